@@ -1,8 +1,8 @@
 import logging
 
 from . import config, data_acquisition, database, utils
-from .fetch import fetch, fetch_atlas_index, fetch_atlas_scores
-from .fetch_surveys import fetch_surveys, get_survey_names
+from .fetch import fetch, fetch_atlas_index, fetch_atlas_scores, iter_fetch
+from .fetch_surveys import fetch_surveys, get_survey_names, iter_fetch_surveys
 
 __all__ = [
     "config",
@@ -13,6 +13,8 @@ __all__ = [
     "fetch_atlas_index",
     "fetch_surveys",
     "get_survey_names",
+    "iter_fetch",
+    "iter_fetch_surveys",
     "utils",
 ]
 
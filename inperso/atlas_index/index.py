@@ -1,23 +1,68 @@
 """Compute the hourly ATLAS index and populate the database."""
 
+import argparse
+import json
 import logging
-from datetime import datetime, timedelta, timezone
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 
 from inperso import config
 from inperso.atlas_index.preprocessing import preprocess_measurements
-from inperso.atlas_index.scores import compute_scores
+from inperso.atlas_index.scores import add_outdoor_daily_sums, compute_scores, write_scores
 from inperso.database.buckets import ensure_bucket_exists
 from inperso.database.delete import delete
+from inperso.database.flux import FluxQuery
 from inperso.database.read import query
-from inperso.database.write import write
+from inperso.database.write import write_data_frame, write_pipeline
+from inperso.tags import dcs as dc_per_device
+from inperso.tags import unit_numbers
+from inperso.utils import iso_to_utc_datetime, utc_datetime_to_iso
+
+# Previous dates whose outdoor temperature is used by the lagged outdoor temperature, and the current one
+N_OUTDOOR_DATES = 4
 
 
 def main():
     """Compute the ATLAS index starting from the latest computed time."""
 
+    parser = argparse.ArgumentParser(description="Compute the ATLAS index and populate the database.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only compute the hours after the latest index of each unit (for frequent runs, e.g. hourly).",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes computing months in parallel (e.g. to recompute the whole index).",
+    )
+    parser.add_argument(
+        "--split-dcs",
+        action="store_true",
+        help="Compute the units of each DC separately, in smaller partitions.",
+    )
+    args = parser.parse_args()
+
+    with write_pipeline():
+        if args.incremental:
+            compute_index_incremental()
+        else:
+            compute_index_since_latest(max_workers=args.processes, split_dcs=args.split_dcs)
+
+
+def compute_index_since_latest(max_workers: int = 1, split_dcs: bool = False) -> None:
+    """Compute the ATLAS index month by month, from the latest computed time until now.
+
+    See `compute_index_partitions` for the arguments.
+    """
+
     datetime_start = get_latest_index_computation_time()
 
     if datetime_start is None:
@@ -29,13 +74,213 @@ def main():
     datetime_end = datetime.now(timezone.utc)
 
     # Chunk computation by month
+    partitions = []
     current_start = datetime_start
     while current_start < datetime_end:
         next_month = (current_start.replace(day=1) + timedelta(days=32)).replace(day=1)
         current_end = min(next_month, datetime_end)
-        compute_index(current_start, current_end)
+        partitions.append((current_start, current_end))
         current_start = current_end
 
+    compute_index_partitions(partitions, max_workers, split_dcs)
+
+
+def compute_index_partitions(
+    partitions: list[tuple[datetime, datetime]],
+    max_workers: int = 1,
+    split_dcs: bool = False,
+) -> None:
+    """Compute the ATLAS index of consecutive time ranges and put the results in the database.
+
+    With max_workers > 1, the partitions are computed by a pool of processes, and their results are written by this
+    process as they complete. If split_dcs is True, each time range is further split by DC.
+    """
+
+    dcs_per_partition = [[dc] for dc in sorted(set(dc_per_device.values()))] if split_dcs else [None]
+    tasks = [(start, end, dcs) for start, end in partitions for dcs in dcs_per_partition]
+
+    if max_workers == 1:
+        for task in tasks:
+            write_scores_and_indices(*compute_partition(*task))
+        return
+
+    # Spawn the workers: forked processes would inherit the locks held by the threads of the writer
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    with executor:
+        futures = [executor.submit(compute_partition, *task) for task in tasks]
+
+        for future in as_completed(futures):
+            write_scores_and_indices(*future.result())
+
+
+def compute_index_incremental(datetime_end: Optional[datetime] = None) -> pd.DataFrame:
+    """Compute the ATLAS index of the complete hours after the latest index of each unit, and write only these.
+
+    The daily outdoor temperatures needed for the lagged outdoor temperature are kept in a local state file (see
+    `config.atlas_index_incremental`), so that only the new measurements are fetched. Without a usable state, the
+    previous days are fetched once. Units further behind the others than "max_unit_lag_days" are not caught up.
+    datetime_end defaults to now, and is truncated to the hour.
+    """
+
+    unit_watermarks = get_unit_watermarks()
+
+    if len(unit_watermarks) == 0:
+        logging.info("No ATLAS index found. Computing it from the start.")
+        compute_index_since_latest()
+        return pd.DataFrame()
+
+    datetime_end = (datetime_end or datetime.now(timezone.utc)).replace(minute=0, second=0, microsecond=0)
+    max_unit_lag = timedelta(days=config.atlas_index_incremental["max_unit_lag_days"])
+    datetime_start = max(min(unit_watermarks.values()), max(unit_watermarks.values()) - max_unit_lag)
+
+    if datetime_start >= datetime_end:
+        logging.info(f"ATLAS index already computed up to {datetime_start}.")
+        return pd.DataFrame()
+
+    datetime_state, outdoor_daily = load_incremental_state()
+
+    # The light percent of an hour is timestamped at its start, unlike the other measurements: it is only complete
+    # after the latest index was computed, which is computed again with one more hour of measurements
+    if is_incremental_state_usable(datetime_state, outdoor_daily, datetime_start):
+        datetime_fetch_start = datetime_start - timedelta(hours=1)
+    else:
+        # Need 3 days to compute lagged outdoor temperature, and 1 more day for off-by-one issues
+        datetime_state, outdoor_daily = None, None
+        datetime_fetch_start = datetime_start - timedelta(days=4)
+
+    logging.info(f"Computing ATLAS index incrementally from {datetime_start} to {datetime_end}")
+    measurements = preprocess_measurements(datetime_fetch_start, datetime_end)
+
+    is_outdoor = measurements["brand"] == "airly"
+    is_new_outdoor = is_outdoor if datetime_state is None else is_outdoor & (measurements["time"] > datetime_state)
+    outdoor_daily = add_outdoor_daily_sums(outdoor_daily, measurements[is_new_outdoor])
+
+    unit_starts = {unit_number: max(watermark, datetime_start) for unit_number, watermark in unit_watermarks.items()}
+    unit_starts = pd.to_datetime(
+        measurements["device"].astype(object).map(unit_numbers).map(unit_starts), utc=True
+    ).fillna(pd.Timestamp(datetime_start))
+    is_new_indoor = ~is_outdoor & (measurements["time"] >= unit_starts)
+    measurements = measurements[is_new_indoor].reset_index(drop=True)
+
+    indices = pd.DataFrame()
+    if measurements.empty:
+        logging.info("No new measurements found.")
+    else:
+        indices = compute_index_from_measurements(measurements, outdoor_daily)
+
+    save_incremental_state(datetime_end, outdoor_daily)
+
+    return indices
+
+
+def get_unit_watermarks() -> dict[str, datetime]:
+    """Get the most recent datetime for which the ATLAS index has been computed, for each unit."""
+
+    bucket_name = config.db["bucket_atlas_index"]
+    ensure_bucket_exists(bucket_name)
+    clean_outdated_index_data()
+
+    flux_query = (
+        FluxQuery(bucket_name)
+        .filter("_measurement", ["index"])
+        .pipe(
+            "last()",
+            'keep(columns: ["_time", "unit_number"])',
+            'group(columns: ["unit_number"])',
+            'sort(columns: ["_time"])',
+            'last(column: "_time")',
+        )
+    )
+    result = query(str(flux_query))
+
+    if result is None:
+        return {}
+
+    unit_watermarks = {}
+    for table in result:
+        record = table.records[0]
+        if record["unit_number"] is not None:
+            unit_watermarks[record["unit_number"]] = record.get_time()
+
+    return unit_watermarks
+
+
+def load_incremental_state() -> tuple[Optional[datetime], Optional[pd.DataFrame]]:
+    """Load the end of the measurements of the previous incremental run, and their daily outdoor temperature sums.
+
+    Returns (None, None) if there is no state, or if it was computed with another ATLAS index configuration.
+    """
+
+    path = os.path.expanduser(config.atlas_index_incremental["state_path"])
+
+    if not os.path.exists(path):
+        return None, None
+
+    with open(path, "r") as f:
+        state = json.load(f)
+
+    if state.get("atlas_index_hash") != config.atlas_index_hash:
+        return None, None
+
+    outdoor_daily = pd.DataFrame(
+        [[date.fromisoformat(date_), sum_, count] for date_, (sum_, count) in state["outdoor_daily"].items()],
+        columns=["date", "sum", "count"],
+    ).set_index("date")
+
+    return iso_to_utc_datetime(state["datetime_end"]), outdoor_daily
+
+
+def is_incremental_state_usable(
+    datetime_state: Optional[datetime],
+    outdoor_daily: Optional[pd.DataFrame],
+    datetime_start: datetime,
+) -> bool:
+    """Whether the state of the previous run is enough to compute the index from datetime_start.
+
+    The previous run must have used the measurements up to datetime_start (the index it computed for a unit may not
+    have been written), and its daily outdoor temperatures must go back to the first date used by the lagged outdoor
+    temperature at datetime_start.
+    """
+
+    if datetime_state is None or outdoor_daily is None or len(outdoor_daily) == 0:
+        return False
+
+    date_first_needed = (datetime_start - timedelta(days=N_OUTDOOR_DATES - 1)).date()
+
+    # The oldest date can be incomplete, if it was the first date fetched
+    if datetime_state < datetime_start - timedelta(hours=1) or outdoor_daily.index.min() >= date_first_needed:
+        logging.info("The incremental state does not go back far enough for all the units. Fetching the previous days.")
+        return False
+
+    return True
+
+
+def save_incremental_state(datetime_end: datetime, outdoor_daily: pd.DataFrame) -> None:
+    """Save the end of the measurements used, and the daily outdoor temperature sums of the last dates.
+
+    The dates of units lagging by up to "max_unit_lag_days" are kept too, and one more date which can be incomplete.
+    """
+
+    path = os.path.expanduser(config.atlas_index_incremental["state_path"])
+    n_dates = N_OUTDOOR_DATES + config.atlas_index_incremental["max_unit_lag_days"] + 1
+    state = {
+        "atlas_index_hash": config.atlas_index_hash,
+        "datetime_end": utc_datetime_to_iso(datetime_end),
+        "outdoor_daily": {
+            date_.isoformat(): [float(row["sum"]), int(row["count"])]
+            for date_, row in outdoor_daily.sort_index().tail(n_dates).iterrows()
+        },
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary_path, "w") as f:
+        json.dump(state, f, indent=2)
+
+    os.replace(temporary_path, path)
+
 
 def get_latest_index_computation_time() -> datetime | None:
     """Get the most recent datetime for which the ATLAS index has been computed."""
@@ -44,13 +289,8 @@ def get_latest_index_computation_time() -> datetime | None:
     ensure_bucket_exists(bucket_name)
     clean_outdated_index_data()
 
-    query_str = (
-        f'from(bucket:"{bucket_name}") '
-        "|> range(start: 0, stop: now()) "
-        f'|> filter(fn: (r) => r["_measurement"] == "index") '
-        "|> last() "
-    )
-    result = query(query_str)
+    flux_query = FluxQuery(bucket_name).filter("_measurement", ["index"]).pipe("last()")
+    result = query(str(flux_query))
 
     if result is None or len(result) == 0:
         return None
@@ -70,8 +310,8 @@ def clean_outdated_index_data():
 def get_earliest_data_time() -> datetime | None:
     """Get the earliest datetime for which data is available in the database."""
 
-    query_str = f'from(bucket:"{config.db["bucket"]}") |> range(start: 0, stop: now()) |> first() '
-    result = query(query_str)
+    flux_query = FluxQuery(config.db["bucket"]).pipe("first()")
+    result = query(str(flux_query))
 
     if result is None or len(result) == 0:
         return None
@@ -82,65 +322,102 @@ def get_earliest_data_time() -> datetime | None:
 def compute_index(datetime_start, datetime_end):
     """Compute the ATLAS index and put the results in the database."""
 
+    scores, indices = compute_partition(datetime_start, datetime_end)
+    write_scores_and_indices(scores, indices)
+
+    return indices
+
+
+def compute_partition(
+    datetime_start: datetime,
+    datetime_end: datetime,
+    dcs: Optional[list[str]] = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Compute the scores and ATLAS index of the hours from datetime_start (included) to datetime_end (excluded).
+
+    Partitions only depend on the database, so that they can be computed in any order or in parallel: the previous
+    days needed for the lagged outdoor temperature are fetched, but their scores are not computed again. If dcs is
+    provided, only compute the units of these DCs.
+    """
+
+    logging.info(f"Computing ATLAS index from {datetime_start} to {datetime_end}" + (f" for DCs {dcs}" if dcs else ""))
+
     # Need 3 days to compute lagged outdoor temperature, and 1 more day for off-by-one issues
-    datetime_start = datetime_start - timedelta(days=4)
+    measurements = preprocess_measurements(datetime_start - timedelta(days=4), datetime_end, dcs)
+
+    is_outdoor = measurements["brand"] == "airly"
+    outdoor_daily = add_outdoor_daily_sums(None, measurements[is_outdoor])
+
+    # Hours are timestamped at their end, except the light percent, timestamped at their start: the first hour of a
+    # partition is only complete with the light percent of the partition
+    is_in_partition = (measurements["time"] >= datetime_start) & (measurements["time"] < datetime_end)
+    measurements = measurements[~is_outdoor & is_in_partition].reset_index(drop=True)
 
-    logging.info(f"Computing ATLAS index from {datetime_start} to {datetime_end}")
-    measurements = preprocess_measurements(datetime_start, datetime_end)
     if measurements.empty:
         logging.info("No measurements found in the given time range.")
-        return pd.DataFrame()
+        return pd.DataFrame(), pd.DataFrame()
+
+    return compute_scores_and_indices(measurements, outdoor_daily)
+
 
-    scores = compute_scores(measurements)
-    scores["score"] = np.log(scores["score"])
+def compute_index_from_measurements(
+    measurements: pd.DataFrame,
+    outdoor_daily: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """Compute the scores and ATLAS index of preprocessed measurements, and put the results in the database."""
+
+    scores, indices = compute_scores_and_indices(measurements, outdoor_daily)
+    write_scores_and_indices(scores, indices)
+
+    return indices
+
+
+def compute_scores_and_indices(
+    measurements: pd.DataFrame,
+    outdoor_daily: Optional[pd.DataFrame] = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Compute the scores and ATLAS index of preprocessed measurements."""
+
+    scores = compute_scores(measurements, outdoor_daily, write_results=False)
+    log_scores = scores.assign(score=np.log(scores["score"]))
 
     fields_per_category = config.atlas_index["index_fields"]
     category_per_field = {field: category for category, fields in fields_per_category.items() for field in fields}
-    scores["category"] = scores["field"].map(category_per_field)
-    indices = scores.groupby(["time", "unit_number", "category"], as_index=False)["score"].mean()
+    log_scores["category"] = log_scores["field"].map(category_per_field)
+    indices = log_scores.groupby(["time", "unit_number", "category"], as_index=False)["score"].mean()
     indices = indices.pivot(index=["time", "unit_number"], columns="category", values="score").reset_index()
 
+    # Partitions can miss whole categories (ex: DCs without light sensors)
     weights = config.atlas_index["weights"]
-    indices["atlas_index"] = indices.apply(
-        lambda row: sum(row[category] * weights[category] for category in weights.keys()), axis=1
-    )
-    for category in list(weights.keys()) + ["atlas_index"]:
-        indices[category] = np.exp(indices[category])
+    indices = indices.reindex(columns=["time", "unit_number"] + list(weights.keys()))
+    categories = list(weights.keys())
+    indices["atlas_index"] = indices[categories].to_numpy(dtype=float) @ np.array(list(weights.values()))
+    indices[categories + ["atlas_index"]] = np.exp(indices[categories + ["atlas_index"]])
 
-    write_indices(indices)
+    return scores, indices
 
-    return indices
+
+def write_scores_and_indices(scores: pd.DataFrame, indices: pd.DataFrame) -> None:
+    if len(scores) > 0:
+        write_scores(scores)
+
+    if len(indices) > 0:
+        write_indices(indices)
 
 
 def write_indices(df: pd.DataFrame) -> None:
     """Write the computed indices to the database."""
 
-    queries = []
-
-    for _, row in df.iterrows():
-        time = row["time"]
-        unit_number = row["unit_number"]
-
-        fields = {
-            category: row[category]
-            for category in df.columns
-            if category not in ["time", "unit_number"] and not pd.isna(row[category])
-        }
-
-        queries.append(
-            {
-                "measurement": "index",
-                "tags": {
-                    "unit_number": str(unit_number),
-                    "atlas_index_hash": config.atlas_index_hash,
-                },
-                "fields": fields,
-                "time": time,
-            }
-        )
+    df = df.assign(unit_number=df["unit_number"].astype(str))
 
-    logging.info(f"Writing {len(queries)} entries to the database.")
-    write(queries, use_atlas_index_bucket=True)
+    write_data_frame(
+        df,
+        "index",
+        field_columns=[column for column in df.columns if column not in ["time", "unit_number"]],
+        tag_columns=["unit_number"],
+        tags={"atlas_index_hash": config.atlas_index_hash},
+        use_atlas_index_bucket=True,
+    )
 
 
 if __name__ == "__main__":
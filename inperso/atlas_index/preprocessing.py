@@ -1,79 +1,186 @@
 from datetime import datetime
+from typing import Optional
 
+import numpy as np
 import pandas as pd
 
 from inperso import config
+from inperso.database.flux import FluxQuery
+from inperso.database.read import query_data_frame
 from inperso.fetch import fetch
+from inperso.tags import dcs as dc_per_device
+from inperso.tags import tags
 
 DATAFRAME_COLUMNS = ["time", "brand", "device", "field", "value"]
 
+# Fields rewritten by `remap_fields`, and their original field
+REMAPPED_FIELDS = {
+    "sla_day": "sla",
+    "sla_night": "sla",
+    "temperature_heating": "temperature",
+    "temperature_cooling_nat": "temperature",
+    "temperature_cooling_mec": "temperature",
+}
 
-def preprocess_measurements(datetime_start: datetime, datetime_end: datetime) -> pd.DataFrame:
-    """Retrieve and preprocess the measurements from the database."""
 
-    data = fetch(
+def preprocess_measurements(
+    datetime_start: datetime,
+    datetime_end: datetime,
+    dcs: Optional[list[str]] = None,
+) -> pd.DataFrame:
+    """Retrieve and preprocess the measurements from the database.
+
+    If dcs is provided, only retrieve the indoor measurements of these DCs. The outdoor measurements of all DCs are
+    retrieved, as they are all used for the outdoor temperature.
+    """
+
+    df = fetch(
         datetime_start=datetime_start,
         datetime_end=datetime_end,
         frequency="1h",
-        window_size="1h",
+        aggregate="mean",
+        output="dataframe",
+        **_get_dc_filter(dcs),
     )
 
-    if len(data) == 0:
+    if dcs is not None:
+        df_outdoor = fetch(
+            datetime_start=datetime_start,
+            datetime_end=datetime_end,
+            frequency="1h",
+            aggregate="mean",
+            brands=["airly"],
+            output="dataframe",
+        )
+        df = pd.concat([df[df["brand"] != "airly"], df_outdoor], ignore_index=True)
+
+    if len(df) == 0:
         return pd.DataFrame(columns=DATAFRAME_COLUMNS)
 
-    df = pd.DataFrame(data)
-    df = convert_units(df)
-    df = compute_light_percent(datetime_start, datetime_end, df)
-    df = compute_sla(df)
+    df = compute_light_percent(datetime_start, datetime_end, df, dcs)
+    df = remap_fields(df)
 
     return df
 
 
-def convert_units(df: pd.DataFrame) -> pd.DataFrame:
-    unit_conversion_factors = config.atlas_index["unit_conversion_factors"]
+def remap_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the units, and split the SLA and indoor temperature fields, in a single vectorized pass.
 
-    for brand, field_factors in unit_conversion_factors.items():
-        for field, factor in field_factors.items():
-            mask = (df["brand"] == brand) & (df["field"] == field)
-            df.loc[mask, "value"] = df.loc[mask, "value"] * factor
+    - SLA fields become "sla_day" or "sla_night", depending on the hour.
+    - Indoor temperature fields become "temperature_heating", "temperature_cooling_nat" or "temperature_cooling_mec",
+      depending on the DC of the device and the month. Temperatures of devices without a configured DC are unchanged.
 
-    return df
+    The "brand" and "field" columns are converted to categoricals, whose codes index lookup arrays of the conversion
+    factors and new fields (see `_get_remapping_arrays`).
+    """
 
+    brand = pd.Categorical(df["brand"])
+    field = pd.Categorical(df["field"])
+    dc = pd.Categorical(df["device"].astype(object).map(dc_per_device))
 
-def compute_light_percent(datetime_start: datetime, datetime_end: datetime, df: pd.DataFrame) -> pd.DataFrame:
-    config_light_percent = config.atlas_index["light_percent"]
-    day_start_hour = config_light_percent["day_start_hour"]
-    day_threshold = config_light_percent["day_threshold"]
-    night_start_hour = config_light_percent["night_start_hour"]
-    night_threshold = config_light_percent["night_threshold"]
+    time = pd.to_datetime(df["time"])
+    hour = time.dt.hour.to_numpy()
+    month_index = time.dt.month.to_numpy() - 1
+    is_sla_day = (hour >= config.atlas_index["sla"]["day_start_hour"]) & (
+        hour < config.atlas_index["sla"]["night_start_hour"]
+    )
 
-    data = fetch(
-        datetime_start=datetime_start,
-        datetime_end=datetime_end,
-        brands=["uhoo"],
-        fields=["light"],
+    factors, field_codes, fields = _get_remapping_arrays(
+        list(brand.categories), list(field.categories), list(dc.categories)
     )
 
-    if len(data) == 0:
+    df["brand"] = brand
+    df["value"] = df["value"].to_numpy(dtype=float) * factors[brand.codes, field.codes]
+    df["field"] = pd.Categorical.from_codes(
+        field_codes[brand.codes, field.codes, dc.codes, month_index, is_sla_day.astype(int)], categories=fields
+    )
+
+    return df
+
+
+def _get_remapping_arrays(
+    brands: list[str],
+    fields: list[str],
+    dcs: list[str],
+) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """Get the lookup arrays of `remap_fields`, and the categories of the new field codes.
+
+    - factors[brand, field]: unit conversion factor.
+    - field_codes[brand, field, dc, month - 1, is_sla_day]: code of the new field.
+
+    The arrays have one more element in each category dimension, for missing values (code -1).
+    """
+
+    unit_conversion_factors = config.atlas_index["unit_conversion_factors"]
+    config_temperature = config.atlas_index["temperature"]
+    indoor_brands = config.atlas_index["fields"].keys()
+
+    new_fields = fields + [field for field in REMAPPED_FIELDS if field not in fields]
+    new_field_codes = {field: code for code, field in enumerate(new_fields)}
+
+    factors = np.ones((len(brands) + 1, len(fields) + 1))
+    field_codes = np.empty((len(brands) + 1, len(fields) + 1, len(dcs) + 1, 12, 2), dtype=int)
+    field_codes[...] = np.append(np.arange(len(fields)), -1)[None, :, None, None, None]
+
+    for i, brand in enumerate(brands):
+        for j, field in enumerate(fields):
+            factors[i, j] = unit_conversion_factors.get(brand, {}).get(field, 1.0)
+
+            if field == "sla":
+                field_codes[i, j, :, :, 0] = new_field_codes["sla_night"]
+                field_codes[i, j, :, :, 1] = new_field_codes["sla_day"]
+
+            if field != "temperature" or brand not in indoor_brands:
+                continue
+
+            for k, dc in enumerate(dcs):
+                for month in range(1, 13):
+                    if dc in config_temperature["month_heating_start"] and (
+                        month >= config_temperature["month_heating_start"][dc]
+                        or month <= config_temperature["month_heating_end"][dc]
+                    ):
+                        field_codes[i, j, k, month - 1, :] = new_field_codes["temperature_heating"]
+
+                    elif dc in config_temperature["cooling_is_nat"]:
+                        is_nat = config_temperature["cooling_is_nat"][dc]
+                        new_field = "temperature_cooling_nat" if is_nat else "temperature_cooling_mec"
+                        field_codes[i, j, k, month - 1, :] = new_field_codes[new_field]
+
+    return factors, field_codes, new_fields
+
+
+def compute_light_percent(
+    datetime_start: datetime,
+    datetime_end: datetime,
+    df: pd.DataFrame,
+    dcs: Optional[list[str]] = None,
+    server_side: bool = True,
+) -> pd.DataFrame:
+    """Add the hourly percentage of uHoo light measurements above the day or night threshold, timestamped at the start
+    of each hour.
+
+    The percentages are computed by the database, which only returns one value per hour and device. If server_side is
+    False, the light measurements are fetched instead, and the percentages computed locally.
+    """
+
+    if server_side:
+        df_light_percent = fetch_light_percent(datetime_start, datetime_end, dcs)
+    else:
+        df_minute = fetch(
+            datetime_start=datetime_start,
+            datetime_end=datetime_end,
+            brands=["uhoo"],
+            fields=["light"],
+            output="dataframe",
+            **_get_dc_filter(dcs),
+        )
+        df_light_percent = get_light_percent(df_minute)
+
+    if len(df_light_percent) == 0:
         return df
 
-    df_minute = pd.DataFrame(data)
-    df_minute["time"] = df_minute["time"].dt.floor("h")
-    df_minute["hour"] = df_minute["time"].dt.hour
-    df_minute["is_day"] = df_minute["hour"].apply(lambda h: day_start_hour <= h < night_start_hour)
-    df_minute["threshold"] = df_minute["is_day"].apply(lambda is_day: day_threshold if is_day else night_threshold)
-    df_minute["above_threshold"] = df_minute["value"] > df_minute["threshold"]
-
-    df_light_percent = (
-        df_minute.groupby(["time", "device", "is_day"])
-        .agg(value=("above_threshold", lambda x: (x.sum() / len(x)) * 100))
-        .reset_index()
-    )
-    df_light_percent.rename(columns={"hour": "time"}, inplace=True)
     df_light_percent["brand"] = "uhoo"
-    df_light_percent["field"] = df_light_percent["is_day"].apply(
-        lambda is_day: "light_percent_day" if is_day else "light_percent_night"
-    )
+    df_light_percent["field"] = np.where(_is_day(df_light_percent["time"]), "light_percent_day", "light_percent_night")
     df_light_percent = df_light_percent[DATAFRAME_COLUMNS]
 
     df = pd.concat([df, df_light_percent], ignore_index=True)
@@ -81,14 +188,66 @@ def compute_light_percent(datetime_start: datetime, datetime_end: datetime, df:
     return df
 
 
-def compute_sla(df: pd.DataFrame) -> pd.DataFrame:
-    day_start_hour = config.atlas_index["sla"]["day_start_hour"]
-    night_start_hour = config.atlas_index["sla"]["night_start_hour"]
-    hour = df["time"].dt.hour
-    is_day = (hour >= day_start_hour) & (hour < night_start_hour)
-    is_sla = df["field"] == "sla"
+def fetch_light_percent(
+    datetime_start: datetime,
+    datetime_end: datetime,
+    dcs: Optional[list[str]] = None,
+) -> pd.DataFrame:
+    """Fetch the hourly percentage of uHoo light measurements above the threshold, computed by the database.
 
-    df.loc[is_day & is_sla, "field"] = "sla_day"
-    df.loc[~is_day & is_sla, "field"] = "sla_night"
+    Returns a DataFrame with the "time" (start of the hour), "device" and "value" columns.
+    """
 
-    return df
+    config_light_percent = config.atlas_index["light_percent"]
+    hour = f"(int(v: r._time) / {3600 * 10**9}) % 24"  # UTC hour, without importing the "date" package
+    is_day = (
+        f"{hour} >= {config_light_percent['day_start_hour']} and {hour} < {config_light_percent['night_start_hour']}"
+    )
+    threshold = (
+        f"if {is_day} then {float(config_light_percent['day_threshold'])} "
+        f"else {float(config_light_percent['night_threshold'])}"
+    )
+
+    flux_query = (
+        FluxQuery(config.db["bucket"])
+        .range(datetime_start, datetime_end)
+        .filter("_measurement", ["uhoo"])
+        .filter("device", None if dcs is None else sorted({device for dc in dcs for device in tags["DC"][dc]}))
+        .filter("_field", ["light"])
+        .pipe(
+            f"map(fn: (r) => ({{r with _value: if float(v: r._value) > ({threshold}) then 100.0 else 0.0}}))",
+            'aggregateWindow(every: 1h, fn: mean, createEmpty: false, timeSrc: "_start")',
+        )
+        .keep(["_time", "device", "_value"])
+    )
+
+    df = query_data_frame(str(flux_query))
+
+    return df.reindex(columns=["_time", "device", "_value"]).rename(columns={"_time": "time", "_value": "value"})
+
+
+def get_light_percent(df_minute: pd.DataFrame) -> pd.DataFrame:
+    """Compute the hourly percentage of light measurements above the threshold, like `fetch_light_percent`."""
+
+    config_light_percent = config.atlas_index["light_percent"]
+
+    time = df_minute["time"].dt.floor("h")
+    threshold = np.where(_is_day(time), config_light_percent["day_threshold"], config_light_percent["night_threshold"])
+    is_above_threshold = df_minute["value"].to_numpy(dtype=float) > threshold
+
+    df_light_percent = pd.DataFrame({"time": time, "device": df_minute["device"], "value": is_above_threshold * 100.0})
+
+    return df_light_percent.groupby(["time", "device"], observed=True, as_index=False)["value"].mean()
+
+
+def _is_day(time: pd.Series) -> np.ndarray:
+    config_light_percent = config.atlas_index["light_percent"]
+    hour = time.dt.hour.to_numpy()
+
+    return (hour >= config_light_percent["day_start_hour"]) & (hour < config_light_percent["night_start_hour"])
+
+
+def _get_dc_filter(dcs: Optional[list[str]]) -> dict[str, list[str]]:
+    """Get the keyword arguments of `fetch` to only retrieve the measurements of the given DCs, if any."""
+
+    return {} if dcs is None else {"dc": dcs}
@@ -1,103 +1,119 @@
-import logging
+from typing import Optional
 
+import numpy as np
 import pandas as pd
 
 from inperso import config
-from inperso.database.write import write
-from inperso.tags import dcs, unit_numbers
+from inperso.atlas_index.preprocessing import REMAPPED_FIELDS
+from inperso.database.write import write_data_frame
+from inperso.tags import unit_numbers
 
 
-def compute_scores(df: pd.DataFrame) -> pd.DataFrame:
-    """Compute the scores for each measurements and put the results in the database."""
+def compute_scores(
+    df: pd.DataFrame,
+    outdoor_daily: Optional[pd.DataFrame] = None,
+    write_results: bool = True,
+) -> pd.DataFrame:
+    """Compute the scores for each measurements and put the results in the database, unless write_results is False.
+
+    outdoor_daily optionally gives the daily sums of outdoor temperatures (see `compute_outdoor_daily_sums`), used
+    instead of the outdoor temperatures of df.
+    """
 
     df["unit_number"] = df["device"].map(unit_numbers)
 
-    df = compute_temperatures(df)
+    df = compute_temperatures(df, outdoor_daily)
     df = compute_scores_per_measurement(df)
     df = df.groupby(["time", "field", "unit_number"])["score"].mean().reset_index()
 
-    write_scores(df)
+    if write_results:
+        write_scores(df)
 
     return df
 
 
-def compute_temperatures(df: pd.DataFrame) -> pd.DataFrame:
+def compute_temperatures(df: pd.DataFrame, outdoor_daily: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Keep the scored fields of the indoor measurements, and add the lagged outdoor temperature to the naturally
+    cooled temperatures.
+
+    Temperature fields are split into heating and cooling fields by `preprocessing.remap_fields`.
+    """
+
     df["time"] = pd.to_datetime(df["time"])
     df["date"] = df["time"].dt.date
-    df["hour"] = df["time"].dt.hour
 
-    airly_hourly = df[df["brand"] == "airly"]
-    airthings_hourly = df[df["brand"] == "airthings"]
-    uhoo_hourly = df[df["brand"] == "uhoo"]
+    outdoor_lagged = compute_outdoor_temperature(df[df["brand"] == "airly"], outdoor_daily)
 
-    outdoor_lagged = compute_outdoor_temperature(airly_hourly)
-    airthings_hourly = compute_temperature(airthings_hourly, outdoor_lagged, "airthings")
-    uhoo_hourly = compute_temperature(uhoo_hourly, outdoor_lagged, "uhoo")
-
-    df = pd.concat([airthings_hourly, uhoo_hourly], ignore_index=True)
+    df = df[_is_scored_field(df)]
+    df = compute_temperature_cooling_nat(df, outdoor_lagged)
     df = df[df["field"] != "temperature"]
-    df = df.drop(columns=["date", "hour", "t_rm"], errors="ignore")
+    df = df.drop(columns=["date", "t_rm"], errors="ignore")
 
     return df
 
 
-def compute_outdoor_temperature(airly_hourly: pd.DataFrame) -> pd.DataFrame:
-    airly_hourly = airly_hourly[airly_hourly["field"] == "temperature"]
-    outdoor_daily_avg = airly_hourly.groupby("date")["value"].mean().rename("temperature_outdoor")
+def _is_scored_field(df: pd.DataFrame) -> np.ndarray:
+    """Whether each measurement is of a field scored for its brand (see `config.atlas_index["fields"]`)."""
 
-    outdoor_lagged = pd.DataFrame({"date": outdoor_daily_avg.index})
-    outdoor_lagged["outdoor_avg_prev1"] = outdoor_daily_avg.shift(1).values
-    outdoor_lagged["outdoor_avg_prev2"] = outdoor_daily_avg.shift(2).values
-    outdoor_lagged["outdoor_avg_prev3"] = outdoor_daily_avg.shift(3).values
+    brand = pd.Categorical(df["brand"])
+    field = pd.Categorical(df["field"])
+    fields_per_brand = config.atlas_index["fields"]
 
-    alpha = config.atlas_index["temperature"]["alpha_lagged_outdoor"]
-    outdoor_lagged["t_rm"] = (1 - alpha) * (
-        outdoor_lagged["outdoor_avg_prev1"]
-        + alpha * outdoor_lagged["outdoor_avg_prev2"]
-        + alpha**2 * outdoor_lagged["outdoor_avg_prev3"]
-    )
+    # One more element in each dimension for missing values (code -1)
+    is_scored = np.zeros((len(brand.categories) + 1, len(field.categories) + 1), dtype=bool)
+    for i, brand_name in enumerate(brand.categories):
+        brand_fields = fields_per_brand.get(brand_name, [])
+        for j, field_name in enumerate(field.categories):
+            is_scored[i, j] = field_name in brand_fields or REMAPPED_FIELDS.get(field_name) in brand_fields
 
-    return outdoor_lagged
+    return is_scored[brand.codes, field.codes]
 
 
-def compute_temperature(df_hourly: pd.DataFrame, outdoor_lagged: pd.DataFrame, brand: str) -> pd.DataFrame:
-    df_hourly = df_hourly[df_hourly["field"].isin(config.atlas_index["fields"][brand])]
-    df_hourly["month"] = df_hourly["time"].dt.month
-    df_hourly["dc"] = df_hourly["device"].map(dcs)
+def compute_outdoor_daily_sums(airly_hourly: pd.DataFrame) -> pd.DataFrame:
+    """Get the sum and count of the outdoor temperatures of each date, from which daily means are computed.
 
-    df_hourly = compute_temperature_heating(df_hourly)
-    df_hourly = compute_temperature_cooling_mec(df_hourly)
-    df_hourly = compute_temperature_cooling_nat(df_hourly, outdoor_lagged)
+    Unlike means, sums from consecutive time ranges can be added (see `add_outdoor_daily_sums`).
+    """
 
-    df_hourly = df_hourly.drop(columns=["month", "dc"])
-    return df_hourly
+    airly_hourly = airly_hourly[airly_hourly["field"] == "temperature"]
+    dates = pd.to_datetime(airly_hourly["time"]).dt.date.rename("date")
 
+    return airly_hourly["value"].astype(float).groupby(dates).agg(["sum", "count"])
 
-def compute_temperature_heating(df_hourly: pd.DataFrame) -> pd.DataFrame:
-    month_heating_start = config.atlas_index["temperature"]["month_heating_start"]
-    month_heating_end = config.atlas_index["temperature"]["month_heating_end"]
 
-    for dc in month_heating_start.keys():
-        is_heating = (
-            (df_hourly["field"] == "temperature")
-            & (df_hourly["dc"] == dc)
-            & ((df_hourly["month"] >= month_heating_start[dc]) | (df_hourly["month"] <= month_heating_end[dc]))
-        )
-        df_hourly.loc[is_heating, "field"] = "temperature_heating"
+def add_outdoor_daily_sums(outdoor_daily: Optional[pd.DataFrame], airly_hourly: pd.DataFrame) -> pd.DataFrame:
+    """Add the outdoor temperatures of new measurements to daily sums (see `compute_outdoor_daily_sums`)."""
 
-    return df_hourly
+    new_outdoor_daily = compute_outdoor_daily_sums(airly_hourly)
 
+    if outdoor_daily is None or len(outdoor_daily) == 0:
+        return new_outdoor_daily
 
-def compute_temperature_cooling_mec(df_hourly: pd.DataFrame) -> pd.DataFrame:
-    cooling_is_nat = config.atlas_index["temperature"]["cooling_is_nat"]
+    return pd.concat([outdoor_daily, new_outdoor_daily]).groupby(level=0).sum()
 
-    for dc in cooling_is_nat.keys():
-        is_cooling = (df_hourly["field"] == "temperature") & (df_hourly["dc"] == dc)
-        df_hourly.loc[is_cooling, "field"] = (
-            "temperature_cooling_nat" if cooling_is_nat[dc] else "temperature_cooling_mec"
-        )
 
-    return df_hourly
+def compute_outdoor_temperature(
+    airly_hourly: pd.DataFrame,
+    outdoor_daily: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    if outdoor_daily is None:
+        outdoor_daily = compute_outdoor_daily_sums(airly_hourly)
+
+    outdoor_daily_avg = (outdoor_daily["sum"] / outdoor_daily["count"]).rename("temperature_outdoor")
+
+    outdoor_lagged = pd.DataFrame({"date": outdoor_daily_avg.index})
+    outdoor_lagged["outdoor_avg_prev1"] = outdoor_daily_avg.shift(1).values
+    outdoor_lagged["outdoor_avg_prev2"] = outdoor_daily_avg.shift(2).values
+    outdoor_lagged["outdoor_avg_prev3"] = outdoor_daily_avg.shift(3).values
+
+    alpha = config.atlas_index["temperature"]["alpha_lagged_outdoor"]
+    outdoor_lagged["t_rm"] = (1 - alpha) * (
+        outdoor_lagged["outdoor_avg_prev1"]
+        + alpha * outdoor_lagged["outdoor_avg_prev2"]
+        + alpha**2 * outdoor_lagged["outdoor_avg_prev3"]
+    )
+
+    return outdoor_lagged
 
 
 def compute_temperature_cooling_nat(df_hourly: pd.DataFrame, outdoor_lagged: pd.DataFrame) -> pd.DataFrame:
@@ -116,18 +132,23 @@ def compute_temperature_cooling_nat(df_hourly: pd.DataFrame, outdoor_lagged: pd.
 
 
 def compute_scores_per_measurement(df: pd.DataFrame) -> pd.DataFrame:
+    """Compute the score of each measurement, one vectorized pass per field.
+
+    The scalar functions built by `function_type_map` are kept as the reference implementation.
+    """
+
     thresholds = config.atlas_index["thresholds"]
-    score_functions = {}
+    values = df["value"].to_numpy(dtype=float)
+    scores = np.full(len(df), np.nan)
+    codes, fields = pd.factorize(df["field"])
 
-    for field, params in thresholds.items():
-        function_type = params["type"]
-        build_fn = function_type_map[function_type]
-        score_functions[field] = build_fn(**params)
+    for code, field in enumerate(fields):
+        params = thresholds[field]
+        build_fn = array_function_type_map[params["type"]]
+        mask = codes == code
+        scores[mask] = build_fn(**params)(values[mask])
 
-    df["score"] = df.apply(
-        lambda row: score_functions[row["field"]](row["value"]),
-        axis=1,
-    )
+    df["score"] = scores
 
     return df
 
@@ -203,32 +224,92 @@ def build_fn_range(**kwargs):
     return scale_to_100_range
 
 
-def write_scores(df: pd.DataFrame):
-    """Write the computed scores to the database."""
+def build_array_fn_smaller(**kwargs):
+    """Array version of `build_fn_smaller`, giving the exact same results."""
+
+    high_score = kwargs["high_score"]
+    mid_score = kwargs["mid_score"]
+    low_score = kwargs["low_score"]
+
+    def scale_to_100_smaller(values: np.ndarray) -> np.ndarray:
+        return np.select(
+            [values <= high_score, values == mid_score, values >= low_score, values < mid_score],
+            [100.0, 50.0, 0.0, 100 - ((values - high_score) / (mid_score - high_score)) * 50],
+            default=50 - ((values - mid_score) / (low_score - mid_score)) * 50,
+        )
+
+    return scale_to_100_smaller
+
+
+def build_array_fn_greater(**kwargs):
+    """Array version of `build_fn_greater`, giving the exact same results."""
+
+    high_score = kwargs["high_score"]
+    mid_score = kwargs["mid_score"]
+    low_score = kwargs["low_score"]
+
+    def scale_to_100_greater(values: np.ndarray) -> np.ndarray:
+        return np.select(
+            [values >= high_score, values == mid_score, values <= low_score, values > mid_score],
+            [100.0, 50.0, 0.0, 50 + ((values - mid_score) / (high_score - mid_score)) * 50],
+            default=((values - low_score) / (mid_score - low_score)) * 50,
+        )
+
+    return scale_to_100_greater
+
+
+def build_array_fn_range(**kwargs):
+    """Array version of `build_fn_range`, giving the exact same results."""
 
-    queries = []
-
-    for _, row in df.iterrows():
-        time = row["time"]
-        unit_number = row["unit_number"]
-
-        fields = {}
-        fields[row["field"]] = row["score"]
-
-        queries.append(
-            {
-                "measurement": "score",
-                "tags": {
-                    "unit_number": str(unit_number),
-                    "atlas_index_hash": config.atlas_index_hash,
-                },
-                "fields": fields,
-                "time": time,
-            }
+    high_score_lower = kwargs["high_score_lower"]
+    high_score_upper = kwargs["high_score_upper"]
+    mid_score_lower = kwargs["mid_score_lower"]
+    mid_score_upper = kwargs["mid_score_upper"]
+    low_score_lower = kwargs["low_score_lower"]
+    low_score_upper = kwargs["low_score_upper"]
+
+    def scale_to_100_range(values: np.ndarray) -> np.ndarray:
+        return np.select(
+            [
+                (high_score_lower <= values) & (values <= high_score_upper),
+                (mid_score_lower <= values) & (values < high_score_lower),
+                (mid_score_upper >= values) & (values > high_score_upper),
+                (low_score_lower <= values) & (values < mid_score_lower),
+                (low_score_upper >= values) & (values > mid_score_upper),
+            ],
+            [
+                100.0,
+                50 + (values - mid_score_lower) / (high_score_lower - mid_score_lower) * 50,
+                100 - (values - high_score_upper) / (mid_score_upper - high_score_upper) * 50,
+                (values - low_score_lower) / (mid_score_lower - low_score_lower) * 50,
+                50 - (values - mid_score_upper) / (low_score_upper - mid_score_upper) * 50,
+            ],
+            default=0.0,
         )
 
-    logging.info(f"Writing {len(queries)} entries to the database.")
-    write(queries, use_atlas_index_bucket=True)
+    return scale_to_100_range
+
+
+def write_scores(df: pd.DataFrame):
+    """Write the computed scores to the database."""
+
+    # One point per time and unit, with a field per score
+    df = df.pivot(index=["time", "unit_number"], columns="field", values="score").reset_index()
+    df["unit_number"] = df["unit_number"].astype(str)
+
+    write_data_frame(
+        df,
+        "score",
+        field_columns=[column for column in df.columns if column not in ["time", "unit_number"]],
+        tag_columns=["unit_number"],
+        tags={"atlas_index_hash": config.atlas_index_hash},
+        use_atlas_index_bucket=True,
+    )
 
 
 function_type_map = {"smaller": build_fn_smaller, "greater": build_fn_greater, "range": build_fn_range}
+array_function_type_map = {
+    "smaller": build_array_fn_smaller,
+    "greater": build_array_fn_greater,
+    "range": build_array_fn_range,
+}
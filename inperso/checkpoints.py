@@ -0,0 +1,132 @@
+"""Local record of the time ranges already stored in the database, persisted in a JSON file.
+
+Used to resume interrupted retrievals without querying the database.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Optional
+
+from inperso import config
+from inperso.utils import iso_to_utc_datetime, utc_datetime_to_iso
+
+ALL_KEYS = "*"
+
+
+class CheckpointStore:
+    def __init__(self, path: str) -> None:
+        """Time ranges stored per namespace (ex: retriever name) and key (ex: device name, or "*" for all).
+
+        Overlapping or contiguous ranges are merged. The file is re-read before each operation, and replaced
+        atomically when modified.
+        """
+
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+
+    def add_range(self, namespace: str, datetime_start: datetime, datetime_end: datetime, key: str = ALL_KEYS) -> None:
+        """Record that all data between datetime_start and datetime_end is stored."""
+
+        self.add_ranges(namespace, {key: [(datetime_start, datetime_end)]})
+
+    def add_ranges(self, namespace: str, ranges_per_key: dict[str, list[tuple[datetime, datetime]]]) -> None:
+        """Same as `add_range`, for multiple ranges and keys at once."""
+
+        with self._lock:
+            data = self._load()
+            ranges_per_namespace_key = data.setdefault(namespace, {})
+
+            for key, new_ranges in ranges_per_key.items():
+                ranges = self._parse_ranges(ranges_per_namespace_key.get(key, []))
+                ranges = _merge_ranges(ranges + [(start.replace(microsecond=0), end) for start, end in new_ranges])
+                ranges_per_namespace_key[key] = [
+                    [utc_datetime_to_iso(start), utc_datetime_to_iso(end)] for start, end in ranges
+                ]
+
+            self._save(data)
+
+    def get_ranges(self, namespace: str, key: str = ALL_KEYS) -> list[tuple[datetime, datetime]]:
+        """Get the sorted, non-overlapping stored ranges."""
+
+        with self._lock:
+            data = self._load()
+
+        return self._parse_ranges(data.get(namespace, {}).get(key, []))
+
+    def get_range_end(self, namespace: str, datetime_: datetime, key: str = ALL_KEYS) -> Optional[datetime]:
+        """Get the end of the stored range containing datetime_, if any."""
+
+        for start, end in self.get_ranges(namespace, key):
+            if start <= datetime_ <= end:
+                return end
+
+        return None
+
+    def get_latest(self, namespace: str, key: str = ALL_KEYS) -> Optional[datetime]:
+        """Get the end of the most recent stored range, if any."""
+
+        ranges = self.get_ranges(namespace, key)
+        return ranges[-1][1] if ranges else None
+
+    def get_ranges_per_key(self, namespace: str) -> dict[str, list[tuple[datetime, datetime]]]:
+        """Get the sorted, non-overlapping stored ranges of each key of a namespace."""
+
+        with self._lock:
+            data = self._load()
+
+        return {key: self._parse_ranges(ranges) for key, ranges in data.get(namespace, {}).items()}
+
+    def get_latest_per_key(self, namespace: str) -> dict[str, datetime]:
+        """Get the end of the most recent stored range of each key of a namespace."""
+
+        return {key: ranges[-1][1] for key, ranges in self.get_ranges_per_key(namespace).items() if ranges}
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _save(self, data: dict) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+
+        with open(temporary_path, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+        os.replace(temporary_path, self.path)
+
+    @staticmethod
+    def _parse_ranges(ranges: list[list[str]]) -> list[tuple[datetime, datetime]]:
+        return [(iso_to_utc_datetime(start), iso_to_utc_datetime(end)) for start, end in ranges]
+
+
+def _merge_ranges(ranges: list[tuple[datetime, datetime]]) -> list[tuple[datetime, datetime]]:
+    merged: list[tuple[datetime, datetime]] = []
+
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+_stores: dict[str, CheckpointStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """Get the checkpoint store at the path of the current configuration."""
+
+    path = config.checkpoints["path"]
+
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = CheckpointStore(path)
+
+        return _stores[path]
@@ -70,6 +70,21 @@ airthings = config["airthings"]
 qualtrics = config["qualtrics"]
 uhoo = config["uhoo"]
 
+# Concurrent retrieval of the APIs
+retrieve = config["retrieve"]
+
+# Local checkpoints of stored data
+checkpoints = config["checkpoints"]
+
+# Incremental computation of the ATLAS index
+atlas_index_incremental = config["atlas_index_incremental"]
+
+# Splitting of large queries
+fetch = config["fetch"]
+
+# Local cache of query results
+cache = config["cache"]
+
 # Field names synonyms
 field_synonyms = config["field_synonyms"]
 
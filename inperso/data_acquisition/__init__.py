@@ -1,4 +1,4 @@
-from . import airly, airthings, qualtrics, retrieve, retriever, uhoo
+from . import airly, airthings, credentials, engine, qualtrics, retrieve, retriever, scheduler, sessions, uhoo
 from .airly import AirlyRetriever
 from .airthings import AirthingsRetriever
 from .qualtrics import QualtricsRetriever
@@ -9,10 +9,14 @@ __all__ = [
     "AirlyRetriever",
     "airthings",
     "AirthingsRetriever",
+    "credentials",
+    "engine",
     "qualtrics",
     "QualtricsRetriever",
     "retrieve",
     "retriever",
+    "scheduler",
+    "sessions",
     "uhoo",
     "UhooRetriever",
 ]
@@ -2,10 +2,9 @@ import csv
 import logging
 from datetime import datetime, timedelta, timezone
 
-import requests
-
 from inperso import config
 from inperso.data_acquisition.retriever import Retriever
+from inperso.data_acquisition.sessions import TimeoutSession, get_shared_session
 from inperso.utils import dict_ints_to_floats, iso_to_utc_datetime
 
 api_url = "https://airapi.airly.eu/v2/"
@@ -28,6 +27,10 @@ class AirlyRetriever(Retriever):
     def _fetch_interval(self) -> timedelta:
         return timedelta(hours=config.airly["fetch_interval_hours"])
 
+    @property
+    def _max_concurrent_requests(self) -> int:
+        return config.airly["max_concurrent_installations"]
+
     def _fetch(
         self,
         datetime_start: datetime,
@@ -38,47 +41,52 @@ class AirlyRetriever(Retriever):
         Can only retrieve data for the last 24 hours.
         """
 
-        for installation in self.installation_list:
-            installation_id = installation["id"]
-            city = installation["address"]["city"]
-            latitude = installation["location"]["latitude"]
-            longitude = installation["location"]["longitude"]
-
-            try:
-                logging.info(f"Getting measurements for installation {installation_id} in {city}")
-                measurements = get_measurements(config.airly["api_key"], installation_id)
-            except RuntimeError as e:
-                logging.error(f"Failed to get measurements for installation {installation_id} in {city}: {e}")
-                continue
-
-            for measurement in measurements:
-                sample_datetime_start = measurement["fromDateTime"]
-                sample_datetime_end = measurement["tillDateTime"]
-                midpoint_datetime = get_midpoint_datetime_from_strings(
-                    sample_datetime_start,
-                    sample_datetime_end,
-                )
-                fields = {}
-
-                for value in measurement["values"]:
-                    field_name = value["name"].lower()
-                    field_value = value["value"]
-                    fields[field_name] = field_value
-
-                fields = dict_ints_to_floats(fields)
-                self.add_write_query(
-                    {
-                        "measurement": self._measurement_name,
-                        "tags": {
-                            "device": installation_id,
-                            "location": city,
-                            "latitude": latitude,
-                            "longitude": longitude,
-                        },
-                        "fields": fields,
-                        "time": midpoint_datetime,
-                    }
-                )
+        self._run_concurrently(self._fetch_installation_data, self.installation_list)
+
+    def _fetch_installation_data(self, installation: dict) -> None:
+        """Retrieve the data of the last 24 hours for a single installation."""
+
+        installation_id = installation["id"]
+        city = installation["address"]["city"]
+        latitude = installation["location"]["latitude"]
+        longitude = installation["location"]["longitude"]
+
+        try:
+            logging.info(f"Getting measurements for installation {installation_id} in {city}")
+            measurements = get_measurements(config.airly["api_key"], installation_id)
+        except RuntimeError as e:
+            logging.error(f"Failed to get measurements for installation {installation_id} in {city}: {e}")
+            self._mark_fetch_failed()
+            return
+
+        for measurement in measurements:
+            sample_datetime_start = measurement["fromDateTime"]
+            sample_datetime_end = measurement["tillDateTime"]
+            midpoint_datetime = get_midpoint_datetime_from_strings(
+                sample_datetime_start,
+                sample_datetime_end,
+            )
+            fields = {}
+
+            for value in measurement["values"]:
+                field_name = value["name"].lower()
+                field_value = value["value"]
+                fields[field_name] = field_value
+
+            fields = dict_ints_to_floats(fields)
+            self.add_write_query(
+                {
+                    "measurement": self._measurement_name,
+                    "tags": {
+                        "device": installation_id,
+                        "location": city,
+                        "latitude": latitude,
+                        "longitude": longitude,
+                    },
+                    "fields": fields,
+                    "time": midpoint_datetime,
+                }
+            )
 
     def _fetch_from_file(self, file_path: str) -> None:
         """Retrieve data from a file."""
@@ -161,6 +169,18 @@ class AirlyRetriever(Retriever):
                 )
 
 
+def get_session() -> TimeoutSession:
+    """Get the HTTP session of the Airly API, with a connection for each concurrent installation request."""
+
+    return get_shared_session(
+        "airly",
+        lambda: TimeoutSession(
+            config.airly["request_timeout_seconds"],
+            pool_maxsize=config.airly["max_concurrent_installations"],
+        ),
+    )
+
+
 def get_installation_list(api_key: str, sponsor_name: str) -> list[dict]:
     """Get installations from the Airly API."""
 
@@ -175,7 +195,7 @@ def get_installation_list(api_key: str, sponsor_name: str) -> list[dict]:
         "maxDistanceKM": -1,
         "maxResults": -1,
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = get_session().get(url, headers=headers, params=params)
 
     if response.status_code != 200:
         message = f"Failed to get installations list from Airly API: Response {response.status_code} - {response.text}"
@@ -213,7 +233,7 @@ def get_measurements(api_key: str, installation_id: int) -> list[dict]:
     params = {
         "installationId": installation_id,
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = get_session().get(url, headers=headers, params=params)
 
     if response.status_code != 200:
         message = f"Failed to get measurements from Airly API: Response {response.status_code} - {response.text}"
@@ -1,12 +1,12 @@
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from typing import Optional
 
-import requests
-
 from inperso import config
+from inperso.data_acquisition.credentials import CredentialManager, get_credential_manager, get_response_error
 from inperso.data_acquisition.retriever import Retriever
+from inperso.data_acquisition.scheduler import create_scheduler
+from inperso.data_acquisition.sessions import TimeoutSession, get_shared_session
 from inperso.utils import dict_ints_to_floats, utc_datetime_to_iso
 
 accounts_api_url = "https://accounts-api.airthings.com/v1/"
@@ -22,6 +22,21 @@ class AirthingsRetriever(Retriever):
     def _fetch_interval(self) -> timedelta:
         return timedelta(hours=config.airthings["fetch_interval_hours"])
 
+    @property
+    def _max_concurrent_fragments(self) -> int:
+        return config.airthings["max_concurrent_fragments"]
+
+    @property
+    def _max_concurrent_requests(self) -> int:
+        return config.airthings["max_concurrent_fragments"] * config.airthings["max_concurrent_devices"]
+
+    @property
+    def _tracks_devices(self) -> bool:
+        return True
+
+    def get_device_names(self) -> list[str]:
+        return [device["segment"]["name"] for device in get_credentials().get_device_list()]
+
     def _fetch(
         self,
         datetime_start: datetime,
@@ -29,43 +44,42 @@ class AirthingsRetriever(Retriever):
     ) -> None:
         """Retrieve data from the source."""
 
-        token = get_token(config.airthings["api_id"], config.airthings["api_key"])
-        device_list = get_device_list(token)
+        credentials = get_credentials()
+        device_list = credentials.get_device_list()
         logging.info(f"Found {len(device_list)} Airthings devices.")
 
-        with ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(self._fetch_device_data, token, device, datetime_start, datetime_end)
-                for device in device_list
-            ]
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    logging.error(f"Error fetching device data: {e}")
+        self._run_concurrently(
+            lambda device: self._fetch_device_data(credentials, device, datetime_start, datetime_end),
+            device_list,
+        )
 
     def _fetch_device_data(
         self,
-        token: str,
+        credentials: CredentialManager,
         device: dict,
         datetime_start: datetime,
         datetime_end: datetime,
     ) -> None:
         """Retrieve data for a single device."""
         device_id = device["id"]
+        device_name = device["segment"]["name"]
+
+        datetime_start = self._get_device_fetch_start(device_name, datetime_start)
+        if datetime_start >= datetime_end:
+            return
 
         try:
-            device_data = get_device_samples(
-                access_token=token,
+            device_data = credentials.call(
+                get_device_samples,
                 device_id=device_id,
                 datetime_start=datetime_start,
                 datetime_end=datetime_end,
             )
         except Exception as e:
             logging.error(f"Failed to get data for device {device_id}: {e}")
+            self._mark_fetch_failed()
             return
 
-        device_name = device["segment"]["name"]
         device_type = device["deviceType"]
         device_location = device["location"]["name"]
 
@@ -99,6 +113,44 @@ class AirthingsRetriever(Retriever):
                 }
             )
 
+        self._mark_device_fetched(device_name, datetime_start, datetime_end)
+
+
+def get_session() -> TimeoutSession:
+    """Get the HTTP session of the Airthings API, with a connection for each concurrent device request.
+
+    Requests are sent within the rate limit of `config.airthings["rate_limit"]`, and sent again when throttled.
+    """
+
+    max_concurrency = config.airthings["max_concurrent_fragments"] * config.airthings["max_concurrent_devices"]
+
+    return get_shared_session(
+        "airthings",
+        lambda: TimeoutSession(
+            config.airthings["request_timeout_seconds"],
+            pool_maxsize=max_concurrency,
+            scheduler=create_scheduler(config.airthings, max_concurrency),
+        ),
+    )
+
+
+def get_credentials() -> CredentialManager:
+    """Get the token and device list cache of the configured API client, shared by all the threads."""
+
+    client_id = config.airthings["api_id"]
+    client_secret = config.airthings["api_key"]
+
+    return get_credential_manager(
+        ("airthings", client_id, client_secret),
+        lambda: CredentialManager(
+            request_token=lambda: get_token(client_id, client_secret),
+            token_lifetime_seconds=config.airthings["token_lifetime_seconds"],
+            refresh_margin_seconds=config.airthings["token_refresh_margin_seconds"],
+            request_device_list=get_device_list,
+            device_list_ttl_seconds=config.airthings["device_list_ttl_seconds"],
+        ),
+    )
+
 
 def get_token(client_id: str, client_secret: str) -> str:
     """Get token from Airthings API, valid 2 hours."""
@@ -110,7 +162,7 @@ def get_token(client_id: str, client_secret: str) -> str:
         "client_secret": client_secret,
         "scope": ["read:device"],
     }
-    response = requests.post(url, data=data)
+    response = get_session().post(url, data=data)
 
     if response.status_code != 200:
         message = f"Failed to get token: Response {response.status_code} - {response.text}"
@@ -131,12 +183,12 @@ def get_device_list(access_token: str) -> list[dict]:
 
     url = api_url + "devices"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers)
 
     if response.status_code != 200:
         message = f"Failed to get device list: Response {response.status_code} - {response.text}"
         logging.error(message)
-        raise RuntimeError(message)
+        raise get_response_error(response.status_code, message)
 
     data = response.json()
     device_list = data["devices"]
@@ -208,12 +260,12 @@ def get_device_samples_one_page(
     }
     if cursor is not None:
         params["cursor"] = cursor
-    response = requests.get(url, headers=headers, params=params)
+    response = get_session().get(url, headers=headers, params=params)
 
     if response.status_code != 200:
         message = f"Failed to get device samples: Response {response.status_code} - {response.text}"
         logging.error(message)
-        raise RuntimeError(message)
+        raise get_response_error(response.status_code, message)
 
     data = response.json()
     cursor = data.get("cursor", None)
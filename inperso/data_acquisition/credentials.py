@@ -0,0 +1,125 @@
+"""Cache of the access tokens and device lists of the APIs, shared by the threads of a process.
+
+Tokens are refreshed shortly before they expire, or when the API rejects them (see `AuthenticationError`).
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+AUTHENTICATION_ERROR_STATUS_CODES = [401, 403]
+
+
+class AuthenticationError(RuntimeError):
+    """Raised by the API helpers when an access token is rejected (invalid or expired)."""
+
+
+def get_response_error(status_code: int, message: str) -> RuntimeError:
+    """Get the error to raise for a failed API response: `AuthenticationError` if the token was rejected."""
+
+    if status_code in AUTHENTICATION_ERROR_STATUS_CODES:
+        return AuthenticationError(message)
+
+    return RuntimeError(message)
+
+
+class CredentialManager:
+    def __init__(
+        self,
+        request_token: Callable[[], str],
+        token_lifetime_seconds: float,
+        refresh_margin_seconds: float,
+        request_device_list: Optional[Callable[[str], list]] = None,
+        device_list_ttl_seconds: float = 0,
+    ) -> None:
+        """Access token of an API, requested with `request_token` and valid `token_lifetime_seconds`.
+
+        The token is requested again `refresh_margin_seconds` before it expires. The device list, requested with
+        `request_device_list(token)`, is kept `device_list_ttl_seconds`. Requests are made by one thread at a time, the
+        other threads waiting for their result.
+        """
+
+        self._request_token = request_token
+        self._token_lifetime_seconds = token_lifetime_seconds
+        self._refresh_margin_seconds = refresh_margin_seconds
+        self._request_device_list = request_device_list
+        self._device_list_ttl_seconds = device_list_ttl_seconds
+
+        self._token: Optional[str] = None
+        self._token_expiry = 0.0
+        self._token_lock = threading.Lock()
+
+        self._device_list: Optional[list] = None
+        self._device_list_expiry = 0.0
+        self._device_list_lock = threading.Lock()
+
+    def get_token(self) -> str:
+        """Get the cached token, or request a new one if it is missing or about to expire."""
+
+        with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expiry - self._refresh_margin_seconds:
+                requested_at = time.monotonic()
+                self._token = self._request_token()
+                self._token_expiry = requested_at + self._token_lifetime_seconds
+
+            return self._token
+
+    def invalidate_token(self, token: str) -> None:
+        """Discard a token rejected by the API, unless another thread already replaced it."""
+
+        with self._token_lock:
+            if self._token == token:
+                logging.info("Access token rejected, requesting a new one")
+                self._token = None
+
+    def call(self, function: Callable[..., T], *args, **kwargs) -> T:
+        """Call function(token, *args, **kwargs) with the cached token.
+
+        If the token is rejected (`AuthenticationError`), call it again once with a new token.
+        """
+
+        token = self.get_token()
+
+        try:
+            return function(token, *args, **kwargs)
+
+        except AuthenticationError:
+            self.invalidate_token(token)
+            return function(self.get_token(), *args, **kwargs)
+
+    def get_device_list(self) -> list:
+        """Get the cached device list, or request it if it is missing or older than its time to live."""
+
+        if self._request_device_list is None:
+            raise RuntimeError("No device list request defined for these credentials")
+
+        with self._device_list_lock:
+            if self._device_list is None or time.monotonic() >= self._device_list_expiry:
+                self._device_list = self.call(self._request_device_list)
+                self._device_list_expiry = time.monotonic() + self._device_list_ttl_seconds
+
+            return self._device_list
+
+
+_managers: dict[Hashable, CredentialManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_credential_manager(key: Hashable, create: Callable[[], CredentialManager]) -> CredentialManager:
+    """Get the manager shared by all the threads for key (ex: provider and client ID), created by `create`."""
+
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = create()
+
+        return _managers[key]
+
+
+def clear_credential_managers() -> None:
+    """Forget all the cached tokens and device lists."""
+
+    with _managers_lock:
+        _managers.clear()
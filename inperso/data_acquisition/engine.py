@@ -0,0 +1,119 @@
+"""Event loop running the blocking requests of all the retrievers concurrently, within the limits of each source.
+
+The loop runs in a background thread, so that it can be used from any thread (the workers of a retriever, or a notebook
+already running its own loop). Blocking functions run in the threads of its default executor (`asyncio.to_thread`),
+and the number of functions run at the same time for a source is limited by a semaphore shared by all its fragments.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Iterable, Optional, TypeVar
+
+from inperso import config
+
+T = TypeVar("T")
+
+
+class Engine:
+    def __init__(self, max_threads: int) -> None:
+        """Event loop in a background thread, running blocking functions in up to max_threads threads."""
+
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="inperso-engine")
+        )
+        self._semaphores: dict[tuple[str, int], asyncio.Semaphore] = {}  # Per source and limit, used in the loop only
+
+        self._thread = threading.Thread(target=self._loop.run_forever, name="inperso-engine", daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine in the loop, and wait for its result. Must not be called from the loop itself."""
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def run_concurrently(
+        self,
+        source: str,
+        function: Callable[[T], None],
+        items: Iterable[T],
+        max_concurrency: int,
+    ) -> None:
+        """Call function on each item (ex: device) concurrently, at most max_concurrency at a time for the source.
+
+        The limit is shared by all the calls for the same source (ex: all the fragments fetched by a retriever).
+        Errors are logged, without stopping the other calls.
+        """
+
+        self.run(self._run_concurrently(source, function, list(items), max_concurrency))
+
+    async def call(self, source: str, max_concurrency: int, function: Callable[..., T], *args, **kwargs) -> T:
+        """Call a blocking function in a thread, at most max_concurrency at a time for the source.
+
+        To be awaited in the loop, by the coroutines passed to `run`.
+        """
+
+        semaphore = self._semaphores.setdefault((source, max_concurrency), asyncio.Semaphore(max_concurrency))
+
+        async with semaphore:
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def _run_concurrently(
+        self,
+        source: str,
+        function: Callable[[T], None],
+        items: list[T],
+        max_concurrency: int,
+    ) -> None:
+        async def run_one(item: T) -> None:
+            try:
+                await self.call(source, max_concurrency, function, item)
+            except Exception as e:
+                logging.error(f"Error fetching {source} data: {e}")
+
+        await asyncio.gather(*[run_one(item) for item in items])
+
+    def close(self) -> None:
+        """Stop the loop and its threads."""
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.run_until_complete(self._loop.shutdown_default_executor())
+        self._loop.close()
+
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """Get the process-wide engine, creating it on first use."""
+
+    global _engine
+
+    with _engine_lock:
+        if _engine is None:
+            _engine = Engine(max_threads=config.retrieve["max_threads"])
+
+        return _engine
+
+
+async def run_retrievers(fetches: dict[str, Callable[[], None]]) -> None:
+    """Run the fetch of each source (ex: `lambda: AirlyRetriever().fetch_recent()`) concurrently, logging errors.
+
+    Each fetch runs in its own thread, outside of the executor of the engine: fetches wait for the requests they run in
+    the engine, which would never start if the fetches took all its threads.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    async def run_one(executor: ThreadPoolExecutor, name: str, fetch: Callable[[], None]) -> None:
+        try:
+            await loop.run_in_executor(executor, fetch)
+        except Exception as e:
+            logging.error(f"Failed to fetch and store data from {name.capitalize()}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(len(fetches), 1), thread_name_prefix="inperso-retriever") as executor:
+        await asyncio.gather(*[run_one(executor, name, fetch) for name, fetch in fetches.items()])
@@ -1,19 +1,24 @@
+import asyncio
 import io
 import json
 import logging
 import time
 import zipfile
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Iterator, Optional, TypeVar
 
 import requests
 
 from inperso import config
+from inperso.data_acquisition.engine import get_engine
 from inperso.data_acquisition.retriever import Retriever
+from inperso.data_acquisition.sessions import TimeoutSession, get_shared_session
 from inperso.utils import iso_to_utc_datetime, utc_datetime_to_iso
 
 api_url = "https://eu.qualtrics.com/API/v3/"
 
+T = TypeVar("T")
+
 
 class QualtricsRetriever(Retriever):
     @property
@@ -24,58 +29,142 @@ class QualtricsRetriever(Retriever):
     def _fetch_interval(self) -> timedelta:
         return timedelta(hours=config.qualtrics["fetch_interval_hours"])
 
+    @property
+    def _max_concurrent_requests(self) -> int:
+        return config.qualtrics["max_concurrent_surveys"]
+
     def _fetch(
         self,
         datetime_start: datetime,
         datetime_end: datetime,
     ) -> None:
-        """Retrieve data from the source."""
+        """Retrieve data from the source.
+
+        The response exports of all the surveys are requested up front, polled concurrently, and each is downloaded
+        as soon as it is complete.
+        """
 
         survey_list = get_survey_list(config.qualtrics["api_key"])
         logging.info(f"Found {len(survey_list)} Qualtrics surveys")
 
-        for survey in survey_list:
-            survey_id = survey["id"]
-            survey_name = survey["name"]
-
-            try:
-                responses = get_responses(
-                    api_key=config.qualtrics["api_key"],
-                    survey_id=survey_id,
-                    datetime_start=datetime_start,
-                    datetime_end=datetime_end,
-                )
-            except RuntimeError as e:
-                logging.error(f"Failed to get responses for survey {survey_id}: {e}")
-                continue
-
-            logging.info(f'Got {len(responses)} responses for survey "{survey_name}"')
-
-            for response in responses:
-                response_id = response["responseId"]
-                data = response["values"]
-                date = iso_to_utc_datetime(data["recordedDate"])
-                answers = parse_answers(data)
-
-                tags = {
-                    "survey": survey_name,
-                    "response_id": response_id,
+        if config.qualtrics["skip_closed_surveys"]:
+            survey_list = [survey for survey in survey_list if not is_survey_closed_before(survey, datetime_start)]
+            logging.info(f"{len(survey_list)} Qualtrics surveys may have responses since {datetime_start}")
+
+        get_engine().run(self._fetch_surveys_responses(survey_list, datetime_start, datetime_end))
+
+    async def _fetch_surveys_responses(
+        self,
+        survey_list: list[dict],
+        datetime_start: datetime,
+        datetime_end: datetime,
+    ) -> None:
+        # All the exports are requested before any is polled, so that the server prepares them concurrently
+        progress_ids = await asyncio.gather(
+            *[self._request_export(survey, datetime_start, datetime_end) for survey in survey_list]
+        )
+
+        await asyncio.gather(
+            *[
+                self._fetch_export(survey, progress_id)
+                for survey, progress_id in zip(survey_list, progress_ids)
+                if progress_id is not None
+            ]
+        )
+
+    async def _request_export(self, survey: dict, datetime_start: datetime, datetime_end: datetime) -> Optional[str]:
+        """Request the response export of a survey, and return its progress ID (None if the request failed)."""
+
+        survey_id = survey["id"]
+
+        try:
+            progress_id = await self._call(
+                request_response_export, config.qualtrics["api_key"], survey_id, datetime_start, datetime_end
+            )
+        except (RuntimeError, requests.RequestException) as e:
+            logging.error(f"Failed to get responses for survey {survey_id}: {e}")
+            self._mark_fetch_failed()
+            return None
+
+        logging.info(f"Response export requested for survey {survey_id}. Progress ID: {progress_id}")
+        return progress_id
+
+    async def _fetch_export(self, survey: dict, progress_id: str) -> None:
+        """Wait for the response export of a survey without blocking the other surveys, then download it."""
+
+        api_key = config.qualtrics["api_key"]
+        survey_id = survey["id"]
+
+        try:
+            file_id = await self._call(get_response_export_file_id, api_key, survey_id, progress_id)
+
+            for delay in get_polling_delays():
+                if file_id is not None:
+                    break
+
+                await asyncio.sleep(delay)
+                file_id = await self._call(get_response_export_file_id, api_key, survey_id, progress_id)
+
+            if file_id is None:
+                logging.error(f"Could not get responses for survey {survey_id} from Qualtrics API: Timeout")
+                self._mark_fetch_failed()
+                return
+
+            responses = await self._call(get_response_export, api_key, survey_id, file_id)
+
+        except (RuntimeError, requests.RequestException) as e:
+            logging.error(f"Failed to get responses for survey {survey_id}: {e}")
+            self._mark_fetch_failed()
+            return
+
+        # Adding queries can block while the database writer catches up, so it is not done in the loop
+        await asyncio.to_thread(self._add_responses, survey["name"], responses)
+
+    async def _call(self, function: Callable[..., T], *args) -> T:
+        """Call a blocking request function in the engine, within `_max_concurrent_requests`."""
+
+        return await get_engine().call(self._measurement_name, self._max_concurrent_requests, function, *args)
+
+    def _add_responses(self, survey_name: str, responses: list[dict]) -> None:
+        logging.info(f'Got {len(responses)} responses for survey "{survey_name}"')
+
+        for response in responses:
+            response_id = response["responseId"]
+            data = response["values"]
+            date = iso_to_utc_datetime(data["recordedDate"])
+            answers = parse_answers(data)
+
+            tags = {
+                "survey": survey_name,
+                "response_id": response_id,
+            }
+
+            if "locationLatitude" in data:
+                tags["latitude"] = float(data["locationLatitude"])
+
+            if "locationLongitude" in data:
+                tags["longitude"] = float(data["locationLongitude"])
+
+            self.add_write_query(
+                {
+                    "measurement": self._measurement_name,
+                    "tags": tags,
+                    "fields": answers,
+                    "time": date,
                 }
+            )
 
-                if "locationLatitude" in data:
-                    tags["latitude"] = float(data["locationLatitude"])
 
-                if "locationLongitude" in data:
-                    tags["longitude"] = float(data["locationLongitude"])
+def get_session() -> TimeoutSession:
+    """Get the HTTP session of the Qualtrics API, with a connection for each concurrent survey request."""
 
-                self.add_write_query(
-                    {
-                        "measurement": self._measurement_name,
-                        "tags": tags,
-                        "fields": answers,
-                        "time": date,
-                    }
-                )
+    return get_shared_session(
+        "qualtrics",
+        lambda: TimeoutSession(
+            config.qualtrics["request_timeout_seconds"],
+            pool_maxsize=config.qualtrics["max_concurrent_surveys"],
+        ),
+    )
 
 
 def get_survey_list(api_key: str) -> list[dict]:
@@ -93,7 +182,7 @@ def get_survey_list(api_key: str) -> list[dict]:
     headers = {
         "X-API-TOKEN": api_key,
     }
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers)
 
     if response.status_code != 200:
         message = f"Failed to get list of surveys from Qualtrics API: Response {response.status_code} - {response.text}"
@@ -122,7 +211,7 @@ def get_survey(api_key: str, survey_id: str) -> dict:
     headers = {
         "X-API-TOKEN": api_key,
     }
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers)
 
     if response.status_code != 200:
         message = f"Failed to get survey details from Qualtrics API: Response {response.status_code} - {response.text}"
@@ -165,20 +254,18 @@ def get_responses(
     logging.info(f"Response export requested. Progress ID: {progress_id}")
     logging.info("Polling for response export file...")
 
-    waiting_time = 0
-    file_id = None
+    file_id = get_response_export_file_id(api_key, survey_id, progress_id)
 
-    while True:
-        file_id = get_response_export_file_id(api_key, survey_id, progress_id)
+    for delay in get_polling_delays():
         if file_id is not None:
             break
 
-        if waiting_time >= config.qualtrics["max_wait_get_response"]:
-            logging.error("Could not get responses from Qualtrics API: Timeout")
-            return []
+        time.sleep(delay)
+        file_id = get_response_export_file_id(api_key, survey_id, progress_id)
 
-        time.sleep(config.qualtrics["polling_interval_get_response"])
-        waiting_time += config.qualtrics["polling_interval_get_response"]
+    if file_id is None:
+        logging.error("Could not get responses from Qualtrics API: Timeout")
+        return []
 
     logging.info(f"Response export file ready. File ID: {file_id}")
     logging.info("Downloading response export file...")
@@ -186,6 +273,24 @@ def get_responses(
     return get_response_export(api_key, survey_id, file_id)
 
 
+def get_polling_delays() -> Iterator[float]:
+    """Get the delays between the polls of a response export, in seconds.
+
+    Starts at `polling_interval_get_response` and doubles up to `max_polling_interval_get_response`, until
+    `max_wait_get_response` is reached.
+    """
+
+    delay = config.qualtrics["polling_interval_get_response"]
+    remaining = config.qualtrics["max_wait_get_response"]
+
+    while remaining > 0:
+        delay = min(delay, remaining)
+        yield delay
+
+        remaining -= delay
+        delay = min(2 * delay, config.qualtrics["max_polling_interval_get_response"])
+
+
 def request_response_export(
     api_key: str,
     survey_id: str,
@@ -205,7 +310,7 @@ def request_response_export(
         "startDate": utc_datetime_to_iso(datetime_start),
         "endDate": utc_datetime_to_iso(datetime_end),
     }
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    response = get_session().post(url, headers=headers, data=json.dumps(data))
 
     if response.status_code != 200:
         message = (
@@ -231,7 +336,7 @@ def get_response_export_file_id(
         "Accept": "application/json",
         "X-API-TOKEN": api_key,
     }
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers)
 
     if response.status_code != 200:
         message = f"Failed to get response export progress from Qualtrics API: Response {response.status_code} - {response.text}"
@@ -264,7 +369,7 @@ def get_response_export(
         "Accept": "application/json",
         "X-API-TOKEN": api_key,
     }
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers)
 
     if response.status_code != 200:
         message = (
@@ -286,6 +391,19 @@ def get_response_export(
     return data["responses"]
 
 
+def is_survey_closed_before(survey: dict, datetime_: datetime) -> bool:
+    """Check if a survey from `get_survey_list` is inactive and was last modified before datetime_.
+
+    Such a survey cannot have received responses since datetime_. The modification date of an active survey does not
+    change when it receives responses, so active surveys are never considered closed.
+    """
+
+    if survey.get("isActive", True) or survey.get("lastModified") is None:
+        return False
+
+    return iso_to_utc_datetime(survey["lastModified"]) < datetime_
+
+
 def parse_answers(data: dict) -> dict:
     """Parse answers from a Qualtrics response data dictionary.
 
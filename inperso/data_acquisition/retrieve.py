@@ -5,8 +5,10 @@ import sys
 
 from inperso.data_acquisition.airly import AirlyRetriever
 from inperso.data_acquisition.airthings import AirthingsRetriever
+from inperso.data_acquisition.engine import get_engine, run_retrievers
 from inperso.data_acquisition.qualtrics import QualtricsRetriever
 from inperso.data_acquisition.uhoo import UhooRetriever
+from inperso.database.write import write_pipeline
 
 
 def main():
@@ -17,32 +19,32 @@ def main():
         "uhoo": UhooRetriever,
     }
 
-    if len(sys.argv) == 1:
-        for name, retriever in retrievers.items():
+    with write_pipeline():
+        if len(sys.argv) == 1:
+            # All the sources are fetched concurrently, in the event loop of the engine
+            fetches = {
+                name: lambda retriever=retriever: retriever().fetch_recent() for name, retriever in retrievers.items()
+            }
+            get_engine().run(run_retrievers(fetches))
+
+        elif len(sys.argv) == 2:
+            name = sys.argv[1]
+
+            if name not in retrievers:
+                print(f"retriever-type should be one of {list(retrievers.keys())}")
+                sys.exit(1)
+
+            retriever = retrievers[name]
+
             try:
                 retriever().fetch_recent()
             except Exception as e:
                 logging.error(f"Failed to fetch and store data from {name.capitalize()}: {e}")
-                continue
 
-    elif len(sys.argv) == 2:
-        name = sys.argv[1]
-
-        if name not in retrievers:
-            print(f"retriever-type should be one of {list(retrievers.keys())}")
+        else:
+            print(f"Usage: {sys.argv[0]} [retriever-type]")
             sys.exit(1)
 
-        retriever = retrievers[name]
-
-        try:
-            retriever().fetch_recent()
-        except Exception as e:
-            logging.error(f"Failed to fetch and store data from {name.capitalize()}: {e}")
-
-    else:
-        print(f"Usage: {sys.argv[0]} [retriever-type]")
-        sys.exit(1)
-
 
 if __name__ == "__main__":
     main()
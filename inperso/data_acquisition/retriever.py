@@ -1,17 +1,29 @@
 import logging
+import threading
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Optional, TypeVar
 
 from inperso import config
+from inperso.checkpoints import ALL_KEYS, get_checkpoint_store
+from inperso.data_acquisition.engine import get_engine
+from inperso.database.flux import FluxQuery
 from inperso.database.read import query
-from inperso.database.write import WriteQuery, write
+from inperso.database.write import WriteQuery, flush, get_points_dropped, write
+
+T = TypeVar("T")
 
 
 class Retriever(ABC):
     def __init__(self) -> None:
         """Container for retrieving data from a source and storing it in the database."""
 
-        self._write_queries: list[WriteQuery] = []
+        self._write_queries: list[WriteQuery | bytes] = []
+        self._write_queries_lock = threading.Lock()
+        self._store_lock = threading.Lock()
+        self._fetch_failed = False
 
     @property
     @abstractmethod
@@ -23,18 +35,184 @@ class Retriever(ABC):
     def _fetch_interval(self) -> timedelta:
         """Interval for fetching data from the source."""
 
+    @property
+    def _checkpoint_namespace(self) -> str:
+        """Namespace of the retriever in the local checkpoints, specific to the database and bucket it writes to."""
+
+        return f"{config.db['host']}/{config.db['bucket']}/{self._measurement_name}"
+
+    @property
+    def _tracks_devices(self) -> bool:
+        """Whether `_fetch` fetches each device from its own watermark (see `_get_device_fetch_start`)."""
+
+        return False
+
     def fetch_recent(self) -> None:
-        """Retrieve most recent data and store it in the database."""
+        """Retrieve most recent data and store it in the database.
+
+        Starts from the latest local checkpoint if it is within the time range of a previous call, otherwise from the
+        latest data in the database if it is more recent (the checkpoint may come from a fetch of an older range). For
+        retrievers tracking devices, starts from the device that is the most behind among the devices currently listed
+        by the source, and each device is only fetched from its own watermark. Never starts more than
+        `config.retrieve["max_lookback_hours"]` ago.
+        """
+
+        store = get_checkpoint_store()
+        recent_namespace = f"{self._checkpoint_namespace}/fetch_recent"
+        datetime_start = None
+        device_watermarks = {}
+
+        if self._tracks_devices:
+            device_watermarks = self.get_device_watermarks()
+
+            if len(device_watermarks) > 0:
+                # Removed devices would otherwise hold the start back forever
+                device_names = set(self.get_device_names())
+                device_watermarks = {
+                    device: watermark for device, watermark in device_watermarks.items() if device in device_names
+                }
+
+            if len(device_watermarks) > 0:
+                datetime_start = min(device_watermarks.values())
+
+        if datetime_start is None:
+            datetime_start = store.get_latest(self._checkpoint_namespace)
+
+            if datetime_start is None:
+                datetime_start = self.get_latest_retrieval_datetime()
+            elif store.get_range_end(recent_namespace, datetime_start) is None:
+                datetime_start = max(datetime_start, self.get_latest_retrieval_datetime())
 
-        datetime_start = self.get_latest_retrieval_datetime()
         datetime_end = datetime.now(timezone.utc)
-        self.fetch(datetime_start, datetime_end)
+        datetime_lookback = datetime_end - timedelta(hours=config.retrieve["max_lookback_hours"])
+
+        if datetime_start < datetime_lookback:
+            logging.warning(
+                f"Data for {self._measurement_name} is missing since {datetime_start}, only fetching it from "
+                f"{datetime_lookback}."
+            )
+            datetime_start = datetime_lookback
+
+        store.add_range(recent_namespace, datetime_start, datetime_end)
+        self.fetch(datetime_start, datetime_end, device_watermarks=device_watermarks)
+
+    @property
+    def _max_concurrent_fragments(self) -> int:
+        """Maximum number of fragments of `_fetch_interval` fetched concurrently from the source."""
+
+        return 1
+
+    @property
+    def _max_concurrent_requests(self) -> int:
+        """Maximum number of calls of `_run_concurrently` running at the same time, over all the fragments."""
+
+        return 1
+
+    def _run_concurrently(self, function: Callable[[T], None], items: Iterable[T]) -> None:
+        """Call function on each item (ex: device) concurrently in the engine, within `_max_concurrent_requests`.
+
+        Used by `_fetch`. Errors are logged, without stopping the other calls.
+        """
+
+        def run(item: T) -> None:
+            try:
+                function(item)
+            except Exception:
+                self._mark_fetch_failed()
+                raise
 
-    def fetch(self, datetime_start: datetime, datetime_end: datetime) -> None:
-        """Retrieve data from the source and store it in the database."""
+        get_engine().run_concurrently(self._measurement_name, run, items, self._max_concurrent_requests)
+
+    def fetch(
+        self,
+        datetime_start: datetime,
+        datetime_end: datetime,
+        resume: bool = False,
+        device_watermarks: Optional[dict[str, datetime]] = None,
+    ) -> None:
+        """Retrieve data from the source and store it in the database.
+
+        Fragments of `_fetch_interval` are fetched by a pool of `_max_concurrent_fragments` workers, while the
+        fragments already fetched are being written. Progress is recorded in order in the local checkpoints: a
+        fragment is only marked as stored once it and all the previous fragments are written. Once some data could not
+        be fetched (see `_mark_fetch_failed`) or written, the following fragments are no longer marked as stored, only
+        the ranges of the devices fully fetched since (unless the writer dropped points since the previous checkpoint).
+
+        If resume is True, skip the beginning of the time range already marked as stored by a previous run, and for
+        retrievers tracking devices, the ranges already marked as stored for each device.
+        device_watermarks optionally gives, per device, the datetime before which its data is not fetched.
+        """
+
+        store = get_checkpoint_store()
+
+        if resume:
+            datetime_stored = store.get_range_end(self._checkpoint_namespace, datetime_start)
+
+            if datetime_stored is not None and datetime_stored > datetime_start:
+                logging.info(f"Data for {self._measurement_name} already stored up to {datetime_stored}. Resuming.")
+                datetime_start = min(datetime_stored, datetime_end)
 
         logging.info(f"Will fetch data for {self._measurement_name} from {datetime_start} to {datetime_end}.")
 
+        self._device_watermarks = device_watermarks or {}
+        self._device_stored_ranges = store.get_ranges_per_key(self._checkpoint_namespace) if resume else {}
+        self._fetched_device_ranges: dict[str, list[tuple[datetime, datetime]]] = {}
+        self._fetched_device_ranges_lock = threading.Lock()
+        self._fetch_failed = False
+        datetime_checkpoint: Optional[datetime] = datetime_start  # None once a range could not be fully stored
+        points_dropped = get_points_dropped()
+
+        fragments = self._get_fragments(datetime_start, datetime_end)
+        executor = ThreadPoolExecutor(max_workers=self._max_concurrent_fragments)
+        futures = [executor.submit(self._fetch_fragment, *fragment) for fragment in fragments]
+        last_flush_time = time.monotonic()
+
+        try:
+            for i, (fragment, future) in enumerate(zip(fragments, futures)):
+                future.result()
+
+                # Wait for the writes regularly only, to keep write batches large
+                is_last_fragment = i == len(fragments) - 1
+                if (
+                    not is_last_fragment
+                    and time.monotonic() - last_flush_time < config.db["write_flush_interval_seconds"]
+                ):
+                    self._store()
+                    continue
+
+                # Devices marked as fetched before storing have all their queries in the stored buffer
+                device_ranges = self._pop_fetched_device_ranges()
+                self._store()
+                flush()
+                last_flush_time = time.monotonic()
+
+                n_points_dropped = get_points_dropped() - points_dropped
+                points_dropped += n_points_dropped
+
+                if n_points_dropped > 0:
+                    logging.error(f"{n_points_dropped} points could not be written, not marking them as stored.")
+                    device_ranges = {}
+
+                if datetime_checkpoint is not None and (n_points_dropped > 0 or self._fetch_failed):
+                    logging.warning(
+                        f"Data for {self._measurement_name} after {datetime_checkpoint} is not marked as stored, "
+                        "some of it could not be fetched or written."
+                    )
+                    datetime_checkpoint = None
+
+                if datetime_checkpoint is not None:
+                    datetime_checkpoint = fragment[1]
+                    self._on_range_stored(datetime_start, datetime_checkpoint, device_ranges)
+                elif len(device_ranges) > 0:
+                    store.add_ranges(self._checkpoint_namespace, device_ranges)
+
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def _get_fragments(self, datetime_start: datetime, datetime_end: datetime) -> list[tuple[datetime, datetime]]:
+        """Split a time range into consecutive fragments of `_fetch_interval`."""
+
+        fragments = []
         n_fragments = (datetime_end - datetime_start) // self._fetch_interval
 
         for i in range(n_fragments + 1):
@@ -44,32 +222,86 @@ class Retriever(ABC):
             if datetime_start_fragment.replace(microsecond=0) >= datetime_end_fragment.replace(microsecond=0):
                 break
 
-            logging.info(
-                f"Fetching data for {self._measurement_name} from {datetime_start_fragment} to {datetime_end_fragment}."
-            )
+            fragments.append((datetime_start_fragment, datetime_end_fragment))
 
-            self._fetch(
-                datetime_start=datetime_start_fragment,
-                datetime_end=datetime_end_fragment,
-            )
-            self._store()
+        return fragments
+
+    def _fetch_fragment(self, datetime_start: datetime, datetime_end: datetime) -> None:
+        logging.info(f"Fetching data for {self._measurement_name} from {datetime_start} to {datetime_end}.")
+
+        self._fetch(
+            datetime_start=datetime_start,
+            datetime_end=datetime_end,
+        )
+
+    def _on_range_stored(
+        self,
+        datetime_start: datetime,
+        datetime_end: datetime,
+        device_ranges: dict[str, list[tuple[datetime, datetime]]],
+    ) -> None:
+        """Called in order when all data from the start of a fetch up to the end of a fragment is written.
+
+        device_ranges contains the ranges of each device written since the previous call.
+        """
+
+        logging.info(f"Stored data for {self._measurement_name} up to {datetime_end}.")
+        store = get_checkpoint_store()
+        store.add_range(self._checkpoint_namespace, datetime_start, datetime_end)
+
+        if len(device_ranges) > 0:
+            store.add_ranges(self._checkpoint_namespace, device_ranges)
+
+    def _get_device_fetch_start(self, device: str, datetime_start: datetime) -> datetime:
+        """Get the start of the missing data of a device, in a fragment starting at datetime_start.
+
+        Used by the `_fetch` of retrievers tracking devices. The result can be after the end of the fragment.
+        """
+
+        datetime_start = max(datetime_start, self._device_watermarks.get(device, datetime_start))
+
+        for start, end in self._device_stored_ranges.get(device, []):
+            if start <= datetime_start <= end:
+                datetime_start = end
+
+        return datetime_start
+
+    def _mark_device_fetched(self, device: str, datetime_start: datetime, datetime_end: datetime) -> None:
+        """Record that all the data of a device in a time range was added with `add_write_query`.
+
+        Used by the `_fetch` of retrievers tracking devices. The range is saved in the checkpoints once written.
+        """
+
+        with self._fetched_device_ranges_lock:
+            self._fetched_device_ranges.setdefault(device, []).append((datetime_start, datetime_end))
+
+    def _mark_fetch_failed(self) -> None:
+        """Record that some data of the current fetch could not be retrieved (ex: a device request failed).
+
+        Used by `_fetch` when an error is logged instead of raised. The time range is no longer marked as stored, so
+        that it is fetched again when resuming.
+        """
+
+        self._fetch_failed = True
+
+    def _pop_fetched_device_ranges(self) -> dict[str, list[tuple[datetime, datetime]]]:
+        with self._fetched_device_ranges_lock:
+            device_ranges = self._fetched_device_ranges
+            self._fetched_device_ranges = {}
+
+        return device_ranges
 
     def fetch_from_file(self, file_path: str, *args, **kwargs) -> None:
         """Retrieve data from a file and store it in the database."""
 
         self._fetch_from_file(file_path, *args, **kwargs)
         self._store()
+        flush()
 
     def get_latest_retrieval_datetime(self) -> datetime:
         """Get the most recent datetime for the measurement associated with the retriever."""
 
-        query_str = (
-            f'from(bucket:"{config.db["bucket"]}") '
-            "|> range(start: 0, stop: now()) "
-            f'|> filter(fn: (r) => r["_measurement"] == "{self._measurement_name}") '
-            "|> last() "
-        )
-        result = query(query_str)
+        result = self._query_last_points()
 
         if len(result) == 0:
             logging.info(f"No data found for {self._measurement_name}.")
@@ -82,13 +314,81 @@ class Retriever(ABC):
 
         return datetime_start
 
+    def get_latest_retrieval_datetimes(self) -> dict[str, datetime]:
+        """Get the most recent datetime of each device of the measurement associated with the retriever."""
+
+        result = self._query_last_points(
+            'keep(columns: ["_time", "device"])',
+            'group(columns: ["device"])',
+            'sort(columns: ["_time"])',
+            'last(column: "_time")',
+        )
+
+        latest_datetimes = {}
+        for table in result:
+            record = table.records[0]
+            if record["device"] is not None:
+                latest_datetimes[record["device"]] = record.get_time()
+
+        return latest_datetimes
+
+    def get_device_names(self) -> list[str]:
+        """Get the names of the devices currently listed by the source. Used by retrievers tracking devices."""
+
+        raise NotImplementedError("Retriever does not track devices.")
+
+    def get_device_watermarks(self) -> dict[str, datetime]:
+        """Get the end of the data stored for each device, from the local checkpoints or from the database.
+
+        The watermarks found in the database are saved in the checkpoints, so that the next runs do not query it.
+        """
+
+        store = get_checkpoint_store()
+        device_watermarks = store.get_latest_per_key(self._checkpoint_namespace)
+        device_watermarks.pop(ALL_KEYS, None)
+
+        if len(device_watermarks) == 0:
+            device_watermarks = self.get_latest_retrieval_datetimes()
+            ranges = {device: [(watermark, watermark)] for device, watermark in device_watermarks.items()}
+            store.add_ranges(self._checkpoint_namespace, ranges)
+
+        return device_watermarks
+
+    def _query_last_points(self, *operations: str) -> list:
+        """Query the last point of each series of the measurement, followed by Flux operations.
+
+        Only the recent window of `config.db["latest_retrieval_window_days"]` is scanned, unless it contains no data.
+        """
+
+        result = []
+
+        for range_start in [f"-{config.db['latest_retrieval_window_days']}d", "0"]:
+            flux_query = (
+                FluxQuery(config.db["bucket"])
+                .range(range_start)
+                .filter("_measurement", [self._measurement_name])
+                .pipe("last()", *operations)
+            )
+            result = query(str(flux_query))
+
+            if len(result) > 0:
+                break
+
+        return result
+
     def add_write_query(self, write_query: WriteQuery) -> None:
-        """Store a write query and write to database if enough queries accumulated."""
+        """Store a write query and write to database if enough queries accumulated.
 
-        self._write_queries.append(write_query)
+        Thread-safe, can be called concurrently by the workers of a retriever.
+        """
 
-        if len(self._write_queries) >= config.db["minimum_write_batch_size"]:
-            self._store()
+        self._add_to_write_queries(write_query)
+
+    def add_write_line(self, line: bytes) -> None:
+        """Same as `add_write_query`, for a point encoded in line protocol (see `database.write.encode_line`)."""
+
+        if line:
+            self._add_to_write_queries(line)
 
     @abstractmethod
     def _fetch(
@@ -103,10 +403,24 @@ class Retriever(ABC):
 
         raise NotImplementedError("Retriever does not support fetching from a file.")
 
+    def _add_to_write_queries(self, write_query: WriteQuery | bytes) -> None:
+        with self._write_queries_lock:
+            self._write_queries.append(write_query)
+            is_batch_complete = len(self._write_queries) >= config.db["minimum_write_batch_size"]
+
+        if is_batch_complete:
+            self._store()
+
     def _store(self) -> None:
-        if len(self._write_queries) == 0:
-            return
+        # Stores are serialized, so that all queries added before a call are passed to the writer when it returns
+        with self._store_lock:
+            # Take the accumulated queries atomically, so that each query is passed to the writer exactly once
+            with self._write_queries_lock:
+                write_queries = self._write_queries
+                self._write_queries = []
+
+            if len(write_queries) == 0:
+                return
 
-        logging.info(f"Writing {len(self._write_queries)} entries to the database.")
-        write(self._write_queries)
-        self._write_queries = []
+            logging.info(f"Writing {len(write_queries)} entries to the database.")
+            write(write_queries)
@@ -0,0 +1,211 @@
+"""Scheduling of the requests to an API within its rate limit, shared by the threads of a process.
+
+Requests wait for a token of a `TokenBucket` and for a slot of an `AdaptiveConcurrencyLimit`. Throttled requests (ex:
+HTTP 429) pause the bucket for all the threads, lower the concurrency, and are sent again with an exponential backoff.
+"""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional
+
+import requests
+
+
+class TokenBucket:
+    def __init__(self, requests_per_second: float, burst: int) -> None:
+        """Rate limit of requests_per_second on average, allowing bursts of up to burst requests."""
+
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+
+        self._tokens = float(burst)  # Negative when requests are waiting for their token
+        self._updated_at = time.monotonic()  # In the future while paused
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Reserve the next token, and wait until it is available."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            delay = max(0.0, self._updated_at - now) + max(0.0, -self._tokens) / self.requests_per_second
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Send no request for the next seconds (ex: after a "Retry-After" header), then start again without burst."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if now + seconds > self._updated_at:
+                self._updated_at = now + seconds
+                self._tokens = min(self._tokens, 0)
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated_at:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.requests_per_second)
+            self._updated_at = now
+
+
+class AdaptiveConcurrencyLimit:
+    def __init__(self, initial: int, minimum: int, maximum: int) -> None:
+        """Maximum number of requests in flight, adjusted between minimum and maximum (AIMD).
+
+        The limit increases by one after as many successful requests as the limit (additive increase), and is halved
+        when a request is throttled (multiplicative decrease). Requests sent before the last decrease do not decrease it
+        again.
+        """
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum)
+
+        self._in_flight = 0
+        self._n_successes = 0
+        self._decreased_at = float("-inf")
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """Wait for a free slot, and return the time the request was started at (to pass to `on_throttle`)."""
+
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+
+            self._in_flight += 1
+            return time.monotonic()
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self._n_successes += 1
+
+            if self._n_successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._n_successes = 0
+                self._condition.notify_all()
+
+    def on_throttle(self, started_at: float) -> None:
+        with self._condition:
+            if started_at < self._decreased_at:
+                return
+
+            self.limit = max(self.minimum, self.limit // 2)
+            self._n_successes = 0
+            self._decreased_at = time.monotonic()
+            logging.info(f"Request throttled, lowering concurrency to {self.limit}")
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        requests_per_second: float,
+        burst: int,
+        max_concurrency: int,
+        initial_concurrency: Optional[int] = None,
+        throttle_status_codes: Iterable[int] = (429,),
+        max_retries: int = 5,
+        retry_delay_seconds: float = 1,
+        max_retry_delay_seconds: float = 60,
+    ) -> None:
+        """Rate and concurrency limits of an API, with the responses it uses to throttle requests.
+
+        Throttled requests are sent again up to max_retries times, after the delay of their "Retry-After" header, or
+        else after an exponential backoff from retry_delay_seconds to max_retry_delay_seconds.
+        """
+
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.concurrency = AdaptiveConcurrencyLimit(initial_concurrency or max_concurrency, 1, max_concurrency)
+        self.throttle_status_codes = set(throttle_status_codes)
+        self.max_retries = max_retries
+        self.retry_delay_seconds = retry_delay_seconds
+        self.max_retry_delay_seconds = max_retry_delay_seconds
+
+    def send(self, send_request: Callable[[], requests.Response]) -> requests.Response:
+        """Call send_request within the limits, again while it is throttled. Return the last response."""
+
+        for attempt in range(self.max_retries + 1):
+            started_at = self.concurrency.acquire()
+
+            try:
+                self.bucket.acquire()
+                response = send_request()
+            finally:
+                self.concurrency.release()
+
+            if response.status_code not in self.throttle_status_codes:
+                self.concurrency.on_success()
+                return response
+
+            self.concurrency.on_throttle(started_at)
+
+            if attempt == self.max_retries:
+                logging.error(f"Request still throttled after {self.max_retries} retries: {response.url}")
+                break
+
+            delay = self._get_retry_delay(response, attempt)
+            logging.warning(f"Request throttled (response {response.status_code}), retrying in {delay:.1f} s")
+            self.bucket.pause(delay)
+
+        return response
+
+    def _get_retry_delay(self, response: requests.Response, attempt: int) -> float:
+        retry_after = get_retry_after_seconds(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_delay_seconds)
+
+        delay = min(self.retry_delay_seconds * 2**attempt, self.max_retry_delay_seconds)
+        return delay * random.uniform(0.5, 1)  # Jitter, so that the throttled threads do not retry together
+
+
+def get_retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Get the delay of the "Retry-After" header of a response, in seconds or as an HTTP date. None if missing."""
+
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_datetime = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        logging.warning(f"Ignoring invalid Retry-After header: {retry_after}")
+        return None
+
+    if retry_datetime.tzinfo is None:
+        retry_datetime = retry_datetime.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_datetime - datetime.now(timezone.utc)).total_seconds())
+
+
+def create_scheduler(provider_config: dict, max_concurrency: int) -> RequestScheduler:
+    """Create the scheduler of an API from the "rate_limit" entry of its configuration (ex: `config.uhoo`)."""
+
+    rate_limit = provider_config["rate_limit"]
+
+    return RequestScheduler(
+        requests_per_second=rate_limit["requests_per_second"],
+        burst=rate_limit["burst"],
+        max_concurrency=max_concurrency,
+        initial_concurrency=rate_limit["initial_concurrency"],
+        throttle_status_codes=rate_limit["throttle_status_codes"],
+        max_retries=rate_limit["max_retries"],
+        retry_delay_seconds=rate_limit["retry_delay_seconds"],
+        max_retry_delay_seconds=rate_limit["max_retry_delay_seconds"],
+    )
@@ -0,0 +1,68 @@
+"""HTTP sessions of the APIs, shared by the threads of a process to reuse their connections."""
+
+import threading
+from functools import partial
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from inperso.data_acquisition.scheduler import RequestScheduler
+
+
+class TimeoutSession(requests.Session):
+    def __init__(
+        self,
+        timeout_seconds: float,
+        pool_maxsize: int,
+        scheduler: Optional[RequestScheduler] = None,
+    ) -> None:
+        """Session keeping up to pool_maxsize connections per host alive, with a default timeout for its requests.
+
+        Responses are compressed with gzip when the server supports it, and decompressed transparently. The connection
+        pools are thread-safe, so a session can be shared by the workers of a retriever. If a scheduler is given, all
+        the requests are sent through it, within the rate limit of the API.
+        """
+
+        super().__init__()
+
+        self.timeout_seconds = timeout_seconds
+        self.scheduler = scheduler
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs) -> requests.Response:  # type: ignore[override]
+        kwargs.setdefault("timeout", self.timeout_seconds)
+        send_request = partial(super().request, method, url, **kwargs)
+
+        if self.scheduler is None:
+            return send_request()
+
+        return self.scheduler.send(send_request)
+
+
+_sessions: dict[str, TimeoutSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_shared_session(name: str, create: Callable[[], TimeoutSession]) -> TimeoutSession:
+    """Get the session shared by all the threads for an API (ex: "uhoo"), created by `create` at the first call."""
+
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = create()
+
+        return _sessions[name]
+
+
+def close_sessions() -> None:
+    """Close the connections of all the sessions."""
+
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+
+        _sessions.clear()
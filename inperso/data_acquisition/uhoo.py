@@ -1,12 +1,13 @@
 import csv
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
-import requests
-
 from inperso import config
+from inperso.data_acquisition.credentials import CredentialManager, get_credential_manager, get_response_error
 from inperso.data_acquisition.retriever import Retriever
+from inperso.data_acquisition.scheduler import create_scheduler
+from inperso.data_acquisition.sessions import TimeoutSession, get_shared_session
+from inperso.database.write import encode_line, encode_series_key
 from inperso.utils import dict_ints_to_floats
 
 
@@ -14,10 +15,15 @@ class UhooRetriever(Retriever):
     def __init__(self) -> None:
         super().__init__()
 
-        token = get_token(config.uhoo["client_id"])
-        self.devices = get_device_list(token)
+        self.credentials = get_credentials()
         logging.info(f"Found {len(self.devices)} devices")
 
+    @property
+    def devices(self) -> list[dict]:
+        """Devices of the account, requested again once their cached list expires."""
+
+        return self.credentials.get_device_list()
+
     @property
     def _measurement_name(self) -> str:
         return "uhoo"
@@ -26,6 +32,21 @@ class UhooRetriever(Retriever):
     def _fetch_interval(self) -> timedelta:
         return timedelta(hours=config.uhoo["fetch_interval_hours"])
 
+    @property
+    def _max_concurrent_fragments(self) -> int:
+        return config.uhoo["max_concurrent_fragments"]
+
+    @property
+    def _max_concurrent_requests(self) -> int:
+        return config.uhoo["max_concurrent_fragments"] * config.uhoo["max_concurrent_devices"]
+
+    @property
+    def _tracks_devices(self) -> bool:
+        return True
+
+    def get_device_names(self) -> list[str]:
+        return [device["deviceName"] for device in self.devices]
+
     def _fetch(
         self,
         datetime_start: datetime,
@@ -33,21 +54,13 @@ class UhooRetriever(Retriever):
     ) -> None:
         """Retrieve data from the source."""
 
-        token = get_token(config.uhoo["client_id"])
-        with ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(self._fetch_device_data, token, device, datetime_start, datetime_end)
-                for device in self.devices
-            ]
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    logging.error(f"Error fetching device data: {e}")
+        self._run_concurrently(
+            lambda device: self._fetch_device_data(device, datetime_start, datetime_end),
+            self.devices,
+        )
 
     def _fetch_device_data(
         self,
-        token: str,
         device: dict,
         datetime_start: datetime,
         datetime_end: datetime,
@@ -57,14 +70,20 @@ class UhooRetriever(Retriever):
         device_name = device["deviceName"]
         device_mac = device["macAddress"]
 
+        datetime_start = self._get_device_fetch_start(device_name, datetime_start)
+        if datetime_start >= datetime_end:
+            return
+
         try:
             logging.info(f"Getting Uhoo device data for {device_name} ({device_mac})")
-            device_data = get_device_data(token, device_name, device_mac, datetime_start, datetime_end)
+            device_data = self.credentials.call(get_device_data, device_name, device_mac, datetime_start, datetime_end)
 
         except RuntimeError:
+            self._mark_fetch_failed()
             return
 
         if device_data == {}:
+            self._mark_device_fetched(device_name, datetime_start, datetime_end)
             return
 
         device_location = device["roomName"]
@@ -88,6 +107,8 @@ class UhooRetriever(Retriever):
                 }
             )
 
+        self._mark_device_fetched(device_name, datetime_start, datetime_end)
+
     def _fetch_from_file(
         self,
         file_path: str,
@@ -109,6 +130,7 @@ class UhooRetriever(Retriever):
             "location": device_location,
             "floor": device_floor,
         }
+        series_key = encode_series_key(self._measurement_name, tags)
 
         with open(file_path, "r") as file:
             reader = csv.DictReader(
@@ -168,14 +190,42 @@ class UhooRetriever(Retriever):
                 }
                 fields = {k: float(v) for k, v in fields.items() if v != ""}
 
-                self.add_write_query(
-                    {
-                        "measurement": self._measurement_name,
-                        "tags": tags,
-                        "fields": fields,
-                        "time": timestamp,
-                    }
-                )
+                self.add_write_line(encode_line(series_key, fields, timestamp))
+
+
+def get_session() -> TimeoutSession:
+    """Get the HTTP session of the uHoo API, with a connection for each concurrent device request.
+
+    Requests are sent within the rate limit of `config.uhoo["rate_limit"]`, and sent again when throttled.
+    """
+
+    max_concurrency = config.uhoo["max_concurrent_fragments"] * config.uhoo["max_concurrent_devices"]
+
+    return get_shared_session(
+        "uhoo",
+        lambda: TimeoutSession(
+            config.uhoo["request_timeout_seconds"],
+            pool_maxsize=max_concurrency,
+            scheduler=create_scheduler(config.uhoo, max_concurrency),
+        ),
+    )
+
+
+def get_credentials() -> CredentialManager:
+    """Get the token and device list cache of the configured client ID, shared by all the threads."""
+
+    client_id = config.uhoo["client_id"]
+
+    return get_credential_manager(
+        ("uhoo", client_id),
+        lambda: CredentialManager(
+            request_token=lambda: get_token(client_id),
+            token_lifetime_seconds=config.uhoo["token_lifetime_seconds"],
+            refresh_margin_seconds=config.uhoo["token_refresh_margin_seconds"],
+            request_device_list=get_device_list,
+            device_list_ttl_seconds=config.uhoo["device_list_ttl_seconds"],
+        ),
+    )
 
 
 def get_token(client_id: str) -> str:
@@ -185,7 +235,7 @@ def get_token(client_id: str) -> str:
 
     url = "https://api.uhooinc.com/v1/generatetoken"
     data = {"code": client_id}
-    response = requests.post(url, data=data)
+    response = get_session().post(url, data=data)
 
     if response.status_code != 200:
         message = f"Failed to get token: Response {response.status_code} - {response.text}"
@@ -207,12 +257,12 @@ def get_device_list(access_token: str) -> list:
 
     url = "https://api.uhooinc.com/v1/devicelist"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = get_session().get(url, headers=headers)
 
     if response.status_code != 200:
         message = f"Failed to get device list: Response {response.status_code} - {response.text}"
         logging.error(message)
-        raise RuntimeError(message)
+        raise get_response_error(response.status_code, message)
         # 400: limit exceeded
         # 401: invalid token
 
@@ -253,7 +303,7 @@ def get_device_data(
         "timestampStart": timestamp_start,
         "timestampEnd": timestamp_end,
     }
-    response = requests.post(url, headers=headers, data=data)
+    response = get_session().post(url, headers=headers, data=data)
 
     if response.status_code == 404:  # No data available
         logging.warning(f"No data available for {device_name} ({device_mac})")
@@ -262,7 +312,7 @@ def get_device_data(
     if response.status_code != 200:
         message = f"Failed to get device data: Response {response.status_code} - {response.text}"
         logging.error(message)
-        raise RuntimeError(message)
+        raise get_response_error(response.status_code, message)
         # 400: limit exceeded
         # 401: invalid token
         # 403: expired token
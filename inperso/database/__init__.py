@@ -1,6 +1,8 @@
-from . import read, write
+from . import client, flux, read, write
 
 __all__ = [
+    "client",
+    "flux",
     "read",
     "write",
 ]
@@ -1,17 +1,11 @@
 import logging
 
-from influxdb_client import InfluxDBClient
-
 from inperso import config
+from inperso.database.client import get_client
 
 
 def get_buckets_api():
-    client = InfluxDBClient(
-        url=config.db["host"],
-        token=config.db["token"],
-        org=config.db["org"],
-        enable_gzip=True,
-    )
+    client = get_client()
 
     buckets_api = client.buckets_api()
 
@@ -0,0 +1,52 @@
+"""Process-wide InfluxDB clients, shared by the read, write, delete and buckets APIs."""
+
+import atexit
+import logging
+import threading
+
+from influxdb_client import InfluxDBClient
+
+from inperso import config
+
+_clients: dict[tuple[str, str, str], InfluxDBClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client() -> InfluxDBClient:
+    """Get the client for the current database configuration, creating it on first use.
+
+    One client is kept per (host, token, org), so that its HTTP connection pool is reused by all calls. Clients are
+    thread-safe and can be shared by worker threads.
+    """
+
+    key = (config.db["host"], config.db["token"], config.db["org"])
+
+    with _clients_lock:
+        client = _clients.get(key)
+
+        if client is None:
+            logging.info(f"Creating database client for {config.db['host']}.")
+            client = InfluxDBClient(
+                url=config.db["host"],
+                token=config.db["token"],
+                org=config.db["org"],
+                enable_gzip=True,
+                connection_pool_maxsize=config.db["connection_pool_maxsize"],
+            )
+            _clients[key] = client
+
+    return client
+
+
+def close_clients() -> None:
+    """Close all clients and their connection pools. Called at interpreter exit."""
+
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_clients)
@@ -1,19 +1,13 @@
 import logging
 from datetime import datetime, timezone
 
-from influxdb_client import InfluxDBClient
-
 from inperso import config
+from inperso.database.client import get_client
 from inperso.utils import utc_datetime_to_iso
 
 
 def get_delete_api():
-    client = InfluxDBClient(
-        url=config.db["host"],
-        token=config.db["token"],
-        org=config.db["org"],
-        enable_gzip=True,
-    )
+    client = get_client()
 
     delete_api = client.delete_api()
 
@@ -0,0 +1,148 @@
+"""Building of Flux queries."""
+
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Iterable, Optional
+
+
+@dataclass(frozen=True)
+class FluxQuery:
+    """Immutable Flux query reading a bucket, built by chaining methods that return new queries.
+
+    Filters are rendered in a canonical order, whatever the order of the calls: measurement, other tags, then fields,
+    so that they are pushed down to the storage engine and use its tag index. Filters on the same column are merged.
+    The rendered string (`str(query)`) is stable, and can be used as a cache key.
+
+    Example:
+        FluxQuery("bucket").range(datetime_start).filter("_field", ["co2"]).filter("device", ["a", "b"]).pipe("last()")
+    """
+
+    bucket: str
+    start: str = "0"
+    stop: str = "now()"
+    filters: tuple[tuple[str, tuple[str, ...]], ...] = ()  # Column and values it must equal, sorted by column
+    exclusions: tuple[tuple[str, tuple[str, ...]], ...] = ()  # Column and values it must not equal, sorted by column
+    operations: tuple[str, ...] = ()  # Applied after the filters, in order
+    columns: Optional[tuple[str, ...]] = None  # Kept at the end
+
+    def range(
+        self,
+        datetime_start: Optional[datetime | str] = None,
+        datetime_end: Optional[datetime | str] = None,
+    ) -> "FluxQuery":
+        """Set the time range, from datetimes (truncated to the second) or Flux expressions (ex: "-30d", "now()").
+
+        Defaults to the whole bucket, from timestamp 0 until now.
+        """
+
+        return replace(self, start=_to_flux_time(datetime_start, "0"), stop=_to_flux_time(datetime_end, "now()"))
+
+    def filter(self, column: str, values: Optional[Iterable[str]]) -> "FluxQuery":
+        """Keep the rows whose column equals one of the values. Does nothing if values is None.
+
+        Filtering the same column again keeps the values in both filters.
+        """
+
+        if values is None:
+            return self
+
+        values = set(values)
+        filters = dict(self.filters)
+
+        if column in filters:
+            values &= set(filters[column])
+
+        filters[column] = tuple(sorted(values))
+
+        return replace(self, filters=_sort_by_column(filters))
+
+    def exclude(self, column: str, values: Iterable[str]) -> "FluxQuery":
+        """Remove the rows whose column equals one of the values."""
+
+        values = set(values)
+        if len(values) == 0:
+            return self
+
+        exclusions = dict(self.exclusions)
+        exclusions[column] = tuple(sorted(values | set(exclusions.get(column, ()))))
+
+        return replace(self, exclusions=_sort_by_column(exclusions))
+
+    def pipe(self, *operations: str) -> "FluxQuery":
+        """Apply Flux operations after the filters (ex: "last()", 'group(columns: ["device"])')."""
+
+        return replace(self, operations=self.operations + operations)
+
+    def keep(self, columns: Iterable[str]) -> "FluxQuery":
+        """Only keep the given columns in the result."""
+
+        return replace(self, columns=tuple(columns))
+
+    def __str__(self) -> str:
+        query_str = f'from(bucket:"{escape_flux_string(self.bucket)}")'
+        query_str += f"|> range(start: {self.start}, stop: {self.stop})"
+
+        filters = dict(self.filters)
+        exclusions = dict(self.exclusions)
+
+        for column, _ in _sort_by_column({**exclusions, **filters}):
+            if column in filters:
+                query_str += get_equality_filter(column, list(filters[column]))
+
+            if column in exclusions:
+                query_str += get_inequality_filter(column, list(exclusions[column]))
+
+        for operation in self.operations:
+            query_str += f"|> {operation}"
+
+        if self.columns is not None:
+            columns = ", ".join(f'"{escape_flux_string(column)}"' for column in self.columns)
+            query_str += f"|> keep(columns: [{columns}])"
+
+        return query_str
+
+
+def _to_flux_time(value: Optional[datetime | str], default: str) -> str:
+    if value is None:
+        return default
+
+    if isinstance(value, datetime):
+        return str(int(value.timestamp()))
+
+    return value
+
+
+def _sort_by_column(values_per_column: dict[str, tuple[str, ...]]) -> tuple[tuple[str, tuple[str, ...]], ...]:
+    """Sort filters by column: measurement first and fields last, as the other tags select series using the index."""
+
+    def get_rank(column: str) -> tuple[int, str]:
+        return {"_measurement": 0, "_field": 2}.get(column, 1), column
+
+    return tuple(sorted(values_per_column.items(), key=lambda item: get_rank(item[0])))
+
+
+def get_equality_filter(column: str, values: list[str]) -> str:
+    """Get a query substring to keep the rows whose column equals one of the values.
+
+    Equality predicates (unlike regular expressions or `contains`) are pushed down to the storage engine, which uses
+    its tag index.
+    """
+
+    if len(values) == 0:
+        return "|> filter(fn: (r) => false)"
+
+    conditions = [f'r["{escape_flux_string(column)}"] == "{escape_flux_string(value)}"' for value in values]
+    return f"|> filter(fn: (r) => {' or '.join(conditions)})"
+
+
+def get_inequality_filter(column: str, values: list[str]) -> str:
+    """Get a query substring to remove the rows whose column equals one of the values."""
+
+    conditions = [f'r["{escape_flux_string(column)}"] != "{escape_flux_string(value)}"' for value in values]
+    return f"|> filter(fn: (r) => {' and '.join(conditions)})"
+
+
+def escape_flux_string(value: str) -> str:
+    """Escape a value to be used in a Flux string literal (between double quotes)."""
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("${", "\\${")
@@ -1,20 +1,16 @@
 import logging
 import time
-from datetime import datetime
-from typing import Optional
+from typing import Iterator
 
-from influxdb_client import InfluxDBClient
+import pandas as pd
+from influxdb_client.client.flux_table import FluxRecord
 
 from inperso import config
+from inperso.database.client import get_client
 
 
 def get_query_api():
-    client = InfluxDBClient(
-        url=config.db["host"],
-        token=config.db["token"],
-        org=config.db["org"],
-        enable_gzip=True,
-    )
+    client = get_client()
 
     query_api = client.query_api()
     return query_api
@@ -40,18 +36,67 @@ def query(query: str):
     return response
 
 
-def get_datetime_filter(
-    datetime_start: Optional[datetime] = None,
-    datetime_end: Optional[datetime] = None,
-) -> str:
-    """Get a query substring to filter data by datetime range."""
+def query_stream(query: str) -> Iterator[FluxRecord]:
+    """Query the database (with a Flux query) and lazily yield the resulting records.
 
-    if datetime_start is None:
-        datetime_start = datetime.fromtimestamp(0)
-    timestamp_start = int(datetime_start.timestamp())
+    Records are parsed while the response is being received. Retries are only possible before the first record.
+    """
 
-    if datetime_end is None:
-        datetime_end = datetime.now()
-    timestamp_end = int(datetime_end.timestamp())
+    records: Iterator[FluxRecord] = iter([])
 
-    return f"|> range(start: {timestamp_start}, stop: {timestamp_end})"
+    for attempt in range(config.db["maximum_query_retries"]):
+        try:
+            query_api = get_query_api()
+            records = query_api.query_stream(query)
+            first_record = next(records, None)
+            break
+
+        except Exception as e:
+            logging.error(
+                f"Failed to query the database (attempt {attempt + 1}/{config.db['maximum_query_retries']}): {e}"
+            )
+            time.sleep(config.db["query_retry_delay_seconds"])
+
+    else:
+        # Not ending the stream silently, which could be mistaken for (and cached as) a valid empty result
+        message = f"Failed to query the database after {config.db['maximum_query_retries']} attempts."
+        logging.error(message)
+        raise RuntimeError(message)
+
+    if first_record is None:
+        return
+
+    yield first_record
+    yield from records
+
+
+def query_data_frame(query: str) -> pd.DataFrame:
+    """Query the database (with a Flux query) and return the result as a single DataFrame.
+
+    The response is parsed table by table into columns, without creating an object per record.
+    """
+
+    frames: list[pd.DataFrame] = []
+
+    for attempt in range(config.db["maximum_query_retries"]):
+        try:
+            query_api = get_query_api()
+            frames = list(query_api.query_data_frame_stream(query))
+            break
+
+        except Exception as e:
+            logging.error(
+                f"Failed to query the database (attempt {attempt + 1}/{config.db['maximum_query_retries']}): {e}"
+            )
+            time.sleep(config.db["query_retry_delay_seconds"])
+
+    else:
+        # Not returning an empty DataFrame, which could be mistaken for (and cached as) a valid empty result
+        message = f"Failed to query the database after {config.db['maximum_query_retries']} attempts."
+        logging.error(message)
+        raise RuntimeError(message)
+
+    if len(frames) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True)
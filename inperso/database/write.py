@@ -1,21 +1,25 @@
+import atexit
 import logging
+import math
+import queue
+import threading
 import time
-from datetime import datetime
-from typing import Any, TypedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Iterator, Optional, TypedDict
 
-from influxdb_client import InfluxDBClient, WritePrecision
+import numpy as np
+import pandas as pd
+from influxdb_client import WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
 
 from inperso import config
+from inperso.database.client import get_client
 
 
 def get_write_api():
-    client = InfluxDBClient(
-        url=config.db["host"],
-        token=config.db["token"],
-        org=config.db["org"],
-        enable_gzip=True,
-    )
+    client = get_client()
 
     write_api = client.write_api(write_options=SYNCHRONOUS)
 
@@ -29,21 +33,383 @@ class WriteQuery(TypedDict):
     time: datetime | int  # Unix timestamp
 
 
-def write(queries: list[WriteQuery] | list[dict[str, Any]], use_atlas_index_bucket: bool = False) -> None:
-    """Write queries (dictionaries) into the database.
+# Line protocol escaping, see https://docs.influxdata.com/influxdb/v2/reference/syntax/line-protocol/#special-characters
+_ESCAPE_MEASUREMENT = str.maketrans({",": "\\,", " ": "\\ ", "\n": "\\n", "\t": "\\t", "\r": "\\r"})
+_ESCAPE_KEY = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n", "\t": "\\t", "\r": "\\r"})
+_ESCAPE_STRING = str.maketrans({'"': '\\"', "\\": "\\\\"})
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-    Timestamps must be in UTC with second precision.
+
+def encode_series_key(measurement: str, tags: dict) -> str:
+    """Encode the measurement and tags of a point in line protocol (ex: "uhoo,device=a,floor=1").
+
+    The result is cached, as the tags of a device never change.
+    """
+
+    return _encode_series_key(measurement, tuple(sorted(tags.items())))
+
+
+@lru_cache(maxsize=4096)
+def _encode_series_key(measurement: str, tag_items: tuple) -> str:
+    series_key = measurement.translate(_ESCAPE_MEASUREMENT)
+
+    for key, value in tag_items:
+        if value is None:
+            continue
+
+        key = str(key).translate(_ESCAPE_KEY)
+        value = str(value).translate(_ESCAPE_KEY)
+        if value.endswith("\\"):
+            value += " "
+
+        if key != "" and value != "":
+            series_key += f",{key}={value}"
+
+    return series_key
+
+
+def encode_line(series_key: str, fields: dict, time: datetime | int) -> bytes:
+    """Encode a point in line protocol, with second precision, from its encoded series key.
+
+    Returns an empty bytes string if the point has no valid field.
+    """
+
+    encoded_fields = []
+
+    for key, value in sorted(fields.items()):
+        value_type = type(value)
+
+        if value_type is float or isinstance(value, (float, np.floating)):
+            if not math.isfinite(value):
+                continue
+            encoded_value = str(value)
+            if encoded_value.endswith(".0"):
+                encoded_value = encoded_value[:-2]
+        elif value is None:
+            continue
+        elif value_type is bool:
+            encoded_value = "true" if value else "false"
+        elif isinstance(value, (int, np.integer)):
+            encoded_value = f"{value}i"
+        elif isinstance(value, str):
+            encoded_value = f'"{value.translate(_ESCAPE_STRING)}"'
+        else:
+            raise ValueError(f'Type: "{type(value)}" of field: "{key}" is not supported.')
+
+        encoded_fields.append(f"{_encode_field_key(key)}={encoded_value}")
+
+    if len(encoded_fields) == 0:
+        return b""
+
+    if isinstance(time, datetime):
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=timezone.utc)
+        time = (time - _EPOCH) // timedelta(seconds=1)
+
+    return f"{series_key} {','.join(encoded_fields)} {time}".encode()
+
+
+@lru_cache(maxsize=4096)
+def _encode_field_key(key: str) -> str:
+    return str(key).translate(_ESCAPE_KEY)
+
+
+def encode_data_frame(
+    df: pd.DataFrame,
+    measurement: str,
+    field_columns: list[str],
+    tag_columns: Optional[list[str]] = None,
+    tags: Optional[dict] = None,
+    time_column: str = "time",
+) -> list[bytes]:
+    """Encode the rows of a DataFrame in line protocol, with second precision, column by column.
+
+    Each row is a point with the fields of field_columns (numeric or boolean), the tags of tag_columns and the constant
+    tags. Missing and infinite values are skipped, and rows without any valid field are dropped. Gives the same lines
+    as `encode_line`, without building a dictionary per row.
     """
-    bucket = config.db["bucket_atlas_index"] if use_atlas_index_bucket else config.db["bucket"]
-
-    for attempt in range(config.db["maximum_query_retries"]):
-        try:
-            write_api = get_write_api()
-            write_api.write(bucket=bucket, record=queries, write_precision=WritePrecision.S)
-            break
-
-        except Exception as e:
-            logging.error(
-                f"Failed to write data to the database (attempt {attempt + 1}/{config.db['maximum_query_retries']}): {e}"
-            )
-            time.sleep(config.db["query_retry_delay_seconds"])
+
+    tag_columns = tag_columns or []
+    tags = tags or {}
+
+    if len(df) == 0:
+        return []
+
+    # Series keys, encoded once per combination of tags
+    if len(tag_columns) > 0:
+        tag_values = df[tag_columns].astype(object)
+        tag_values = tag_values.where(tag_values.notna(), None)
+        codes, unique_tag_values = pd.factorize(pd.Series(list(zip(*(tag_values[c] for c in tag_columns)))))
+        unique_series_keys = [
+            encode_series_key(measurement, {**tags, **dict(zip(tag_columns, values))}) for values in unique_tag_values
+        ]
+        series_keys = pd.Series(np.array(unique_series_keys, dtype=object)[codes], index=df.index)
+    else:
+        series_keys = pd.Series(encode_series_key(measurement, tags), index=df.index)
+
+    # Fields, as "key=value," strings, empty if the value is missing
+    encoded_fields = pd.Series("", index=df.index)
+    for column in sorted(field_columns):
+        encoded_fields += _encode_field_column(df[column])
+
+    has_fields = encoded_fields != ""
+
+    times = df[time_column]
+    if pd.api.types.is_datetime64_any_dtype(times) or times.dtype == object:
+        times = pd.to_datetime(times, utc=True)
+        times = (times - _EPOCH) // timedelta(seconds=1)
+
+    lines = series_keys[has_fields] + " " + encoded_fields[has_fields].str[:-1] + " " + times[has_fields].astype(str)
+
+    return [line.encode() for line in lines]
+
+
+def _encode_field_column(values: pd.Series) -> pd.Series:
+    key = _encode_field_key(values.name)
+
+    if pd.api.types.is_bool_dtype(values):
+        encoded_values = values.map({True: "true", False: "false"})
+        is_valid = values.notna()
+    elif pd.api.types.is_integer_dtype(values):
+        encoded_values = values.astype(str) + "i"
+        is_valid = values.notna()
+    elif pd.api.types.is_float_dtype(values):
+        is_valid = pd.Series(np.isfinite(values.to_numpy(dtype=float)), index=values.index)
+        encoded_values = pd.Series([str(value) for value in values.tolist()], index=values.index, dtype=object)
+        encoded_values = encoded_values.str.removesuffix(".0")
+    else:
+        raise ValueError(f'Type: "{values.dtype}" of field: "{values.name}" is not supported.')
+
+    return (key + "=" + encoded_values + ",").where(is_valid, "")
+
+
+def encode_query(query: WriteQuery | dict[str, Any]) -> bytes:
+    """Encode a write query (dictionary) in line protocol, with second precision."""
+
+    series_key = encode_series_key(query["measurement"], query.get("tags", {}))
+    return encode_line(series_key, query["fields"], query["time"])
+
+
+class BatchWriter:
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        flush_interval_seconds: Optional[float] = None,
+        max_queue_size: Optional[int] = None,
+    ) -> None:
+        """Write queries to the database from a background thread.
+
+        Queries are accumulated per bucket, and written when `batch_size` queries are pending or every
+        `flush_interval_seconds`. Failed writes are retried with exponential backoff, and dropped after
+        `config.db["maximum_query_retries"]` attempts. When `max_queue_size` calls to `write` are pending, `write`
+        blocks until the background thread catches up.
+        """
+
+        self.batch_size = batch_size or config.db["write_batch_size"]
+        self.flush_interval_seconds = flush_interval_seconds or config.db["write_flush_interval_seconds"]
+
+        self.points_written = 0
+        self.points_retried = 0
+        self.points_dropped = 0
+        self.closed = False
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size or config.db["write_queue_max_size"])
+        self._thread = threading.Thread(target=self._run, name="inperso-batch-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write(
+        self,
+        queries: list[WriteQuery] | list[dict[str, Any]] | list[bytes],
+        use_atlas_index_bucket: bool = False,
+    ) -> None:
+        """Queue queries (dictionaries or encoded lines) to be written into the database."""
+
+        if self.closed:
+            raise RuntimeError("Cannot write with a closed BatchWriter.")
+
+        bucket = config.db["bucket_atlas_index"] if use_atlas_index_bucket else config.db["bucket"]
+        self._queue.put((bucket, list(queries)))
+
+    def flush(self) -> None:
+        """Wait until all queued queries are written (or dropped)."""
+
+        if self.closed:
+            return
+
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        flushed.wait()
+
+    def close(self) -> None:
+        """Write all queued queries and stop the background thread."""
+
+        if self.closed:
+            return
+
+        self.flush()
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+        self.log_statistics()
+
+    def log_statistics(self) -> None:
+        logging.info(
+            f"Wrote {self.points_written} points to the database "
+            f"({self.points_retried} retried, {self.points_dropped} dropped)."
+        )
+
+    def _run(self) -> None:
+        buffers: dict[str, list] = {}
+        next_flush_time = time.monotonic() + self.flush_interval_seconds
+
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, next_flush_time - time.monotonic()))
+            except queue.Empty:
+                item = threading.Event()  # Periodic flush, nobody waiting for it
+
+            if item is None:
+                return
+
+            if isinstance(item, threading.Event):
+                next_flush_time = self._flush_buffers(buffers)
+                item.set()
+                continue
+
+            bucket, queries = item
+            buffer = buffers.setdefault(bucket, [])
+            buffer.extend(queries)
+            self._write_buffer(bucket, buffer, flush=False)
+
+            # The queue only times out when it is empty, not while writes keep arriving
+            if time.monotonic() >= next_flush_time:
+                next_flush_time = self._flush_buffers(buffers)
+
+    def _flush_buffers(self, buffers: dict[str, list]) -> float:
+        """Write all the buffered queries, and return the time of the next periodic flush."""
+
+        for bucket in buffers:
+            self._write_buffer(bucket, buffers[bucket], flush=True)
+
+        return time.monotonic() + self.flush_interval_seconds
+
+    def _write_buffer(self, bucket: str, buffer: list, flush: bool) -> None:
+        """Write full batches from the buffer (and the remaining queries if flushing), in place."""
+
+        while len(buffer) >= self.batch_size or (flush and len(buffer) > 0):
+            batch = buffer[: self.batch_size]
+            del buffer[: self.batch_size]
+            self._write_batch(bucket, batch)
+
+    def _write_batch(self, bucket: str, batch: list) -> None:
+        maximum_retries = config.db["maximum_query_retries"]
+
+        for attempt in range(maximum_retries):
+            try:
+                write_api = get_write_api()
+                write_api.write(bucket=bucket, record=batch, write_precision=WritePrecision.S)
+                self.points_written += len(batch)
+                return
+
+            except Exception as e:
+                logging.error(f"Failed to write data to the database (attempt {attempt + 1}/{maximum_retries}): {e}")
+
+                if attempt + 1 < maximum_retries:
+                    self.points_retried += len(batch)
+                    delay = config.db["query_retry_delay_seconds"] * 2**attempt
+                    time.sleep(min(delay, config.db["write_retry_max_delay_seconds"]))
+
+        logging.error(f"Dropping {len(batch)} points that could not be written to bucket '{bucket}'.")
+        self.points_dropped += len(batch)
+
+
+_batch_writer: Optional[BatchWriter] = None
+_batch_writer_lock = threading.Lock()
+
+
+def get_batch_writer() -> BatchWriter:
+    """Get the process-wide background writer, creating it on first use."""
+
+    global _batch_writer
+
+    with _batch_writer_lock:
+        if _batch_writer is None or _batch_writer.closed:
+            _batch_writer = BatchWriter()
+            atexit.register(_batch_writer.close)
+
+        return _batch_writer
+
+
+def write(
+    queries: list[WriteQuery] | list[dict[str, Any]] | list[bytes],
+    use_atlas_index_bucket: bool = False,
+) -> None:
+    """Queue queries (dictionaries or encoded lines) to be written into the database by the background writer.
+
+    Timestamps must be in UTC with second precision. Returns immediately, call `flush` to wait for the queries to be
+    written.
+    """
+
+    get_batch_writer().write(queries, use_atlas_index_bucket=use_atlas_index_bucket)
+
+
+def write_lines(lines: list[bytes], use_atlas_index_bucket: bool = False) -> None:
+    """Queue points encoded in line protocol (see `encode_line`) to be written into the database.
+
+    Lines are sent as is (gzip-compressed by the client), skipping the serialization of dictionaries.
+    """
+
+    get_batch_writer().write([line for line in lines if line], use_atlas_index_bucket=use_atlas_index_bucket)
+
+
+def write_data_frame(
+    df: pd.DataFrame,
+    measurement: str,
+    field_columns: list[str],
+    tag_columns: Optional[list[str]] = None,
+    tags: Optional[dict] = None,
+    time_column: str = "time",
+    use_atlas_index_bucket: bool = False,
+) -> None:
+    """Queue the rows of a DataFrame to be written into the database, encoded column by column.
+
+    See `encode_data_frame` for the arguments.
+    """
+
+    lines = encode_data_frame(df, measurement, field_columns, tag_columns, tags, time_column)
+    logging.info(f"Writing {len(lines)} entries to the database.")
+    write_lines(lines, use_atlas_index_bucket=use_atlas_index_bucket)
+
+
+def flush() -> None:
+    """Wait until all queries queued with `write` are written (or dropped)."""
+
+    if _batch_writer is not None:
+        _batch_writer.flush()
+
+
+def get_points_dropped() -> int:
+    """Get the number of points the background writer dropped after exhausting its retries, since it was created."""
+
+    return _batch_writer.points_dropped if _batch_writer is not None else 0
+
+
+@contextmanager
+def write_pipeline() -> Iterator[BatchWriter]:
+    """Context manager making sure all queued queries are written when leaving it. Used by the CLI entry points."""
+
+    batch_writer = get_batch_writer()
+
+    try:
+        yield batch_writer
+
+    finally:
+        batch_writer.flush()
+        batch_writer.log_statistics()
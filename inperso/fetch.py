@@ -1,12 +1,24 @@
 """Function to manually fetch data from the database"""
 
 import logging
-from datetime import datetime
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, Literal, Optional, TypeVar
+
+import numpy as np
+import pandas as pd
 
 from inperso import config
-from inperso.database.read import get_datetime_filter, query
+from inperso.database.flux import FluxQuery
+from inperso.database.read import query, query_data_frame, query_stream
+from inperso.query_cache import get_partitions, get_query_cache
 from inperso.tags import tags
+from inperso.utils import batched, parse_duration
+
+OUTPUT_TYPES = ["records", "dataframe"]
+AGGREGATES = ["mean", "min", "max", "count", "last"]
+
+T = TypeVar("T")
 
 
 def fetch(
@@ -17,8 +29,11 @@ def fetch(
     brands: Optional[list[str]] = None,
     devices: Optional[list[str]] = None,
     fields: Optional[list[str]] = None,
+    output: Literal["records", "dataframe"] = "records",
+    use_cache: bool = False,
+    aggregate: Optional[str] = None,
     **kwargs,
-) -> list[dict]:
+) -> list[dict] | pd.DataFrame:
     """Fetch data from the database.
 
     Args:
@@ -27,7 +42,8 @@ def fetch(
         datetime_end (datetime, optional): End of the time range.
             Defaults to None, which retrieve data until now.
         frequency (str, optional): If provided with "window_size", resample the
-            data using a moving average. Example: "6h".
+            data using a moving average. If provided with "aggregate", resample the data using consecutive windows.
+            Example: "6h".
         window_size (str, optional): If provided with "frequency", resample the
             data using a moving average. Example: "1d".
         brands (list[str], optional): List of brands to retrieve data from.
@@ -38,6 +54,14 @@ def fetch(
             Defaults to None, which retrieves data from all fields.
             Some fields have synonyms (e.g. "temperature" and "temp"). Requesting a field with synonyms will fetch data
             for all synonyms. See `inperso.config.field_synonyms` for the list of synonyms.
+        output (str, optional): "records" (default) to get a list of dictionaries, or "dataframe" to get a
+            DataFrame parsed column by column, with categorical "brand", "device" and "field" columns.
+        use_cache (bool, optional): If True, query the time range partition by partition (see
+            `inperso.config.cache`), and serve the partitions that are over from the local cache. Requires
+            datetime_start. Time values of cached records are pandas Timestamps.
+        aggregate (str, optional): If provided with "frequency", resample the data with one value per consecutive
+            window of "frequency", computed by InfluxDB's `aggregateWindow`: "mean", "min", "max", "count" or "last".
+            Faster than a moving average, which it replaces ("window_size" must then be None or "frequency").
         **kwargs: Additional tags filters:
             - "dc" (list[str])
             - "address" (list[str])
@@ -47,40 +71,131 @@ def fetch(
             See `inperso.tags.tags` for the list of possible values for each tag.
 
     Returns:
-        list[dict]: List of dictionaries containing the data, with the keys:
+        list[dict] | pd.DataFrame: List of dictionaries (or DataFrame) containing the data, with the keys:
             - "time" (datetime)
             - "value" (any)
             - "field" (str)
             - "device" (str)
     """
-    query_str = f'from(bucket:"{config.db["bucket"]}")'
-    query_str += get_datetime_filter(datetime_start, datetime_end)
-    query_str += _get_measurements_filter(brands)
-    query_str += _get_devices_filter(devices)
-    query_str += _get_fields_filter(fields)
-    query_str += _get_tags_filter(**kwargs)
-    query_str += _get_moving_average_filter(frequency, window_size)
-    query_str += '|> keep(columns: ["_time", "_measurement", "device", "_field", "_value"])'
+    _check_output(output)
+    window_size = _check_aggregate(frequency, window_size, aggregate)
+
+    def get_query(
+        datetime_start: Optional[datetime],
+        datetime_end: Optional[datetime],
+        devices: Optional[list[str]] = devices,
+    ) -> str:
+        return str(
+            _get_fetch_query(
+                datetime_start, datetime_end, frequency, window_size, brands, devices, fields, aggregate, **kwargs
+            )
+        )
+
+    columns = {"_time": "time", "_measurement": "brand", "device": "device", "_field": "field", "_value": "value"}
+    categorical_columns = ["brand", "device", "field"]
+
+    if use_cache and _is_cacheable(datetime_start, datetime_end, frequency, window_size):
+        df = _query_data_frame_cached(
+            get_query, "fetch", datetime_start, datetime_end, frequency, columns, categorical_columns
+        )
+
+    else:
+        query_strs = [
+            get_query(shard_start, shard_end, device_shard)
+            for shard_start, shard_end in _get_time_shards(datetime_start, datetime_end, frequency, window_size)
+            for device_shard in _get_device_shards(devices)
+        ]
+        _log_queries(query_strs)
+
+        if output == "records":
+            synonyms = _get_unique_synonyms()
+            return [_format_record(values, synonyms) for values in _get_record_values(_run_queries(query, query_strs))]
+
+        df = _concat_data_frames(
+            _run_queries(lambda query_str: _query_data_frame(query_str, columns, categorical_columns), query_strs),
+            columns,
+        )
+
+    df["field"] = _replace_categories_with_unique_synonym(df["field"])
+
+    if output == "records":
+        return df.to_dict("records")
+
+    return df
+
+
+def iter_fetch(
+    datetime_start: Optional[datetime] = None,
+    datetime_end: Optional[datetime] = None,
+    frequency: Optional[str] = None,
+    window_size: Optional[str] = None,
+    brands: Optional[list[str]] = None,
+    devices: Optional[list[str]] = None,
+    fields: Optional[list[str]] = None,
+    batch_size: Optional[int] = None,
+    aggregate: Optional[str] = None,
+    **kwargs,
+) -> Iterator[dict] | Iterator[list[dict]]:
+    """Lazily fetch data from the database, with constant memory usage.
+
+    Takes the same arguments as `fetch`, and yields the same dictionaries.
+
+    Args:
+        batch_size (int, optional): If provided, yield lists of at most `batch_size` dictionaries instead of single
+            dictionaries.
+    """
+    window_size = _check_aggregate(frequency, window_size, aggregate)
 
+    query_str = str(
+        _get_fetch_query(
+            datetime_start, datetime_end, frequency, window_size, brands, devices, fields, aggregate, **kwargs
+        )
+    )
     logging.info("Running the query:\n" + query_str.replace("|>", "\n|>"))
-    result = query(query_str)
-    values = [record.values for table in result for record in table.records]
 
-    # Remove "result" and "table" keys
-    values = [
-        {
-            "time": record["_time"],
-            "brand": record["_measurement"],
-            "device": record["device"],
-            "field": record["_field"],
-            "value": record["_value"],
-        }
-        for record in values
-    ]
+    synonyms = _get_unique_synonyms()
+    values = (_format_record(record.values, synonyms) for record in query_stream(query_str))
 
-    _replace_fields_with_unique_synonym(values)
+    if batch_size is None:
+        return values
 
-    return values
+    return batched(values, batch_size)
+
+
+def _get_fetch_query(
+    datetime_start: Optional[datetime] = None,
+    datetime_end: Optional[datetime] = None,
+    frequency: Optional[str] = None,
+    window_size: Optional[str] = None,
+    brands: Optional[list[str]] = None,
+    devices: Optional[list[str]] = None,
+    fields: Optional[list[str]] = None,
+    aggregate: Optional[str] = None,
+    **kwargs,
+) -> FluxQuery:
+    query = (
+        FluxQuery(config.db["bucket"])
+        .range(datetime_start, datetime_end)
+        .filter("_measurement", brands)
+        .filter("device", devices)
+        .filter("device", _get_tag_devices(**kwargs))
+        .filter("_field", None if fields is None else _get_fields_with_synonyms(fields))
+    )
+    query = _add_resampling(query, frequency, window_size, aggregate)
+
+    return query.keep(["_time", "_measurement", "device", "_field", "_value"])
+
+
+def _format_record(record: dict, synonyms: dict[str, str]) -> dict:
+    """Only keep relevant keys of a record, with a unique synonym for the field."""
+
+    return {
+        "time": record["_time"],
+        "brand": record["_measurement"],
+        "device": record["device"],
+        "field": synonyms.get(record["_field"], record["_field"]),
+        "value": record["_value"],
+    }
 
 
 def fetch_atlas_scores(
@@ -90,7 +205,10 @@ def fetch_atlas_scores(
     window_size: Optional[str] = None,
     unit_numbers: Optional[list[str]] = None,
     fields: Optional[list[str]] = None,
-) -> list[dict]:
+    output: Literal["records", "dataframe"] = "records",
+    use_cache: bool = False,
+    aggregate: Optional[str] = None,
+) -> list[dict] | pd.DataFrame:
     """Fetch score data from the ATLAS index database.
 
     Args:
@@ -99,33 +217,68 @@ def fetch_atlas_scores(
         datetime_end (datetime, optional): End of the time range.
             Defaults to None, which retrieve data until now.
         frequency (str, optional): If provided with "window_size", resample the
-            data using a moving average. Example: "6h".
+            data using a moving average. If provided with "aggregate", resample the data using consecutive windows.
+            Example: "6h".
         window_size (str, optional): If provided with "frequency", resample the
             data using a moving average. Example: "1d".
         unit_numbers (list[str], optional): List of unit numbers to retrieve data from.
             Defaults to None, which retrieves data from all unit numbers.
         fields (list[str], optional): List of fields to retrieve data from.
             Defaults to None, which retrieves data from all fields.
+        output (str, optional): "records" (default) to get a list of dictionaries, or "dataframe" to get a
+            DataFrame parsed column by column, with categorical "unit_number" and "field" columns.
+        use_cache (bool, optional): If True, query the time range partition by partition (see
+            `inperso.config.cache`), and serve the partitions that are over from the local cache. Requires
+            datetime_start. Cached partitions are invalidated when the ATLAS index configuration changes.
+        aggregate (str, optional): If provided with "frequency", resample the data with one value per consecutive
+            window of "frequency", computed by InfluxDB's `aggregateWindow`: "mean", "min", "max", "count" or "last".
+            Faster than a moving average, which it replaces ("window_size" must then be None or "frequency").
 
     Returns:
-        list[dict]: List of dictionaries containing the data, with the keys:
+        list[dict] | pd.DataFrame: List of dictionaries (or DataFrame) containing the data, with the keys:
             - "time" (datetime)
             - "value" (any)
             - "field" (str)
             - "unit_number" (str)
     """
+    _check_output(output)
+    window_size = _check_aggregate(frequency, window_size, aggregate)
+
+    def get_query(datetime_start: Optional[datetime], datetime_end: Optional[datetime]) -> str:
+        return str(
+            _get_atlas_query(
+                "score", datetime_start, datetime_end, frequency, window_size, unit_numbers, fields, aggregate
+            )
+        )
+
+    columns = {"_time": "time", "unit_number": "unit_number", "_field": "field", "_value": "value"}
+    categorical_columns = ["unit_number", "field"]
+
+    if use_cache and _is_cacheable(datetime_start, datetime_end, frequency, window_size):
+        df = _query_data_frame_cached(
+            get_query,
+            _get_atlas_cache_namespace(),
+            datetime_start,
+            datetime_end,
+            frequency,
+            columns,
+            categorical_columns,
+        )
+        return df if output == "dataframe" else df.to_dict("records")
+
+    query_strs = [
+        get_query(shard_start, shard_end)
+        for shard_start, shard_end in _get_time_shards(datetime_start, datetime_end, frequency, window_size)
+    ]
+    _log_queries(query_strs)
 
-    query_str = f'from(bucket:"{config.db["bucket_atlas_index"]}")'
-    query_str += get_datetime_filter(datetime_start, datetime_end)
-    query_str += _get_measurements_filter(["score"])
-    query_str += _get_unit_numbers_filter(unit_numbers)
-    query_str += _get_fields_filter(fields)
-    query_str += _get_moving_average_filter(frequency, window_size)
-    query_str += '|> keep(columns: ["_time", "unit_number", "_field", "_value"])'
+    if output == "dataframe":
+        return _concat_data_frames(
+            _run_queries(lambda query_str: _query_data_frame(query_str, columns, categorical_columns), query_strs),
+            columns,
+        )
 
-    logging.info("Running the query:\n" + query_str.replace("|>", "\n|>"))
-    result = query(query_str)
-    values = [record.values for table in result for record in table.records]
+    values = _get_record_values(_run_queries(query, query_strs))
 
     # Remove "result" and "table" keys
     values = [
@@ -148,7 +301,10 @@ def fetch_atlas_index(
     window_size: Optional[str] = None,
     unit_numbers: Optional[list[str]] = None,
     categories: Optional[list[str]] = None,
-) -> list[dict]:
+    output: Literal["records", "dataframe"] = "records",
+    use_cache: bool = False,
+    aggregate: Optional[str] = None,
+) -> list[dict] | pd.DataFrame:
     """Fetch ATLAS index data from the ATLAS index database.
 
     Args:
@@ -157,32 +313,67 @@ def fetch_atlas_index(
         datetime_end (datetime, optional): End of the time range.
             Defaults to None, which retrieves data until now.
         frequency (str, optional): If provided with "window_size", resample the
-            data using a moving average. Example: "6h".
+            data using a moving average. If provided with "aggregate", resample the data using consecutive windows.
+            Example: "6h".
         window_size (str, optional): If provided with "frequency", resample the
             data using a moving average. Example: "1d".
         unit_numbers (list[str], optional): List of unit numbers to retrieve data from.
             Defaults to None, which retrieves data from all unit numbers.
         categories (list[str], optional): List of index categories ("atlas_index", "iaq", "lux", "noise", "thermal") to retrieve data from. Defaults to None, which retrieves data from all categories.
+        output (str, optional): "records" (default) to get a list of dictionaries, or "dataframe" to get a
+            DataFrame parsed column by column, with categorical "unit_number" and "category" columns.
+        use_cache (bool, optional): If True, query the time range partition by partition (see
+            `inperso.config.cache`), and serve the partitions that are over from the local cache. Requires
+            datetime_start. Cached partitions are invalidated when the ATLAS index configuration changes.
+        aggregate (str, optional): If provided with "frequency", resample the data with one value per consecutive
+            window of "frequency", computed by InfluxDB's `aggregateWindow`: "mean", "min", "max", "count" or "last".
+            Faster than a moving average, which it replaces ("window_size" must then be None or "frequency").
 
     Returns:
-        list[dict]: List of dictionaries containing the data, with the keys:
+        list[dict] | pd.DataFrame: List of dictionaries (or DataFrame) containing the data, with the keys:
             - "time" (datetime)
             - "value" (any)
             - "category" (str)
             - "unit_number" (str)
     """
+    _check_output(output)
+    window_size = _check_aggregate(frequency, window_size, aggregate)
+
+    def get_query(datetime_start: Optional[datetime], datetime_end: Optional[datetime]) -> str:
+        return str(
+            _get_atlas_query(
+                "index", datetime_start, datetime_end, frequency, window_size, unit_numbers, categories, aggregate
+            )
+        )
+
+    columns = {"_time": "time", "unit_number": "unit_number", "_field": "category", "_value": "value"}
+    categorical_columns = ["unit_number", "category"]
+
+    if use_cache and _is_cacheable(datetime_start, datetime_end, frequency, window_size):
+        df = _query_data_frame_cached(
+            get_query,
+            _get_atlas_cache_namespace(),
+            datetime_start,
+            datetime_end,
+            frequency,
+            columns,
+            categorical_columns,
+        )
+        return df if output == "dataframe" else df.to_dict("records")
+
+    query_strs = [
+        get_query(shard_start, shard_end)
+        for shard_start, shard_end in _get_time_shards(datetime_start, datetime_end, frequency, window_size)
+    ]
+    _log_queries(query_strs)
 
-    query_str = f'from(bucket:"{config.db["bucket_atlas_index"]}")'
-    query_str += get_datetime_filter(datetime_start, datetime_end)
-    query_str += _get_measurements_filter(["index"])
-    query_str += _get_unit_numbers_filter(unit_numbers)
-    query_str += _get_fields_filter(categories)
-    query_str += _get_moving_average_filter(frequency, window_size)
-    query_str += '|> keep(columns: ["_time", "unit_number", "_field", "_value"])'
+    if output == "dataframe":
+        return _concat_data_frames(
+            _run_queries(lambda query_str: _query_data_frame(query_str, columns, categorical_columns), query_strs),
+            columns,
+        )
 
-    logging.info("Running the query:\n" + query_str.replace("|>", "\n|>"))
-    result = query(query_str)
-    values = [record.values for table in result for record in table.records]
+    values = _get_record_values(_run_queries(query, query_strs))
 
     # Remove "result" and "table" keys
     values = [
@@ -198,50 +389,306 @@ def fetch_atlas_index(
     return values
 
 
-def _get_moving_average_filter(
+def _get_atlas_query(
+    measurement: str,
+    datetime_start: Optional[datetime] = None,
+    datetime_end: Optional[datetime] = None,
     frequency: Optional[str] = None,
     window_size: Optional[str] = None,
-) -> str:
-    if frequency is None and window_size is None:
-        return ""
+    unit_numbers: Optional[list[str]] = None,
+    fields: Optional[list[str]] = None,
+    aggregate: Optional[str] = None,
+) -> FluxQuery:
+    query = (
+        FluxQuery(config.db["bucket_atlas_index"])
+        .range(datetime_start, datetime_end)
+        .filter("_measurement", [measurement])
+        .filter("unit_number", unit_numbers)
+        .filter("_field", None if fields is None else _get_fields_with_synonyms(fields))
+    )
+    query = _add_resampling(query, frequency, window_size, aggregate)
+
+    return query.keep(["_time", "unit_number", "_field", "_value"])
+
+
+def _check_output(output: str) -> None:
+    if output not in OUTPUT_TYPES:
+        raise ValueError(f"Invalid output: '{output}'. Must be one of: {OUTPUT_TYPES}")
+
+
+def _query_data_frame(query_str: str, columns: dict[str, str], categorical_columns: list[str]) -> pd.DataFrame:
+    """Run a query into a DataFrame, keeping and renaming the given columns."""
+
+    df = query_data_frame(query_str)
+    df = df.reindex(columns=list(columns.keys())).rename(columns=columns)
+
+    for column in categorical_columns:
+        df[column] = df[column].astype("category")
+
+    return df
+
+
+def _is_cacheable(
+    datetime_start: Optional[datetime],
+    datetime_end: Optional[datetime],
+    frequency: Optional[str],
+    window_size: Optional[str],
+) -> bool:
+    if not _is_splittable(datetime_start, datetime_end, frequency, window_size):
+        logging.warning(
+            "Not using the cache, which requires datetime_start, and for moving averages a window_size equal to the "
+            "frequency, dividing a day, and a time range aligned with it."
+        )
+        return False
+
+    return True
+
+
+def _is_splittable(
+    datetime_start: Optional[datetime],
+    datetime_end: Optional[datetime],
+    frequency: Optional[str],
+    window_size: Optional[str],
+) -> bool:
+    """Whether the time range can be split at day boundaries (from datetime_start) without changing the result."""
+
+    if datetime_start is None:
+        return False
 
     if frequency is None or window_size is None:
-        raise ValueError("Both 'frequency' and 'window_size' must be provided.")
+        return True
 
-    logging.warning('Using moving average filter. "qualtrics" brand will be excluded.')
-    filter = '|> filter(fn: (r) => r["_measurement"] != "qualtrics")'
+    # Moving averages are only split exactly for consecutive windows dividing a day, and aligned with the time range
+    try:
+        every = parse_duration(frequency)
+        period = parse_duration(window_size)
+    except ValueError:
+        return False
+
+    datetimes = [datetime_start] if datetime_end is None else [datetime_start, datetime_end]
+
+    return (
+        every == period
+        and not timedelta(days=1) % every
+        and not any(_to_utc_second(d).timestamp() % every.total_seconds() for d in datetimes)
+    )
+
+
+def _get_time_shards(
+    datetime_start: Optional[datetime],
+    datetime_end: Optional[datetime],
+    frequency: Optional[str],
+    window_size: Optional[str],
+) -> list[tuple[Optional[datetime], Optional[datetime]]]:
+    """Split a time range into consecutive shards of `config.fetch["shard_duration_days"]`, queried concurrently.
+
+    The time range is kept whole if splitting it would change the result (see `_is_splittable`).
+    """
+
+    if not _is_splittable(datetime_start, datetime_end, frequency, window_size):
+        return [(datetime_start, datetime_end)]
+
+    assert datetime_start is not None
+    datetime_start = _to_utc_second(datetime_start)
+    datetime_end = datetime.now(timezone.utc) if datetime_end is None else _to_utc_second(datetime_end)
+    shard_duration = timedelta(days=config.fetch["shard_duration_days"])
+
+    shards: list[tuple[Optional[datetime], Optional[datetime]]] = []
+    while datetime_start < datetime_end:
+        shards.append((datetime_start, min(datetime_start + shard_duration, datetime_end)))
+        datetime_start += shard_duration
+
+    return shards or [(datetime_start, datetime_end)]
+
+
+def _get_device_shards(devices: Optional[list[str]]) -> list[Optional[list[str]]]:
+    """Split a list of devices into shards of `config.fetch["devices_per_shard"]`, queried concurrently."""
+
+    if devices is None or len(devices) <= config.fetch["devices_per_shard"]:
+        return [devices]
+
+    return list(batched(sorted(devices), config.fetch["devices_per_shard"]))
+
+
+def _run_queries(run_query: Callable[[str], T], query_strs: list[str]) -> list[T]:
+    """Run queries concurrently on `config.fetch["max_concurrent_queries"]` threads, sharing the database client.
+
+    Results are in the order of the queries.
+    """
+
+    if len(query_strs) == 1:
+        return [run_query(query_strs[0])]
+
+    with ThreadPoolExecutor(max_workers=config.fetch["max_concurrent_queries"]) as executor:
+        return list(executor.map(run_query, query_strs))
+
+
+def _log_queries(query_strs: list[str]) -> None:
+    message = "Running the query:\n" + query_strs[0].replace("|>", "\n|>")
+
+    if len(query_strs) > 1:
+        message += f"\nSplit into {len(query_strs)} queries by time range and device."
 
-    filter += f"|> timedMovingAverage(every: {frequency}, period: {window_size})"
-    return filter
+    logging.info(message)
 
 
-def _get_measurements_filter(brands: Optional[list[str]] = None) -> str:
-    if brands is None:
-        return ""
+def _get_record_values(results: list) -> list[dict]:
+    """Get the values of the records of the results of `_run_queries`, sorted by time if there are several results.
+
+    Each query returns its records series by series, so the records of several shards are sorted by time (keeping the
+    order of the queries at equal times).
+    """
+
+    values = [record.values for result in results for table in result for record in table.records]
+
+    if len(results) > 1:
+        values.sort(key=lambda record: record["_time"])
+
+    return values
+
+
+def _concat_data_frames(dfs: list[pd.DataFrame], columns: dict[str, str]) -> pd.DataFrame:
+    """Concatenate the DataFrames of `_query_data_frame` sorted by time, keeping the categorical columns categorical."""
+
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=list(columns.values()))
+
+    if len(dfs) == 1:
+        return dfs[0]
+
+    categorical_columns = [column for column in dfs[0].columns if isinstance(dfs[0][column].dtype, pd.CategoricalDtype)]
+    dfs = [df for df in dfs if len(df) > 0] or dfs[:1]
+    df = pd.concat(dfs, ignore_index=True)
+
+    # Categories differing between DataFrames give non-categorical columns
+    for column in categorical_columns:
+        df[column] = df[column].astype("category")
+
+    return df.sort_values("time", kind="stable", ignore_index=True)
+
+
+def _query_data_frame_cached(
+    get_query: Callable[[datetime, datetime], str],
+    namespace: str,
+    datetime_start: datetime,
+    datetime_end: Optional[datetime],
+    frequency: Optional[str],
+    columns: dict[str, str],
+    categorical_columns: list[str],
+) -> pd.DataFrame:
+    """Same as `_query_data_frame`, running the query partition by partition through the local cache.
+
+    Partitions ending more than `config.cache["closed_partition_delay_hours"]` ago are complete, and read from (or
+    saved to) the cache. The other partitions are queried again every time.
+    """
 
-    return f'|> filter(fn: (r) => r["_measurement"] =~ /^({"|".join(brands)})$/)'
+    cache = get_query_cache()
+    now = datetime.now(timezone.utc)
+    datetime_start = _to_utc_second(datetime_start)
+    datetime_end = now if datetime_end is None else _to_utc_second(datetime_end)
+    datetime_closed = now - timedelta(hours=config.cache["closed_partition_delay_hours"])
 
+    partitions = get_partitions(datetime_start, datetime_end, config.cache["partition"])
+    dfs: list[Optional[pd.DataFrame]] = []
+    missing: list[tuple[int, str, Optional[str]]] = []  # Index, query and cache key of the partitions to query
 
-def _get_devices_filter(devices: Optional[list[str]] = None) -> str:
-    if devices is None:
-        return ""
+    for partition_start, partition_end in partitions:
+        if partition_end > datetime_closed:
+            missing.append((len(dfs), get_query(partition_start, min(partition_end, datetime_end)), None))
+            dfs.append(None)
+            continue
 
-    return f'|> filter(fn: (r) => r["device"] =~ /^({"|".join(devices)})$/)'
+        # The database is part of the key, as queries only differ by bucket name
+        query_str = get_query(partition_start, partition_end)
+        key = cache.get_key(namespace, f"{config.db['host']}\n{config.db['org']}\n{query_str}")
+        df = cache.get(key)
 
+        if df is None:
+            missing.append((len(dfs), query_str, key))
 
-def _get_unit_numbers_filter(unit_numbers: Optional[list[str]] = None) -> str:
-    if unit_numbers is None:
-        return ""
+        dfs.append(df)
 
-    return f'|> filter(fn: (r) => r["unit_number"] =~ /^({"|".join(unit_numbers)})$/)'
+    logging.info(f"Querying {len(missing)} of {len(partitions)} partitions, the others are read from the cache.")
+    queried_dfs = _run_queries(
+        lambda query_str: _query_data_frame(query_str, columns, categorical_columns),
+        [query_str for _, query_str, _ in missing],
+    )
 
+    for (i, _, key), df in zip(missing, queried_dfs):
+        dfs[i] = df
+        if key is not None:
+            cache.put(key, df)
 
-def _get_fields_filter(fields: Optional[list[str]] = None) -> str:
-    if fields is None:
-        return ""
+    df = _concat_data_frames([df for df in dfs if df is not None], columns)
 
-    fields = _get_fields_with_synonyms(fields)
-    return f'|> filter(fn: (r) => r["_field"] =~ /^({"|".join(fields)})$/)'
+    # Resampled values are timestamped at the end of their window
+    if frequency is None:
+        df = df[(df["time"] >= datetime_start) & (df["time"] < datetime_end)]
+    else:
+        df = df[(df["time"] > datetime_start) & (df["time"] <= datetime_end)]
+    df = df.reset_index(drop=True)
+
+    return df
+
+
+def _get_atlas_cache_namespace() -> str:
+    """Cache namespace of the ATLAS index data, removing the cached data computed with another configuration."""
+
+    namespace = f"atlas-{config.atlas_index_hash}"
+    get_query_cache().invalidate("atlas-", keep_prefix=f"{namespace}-")
+
+    return namespace
+
+
+def _to_utc_second(datetime_: datetime) -> datetime:
+    """Convert a datetime to UTC, truncated to the second like in `FluxQuery.range`."""
+
+    return datetime.fromtimestamp(int(datetime_.timestamp()), timezone.utc)
+
+
+def _check_aggregate(frequency: Optional[str], window_size: Optional[str], aggregate: Optional[str]) -> Optional[str]:
+    """Check the resampling arguments, and get the window size: with an aggregate, the windows are consecutive."""
+
+    if aggregate is None:
+        return window_size
+
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Invalid aggregate: '{aggregate}'. Must be one of: {AGGREGATES}")
+
+    if frequency is None:
+        raise ValueError("'frequency' must be provided with 'aggregate'.")
+
+    if window_size is not None and window_size != frequency:
+        raise ValueError("'window_size' must be None or equal to 'frequency' when 'aggregate' is provided.")
+
+    return frequency
+
+
+def _add_resampling(
+    query: FluxQuery,
+    frequency: Optional[str] = None,
+    window_size: Optional[str] = None,
+    aggregate: Optional[str] = None,
+) -> FluxQuery:
+    if frequency is None and window_size is None:
+        return query
+
+    if frequency is None or window_size is None:
+        raise ValueError("Both 'frequency' and 'window_size' must be provided.")
+
+    if aggregate is not None:
+        # Unlike timedMovingAverage, pushed down to the storage engine, which aggregates without returning raw points
+        logging.warning(f'Using {aggregate} aggregate windows. "qualtrics" brand will be excluded.')
+
+        return query.exclude("_measurement", ["qualtrics"]).pipe(
+            f"aggregateWindow(every: {frequency}, fn: {aggregate}, createEmpty: false)"
+        )
+
+    logging.warning('Using moving average filter. "qualtrics" brand will be excluded.')
+
+    return query.exclude("_measurement", ["qualtrics"]).pipe(
+        f"timedMovingAverage(every: {frequency}, period: {window_size})"
+    )
 
 
 def _get_fields_with_synonyms(fields: list[str]) -> list[str]:
@@ -252,10 +699,12 @@ def _get_fields_with_synonyms(fields: list[str]) -> list[str]:
             if field in synonmys:
                 fields_with_synonyms.update(synonmys)
 
-    return list(fields_with_synonyms)
+    return sorted(fields_with_synonyms)
 
 
-def _get_tags_filter(**kwargs) -> str:
+def _get_tag_devices(**kwargs) -> Optional[list[str]]:
+    """Get the devices matching any of the tag filters, or None if there is no filter."""
+
     tag_keys = tags.keys()  # ex: "Unit Number"
     possible_kwarg_keys = [key.lower().replace(" ", "_") for key in tag_keys]  # ex: "unit_number"
     kwarg_to_tag_key = dict(zip(possible_kwarg_keys, tag_keys))  # ex: {"unit_number": "Unit Number"}
@@ -277,13 +726,26 @@ def _get_tags_filter(**kwargs) -> str:
             devices.update(set(tags[tag_key][value]))
 
     if len(devices) == 0:
-        return ""
+        return None
+
+    return sorted(devices)
+
+
+def _get_unique_synonyms() -> dict[str, str]:
+    """Map each field name with synonyms to its unique synonym (ex: {"temp": "temperature"})."""
+
+    return {field: synonym for synonym, fields in config.field_synonyms.items() for field in fields}
+
 
-    return f'|> filter(fn: (r) => r["device"] =~ /^({"|".join(devices)})$/)'
+def _replace_categories_with_unique_synonym(column: pd.Series) -> pd.Series:
+    """Replace the field names of a categorical column with their unique synonym."""
 
+    synonyms = _get_unique_synonyms()
+    categories = column.cat.categories.map(lambda field: synonyms.get(field, field))
+    unique_categories = categories.unique()
 
-def _replace_fields_with_unique_synonym(values: list[dict]) -> None:
-    synonyms = {field: synonym for synonym, fields in config.field_synonyms.items() for field in fields}
+    # Missing values have code -1, which picks the appended -1
+    new_codes_per_code = np.append(unique_categories.get_indexer(categories), -1)
+    new_codes = new_codes_per_code[column.cat.codes.to_numpy()]
 
-    for value in values:
-        value["field"] = synonyms.get(value["field"], value["field"])
+    return pd.Series(pd.Categorical.from_codes(new_codes, categories=unique_categories), index=column.index)
@@ -3,10 +3,12 @@
 import logging
 from datetime import datetime
 from functools import cache
-from typing import Optional
+from typing import Iterator, Optional
 
 from inperso import config
-from inperso.database.read import get_datetime_filter, query
+from inperso.database.flux import FluxQuery
+from inperso.database.read import query, query_stream
+from inperso.utils import batched
 
 SURVEY_MEASUREMENT = "qualtrics"
 
@@ -36,33 +38,73 @@ def fetch_surveys(
             - "question" (str)
             - "answer" (any)
     """
-    query_str = f'from(bucket:"{config.db["bucket"]}")'
-    query_str += get_datetime_filter(datetime_start, datetime_end)
-    query_str += f'|> filter(fn: (r) => r["_measurement"] == "{SURVEY_MEASUREMENT}")'
-    query_str += _get_surveys_filter(surveys)
-
+    query_str = _get_surveys_query(surveys, datetime_start, datetime_end)
     logging.info("Running the query:\n" + query_str.replace("|>", "\n|>"))
+
     result = query(query_str)
-    values = [record.values for table in result for record in table.records]
-
-    # Only keep relevant fields
-    values = [
-        {
-            "survey": record["survey"],
-            "time": record["_time"],
-            "response_id": record["response_id"],
-            "latitude": record.get("latitude", None),
-            "longitude": record.get("longitude", None),
-            "question": record["_field"],
-            "answer": record["_value"],
-        }
-        for record in values
-    ]
+    values = [_format_record(record.values) for table in result for record in table.records]
 
     return values
 
 
-def _get_surveys_filter(surveys: Optional[list[str]] = None) -> str:
+def iter_fetch_surveys(
+    surveys: Optional[list[str]] = None,
+    datetime_start: Optional[datetime] = None,
+    datetime_end: Optional[datetime] = None,
+    batch_size: Optional[int] = None,
+) -> Iterator[dict] | Iterator[list[dict]]:
+    """Lazily fetch survey data from the database, with constant memory usage.
+
+    Takes the same arguments as `fetch_surveys`, and yields the same dictionaries.
+
+    Args:
+        batch_size (int, optional): If provided, yield lists of at most `batch_size` dictionaries instead of single
+            dictionaries.
+    """
+
+    query_str = _get_surveys_query(surveys, datetime_start, datetime_end)
+    logging.info("Running the query:\n" + query_str.replace("|>", "\n|>"))
+
+    values = (_format_record(record.values) for record in query_stream(query_str))
+
+    if batch_size is None:
+        return values
+
+    return batched(values, batch_size)
+
+
+def _get_surveys_query(
+    surveys: Optional[list[str]] = None,
+    datetime_start: Optional[datetime] = None,
+    datetime_end: Optional[datetime] = None,
+) -> str:
+    _check_surveys(surveys)
+
+    query = (
+        FluxQuery(config.db["bucket"])
+        .range(datetime_start, datetime_end)
+        .filter("_measurement", [SURVEY_MEASUREMENT])
+        .filter("survey", surveys)
+    )
+
+    return str(query)
+
+
+def _format_record(record: dict) -> dict:
+    """Only keep relevant keys of a record."""
+
+    return {
+        "survey": record["survey"],
+        "time": record["_time"],
+        "response_id": record["response_id"],
+        "latitude": record.get("latitude", None),
+        "longitude": record.get("longitude", None),
+        "question": record["_field"],
+        "answer": record["_value"],
+    }
+
+
+def _check_surveys(surveys: Optional[list[str]] = None) -> None:
     if surveys is None or len(surveys) == 0:
         raise ValueError(f"Must provide a list of surveys to fetch data from. Must choose from: {get_survey_names()}.")
 
@@ -72,11 +114,6 @@ def _get_surveys_filter(surveys: Optional[list[str]] = None) -> str:
     if invalid_surveys:
         raise ValueError(f"Invalid surveys: {invalid_surveys}. Must choose from: {valid_surveys}.")
 
-    # surveys = [re.escape(survey) for survey in surveys]
-    # return f'|> filter(fn: (r) => r["survey"] =~ /({"|".join(surveys)})/)'
-    conditions = [f'r["survey"] == "{survey}"' for survey in surveys]
-    return f"|> filter(fn: (r) => {' or '.join(conditions)})"
-
 
 @cache
 def get_survey_names() -> list[str]:
@@ -0,0 +1,162 @@
+"""Local cache of query results, stored per time partition as pickled DataFrames.
+
+Used by the `inperso.fetch` functions when called with `use_cache=True`.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
+
+import pandas as pd
+
+from inperso import config
+
+PARTITIONS = ["day", "month"]
+
+
+class QueryCache:
+    def __init__(self, path: str, max_size_bytes: int) -> None:
+        """DataFrames stored in a directory, one file per key.
+
+        When the directory exceeds `max_size_bytes`, the least recently used files are removed.
+        """
+
+        self.path = os.path.expanduser(path)
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(namespace: str, query_str: str) -> str:
+        """Get the key of a query. Keys of a namespace share the prefix f"{namespace}-"."""
+
+        return f"{namespace}-{hashlib.sha256(query_str.encode()).hexdigest()[:32]}"
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Get a stored DataFrame, or None if there is none."""
+
+        file_path = self._get_file_path(key)
+
+        try:
+            df = pd.read_pickle(file_path)
+            os.utime(file_path)  # Mark as recently used
+
+        except FileNotFoundError:
+            return None
+
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable cache file {file_path}: {e}")
+            return None
+
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """Store a DataFrame, then evict the least recently used files if the cache is too large."""
+
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self._get_file_path(key)
+        temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        df.to_pickle(temporary_path)
+        os.replace(temporary_path, file_path)
+
+        self._evict()
+
+    def invalidate(self, prefix: str, keep_prefix: str) -> None:
+        """Remove the files whose key starts with prefix, but not with keep_prefix.
+
+        Used to remove results computed with a previous configuration.
+        """
+
+        for file_name in self._list_file_names():
+            if file_name.startswith(prefix) and not file_name.startswith(keep_prefix):
+                _remove(os.path.join(self.path, file_name))
+
+    def clear(self) -> None:
+        """Remove all stored files."""
+
+        for file_name in self._list_file_names():
+            _remove(os.path.join(self.path, file_name))
+
+    def _evict(self) -> None:
+        with self._lock:
+            files = []
+            for file_name in self._list_file_names():
+                try:
+                    stat = os.stat(os.path.join(self.path, file_name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file_name))
+
+            size = sum(file_size for _, file_size, _ in files)
+
+            for _, file_size, file_name in sorted(files):
+                if size <= self.max_size_bytes:
+                    break
+
+                _remove(os.path.join(self.path, file_name))
+                size -= file_size
+
+    def _list_file_names(self) -> list[str]:
+        if not os.path.isdir(self.path):
+            return []
+
+        return [file_name for file_name in os.listdir(self.path) if file_name.endswith(".pkl")]
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.pkl")
+
+
+def _remove(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def get_partitions(
+    datetime_start: datetime,
+    datetime_end: datetime,
+    partition: Literal["day", "month"],
+) -> list[tuple[datetime, datetime]]:
+    """Split a time range into the UTC days or months overlapping it (the first and last ones extending past it)."""
+
+    if partition not in PARTITIONS:
+        raise ValueError(f"Invalid partition: '{partition}'. Must be one of: {PARTITIONS}")
+
+    datetime_start = datetime_start.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if partition == "month":
+        datetime_start = datetime_start.replace(day=1)
+
+    partitions = []
+
+    while datetime_start < datetime_end:
+        if partition == "day":
+            datetime_next = datetime_start + timedelta(days=1)
+        elif datetime_start.month == 12:
+            datetime_next = datetime_start.replace(year=datetime_start.year + 1, month=1)
+        else:
+            datetime_next = datetime_start.replace(month=datetime_start.month + 1)
+
+        partitions.append((datetime_start, datetime_next))
+        datetime_start = datetime_next
+
+    return partitions
+
+
+_caches: dict[str, QueryCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_query_cache() -> QueryCache:
+    """Get the query cache at the path of the current configuration."""
+
+    path = config.cache["path"]
+
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = QueryCache(path, max_size_bytes=int(config.cache["max_size_mb"] * 1024**2))
+
+        return _caches[path]
@@ -1,7 +1,23 @@
-from datetime import datetime
+import re
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterable, Iterator, TypeVar
 
 import yaml
 
+T = TypeVar("T")
+
+_DURATION_UNITS = {
+    "us": timedelta(microseconds=1),
+    "ms": timedelta(milliseconds=1),
+    "s": timedelta(seconds=1),
+    "m": timedelta(minutes=1),
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+    "w": timedelta(weeks=1),
+}
+_DURATION_REGEX = re.compile(r"(\d+)(us|ms|s|m|h|d|w)")
+
 
 def load_yaml(path: str) -> dict:
     """Load a YAML file and return it as a dictionary."""
@@ -39,3 +55,29 @@ def iso_to_utc_datetime(s: str) -> datetime:
     """Convert an ISO 8601 string to a datetime object."""
 
     return datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Lazily split an iterable into lists of at most `size` elements."""
+
+    if size < 1:
+        raise ValueError("Batch size must be at least 1.")
+
+    iterator = iter(iterable)
+
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def parse_duration(duration: str) -> timedelta:
+    """Convert a Flux duration literal (ex: "6h", "1h30m") to a timedelta.
+
+    Calendar units ("mo", "y") have no fixed length and are not supported.
+    """
+
+    parts = _DURATION_REGEX.findall(duration)
+
+    if len(parts) == 0 or "".join(value + unit for value, unit in parts) != duration:
+        raise ValueError(f"Invalid or unsupported duration: '{duration}'.")
+
+    return sum((int(value) * _DURATION_UNITS[unit] for value, unit in parts), timedelta())
@@ -0,0 +1,107 @@
+"""Benchmark the aggregation and encoding of a year of hourly ATLAS scores and indices for all units.
+
+Compares the row by row implementations (`DataFrame.apply` for the weighted index, `DataFrame.iterrows` building one
+dictionary per point) with the column-wise ones (weight vector dot product, `encode_data_frame`). Runs locally on
+synthetic data, without writing to the database. The row by row encoding, taking minutes, is timed on the first month
+and extrapolated to the year.
+
+Usage: python scripts/benchmark_atlas_index_write.py
+"""
+
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from inperso import config
+from inperso.database.write import encode_data_frame, encode_query
+from inperso.tags import unit_numbers
+
+WEIGHTS = config.atlas_index["weights"]
+FIELDS = [field for fields in config.atlas_index["index_fields"].values() for field in fields]
+TAGS = {"atlas_index_hash": config.atlas_index_hash}
+N_DAYS = 365
+N_DAYS_ROW_BY_ROW = 31
+
+
+def get_data() -> tuple[pd.DataFrame, pd.DataFrame]:
+    rng = np.random.default_rng(0)
+    times = pd.date_range(datetime(2024, 1, 1, tzinfo=timezone.utc), periods=N_DAYS * 24, freq="1h")
+    units = sorted(set(unit_numbers.values()))
+
+    index = pd.MultiIndex.from_product([times, units], names=["time", "unit_number"])
+    indices = pd.DataFrame(rng.uniform(0, 5, (len(index), len(WEIGHTS))), index=index, columns=list(WEIGHTS))
+    indices = indices.mask(rng.uniform(size=indices.shape) < 0.05).reset_index()
+
+    index = pd.MultiIndex.from_product([times, units, FIELDS], names=["time", "unit_number", "field"])
+    scores = pd.DataFrame({"score": rng.uniform(0, 100, len(index))}, index=index).reset_index()
+
+    return scores, indices
+
+
+def aggregate_rows(indices: pd.DataFrame) -> pd.Series:
+    return indices.apply(lambda row: sum(row[category] * WEIGHTS[category] for category in WEIGHTS), axis=1)
+
+
+def aggregate_columns(indices: pd.DataFrame) -> np.ndarray:
+    return indices[list(WEIGHTS)].to_numpy(dtype=float) @ np.array(list(WEIGHTS.values()))
+
+
+def encode_rows(scores: pd.DataFrame, indices: pd.DataFrame) -> int:
+    lines = []
+
+    for _, row in scores.iterrows():
+        query = {
+            "measurement": "score",
+            "tags": {"unit_number": str(row["unit_number"]), **TAGS},
+            "fields": {row["field"]: row["score"]},
+            "time": row["time"],
+        }
+        lines.append(encode_query(query))
+
+    for _, row in indices.iterrows():
+        fields = {category: row[category] for category in WEIGHTS if not pd.isna(row[category])}
+        query = {"measurement": "index", "tags": {"unit_number": str(row["unit_number"]), **TAGS}, "fields": fields}
+        lines.append(encode_query({**query, "time": row["time"]}))
+
+    return sum(len(line) for line in lines)
+
+
+def encode_columns(scores: pd.DataFrame, indices: pd.DataFrame) -> int:
+    scores = scores.pivot(index=["time", "unit_number"], columns="field", values="score").reset_index()
+    lines = encode_data_frame(scores, "score", FIELDS, ["unit_number"], TAGS)
+    lines += encode_data_frame(indices, "index", list(WEIGHTS), ["unit_number"], TAGS)
+
+    return sum(len(line) for line in lines)
+
+
+def time_function(function, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    scores, indices = get_data()
+    print(f"Scores:   {len(scores):,} rows")
+    print(f"Indices:  {len(indices):,} rows")
+
+    duration_apply, index_apply = time_function(aggregate_rows, indices)
+    duration_dot, index_dot = time_function(aggregate_columns, indices)
+    np.testing.assert_allclose(index_apply.to_numpy(dtype=float), index_dot, rtol=1e-12)
+    print(f"Weighted index, apply:        {duration_apply:.2f} s")
+    print(f"Weighted index, dot product:  {duration_dot:.3f} s ({duration_apply / duration_dot:.0f}x)")
+
+    is_first_month = {
+        name: df["time"] < df["time"].iloc[0] + pd.Timedelta(days=N_DAYS_ROW_BY_ROW)
+        for name, df in [("scores", scores), ("indices", indices)]
+    }
+    duration_iterrows, _ = time_function(
+        encode_rows, scores[is_first_month["scores"]], indices[is_first_month["indices"]]
+    )
+    duration_iterrows *= N_DAYS / N_DAYS_ROW_BY_ROW
+    duration_columns, size_columns = time_function(encode_columns, scores, indices)
+    print(f"Line protocol, iterrows:      {duration_iterrows:.2f} s (extrapolated from {N_DAYS_ROW_BY_ROW} days)")
+    print(f"Line protocol, columns:       {duration_columns:.2f} s ({size_columns / 1e6:.0f} MB)")
+    print(f"Speedup:                      {duration_iterrows / duration_columns:.1f}x")
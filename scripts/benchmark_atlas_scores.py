@@ -0,0 +1,58 @@
+"""Benchmark the vectorized ATLAS scoring against the scalar reference implementation.
+
+The scalar implementation is timed on a sample of the synthetic frame and extrapolated, since running it on millions
+of rows takes minutes.
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from inperso.atlas_index.scores import compute_scores_per_measurement, function_type_map
+from inperso.config import atlas_index
+
+N_ROWS = 5_000_000
+N_ROWS_SCALAR = 200_000
+
+
+def build_synthetic_frame(n_rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    fields = list(atlas_index["thresholds"].keys())
+
+    return pd.DataFrame(
+        {
+            "field": rng.choice(fields, n_rows),
+            "value": rng.uniform(0, 2500, n_rows),
+        }
+    )
+
+
+def compute_scores_scalar(df: pd.DataFrame) -> pd.DataFrame:
+    score_functions = {
+        field: function_type_map[params["type"]](**params) for field, params in atlas_index["thresholds"].items()
+    }
+    df["score"] = df.apply(lambda row: score_functions[row["field"]](row["value"]), axis=1)
+    return df
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS
+    df = build_synthetic_frame(n_rows)
+
+    start = time.perf_counter()
+    vectorized = compute_scores_per_measurement(df.copy())
+    duration_vectorized = time.perf_counter() - start
+
+    sample = df.iloc[:N_ROWS_SCALAR].copy()
+    start = time.perf_counter()
+    scalar = compute_scores_scalar(sample)
+    duration_scalar = (time.perf_counter() - start) * n_rows / len(sample)
+
+    np.testing.assert_array_equal(vectorized["score"].to_numpy()[: len(sample)], scalar["score"].to_numpy())
+
+    print(f"Rows:               {n_rows:,}")
+    print(f"Vectorized:         {duration_vectorized:.2f} s")
+    print(f"Scalar (estimated): {duration_scalar:.2f} s")
+    print(f"Speedup:            {duration_scalar / duration_vectorized:.0f}x")
@@ -0,0 +1,73 @@
+"""Benchmark device filters written as a regular expression alternation against equality predicates.
+
+Runs against the database of the environment variables (INFLUX_HOST, INFLUX_TOKEN, ...), meant to be a local InfluxDB
+container (see backend/docker-compose.yml). With "--populate", first writes a month of synthetic 5-minute uHoo data for
+N_DEVICES devices. Half of the devices are selected, with names containing spaces and dots like the real ones.
+
+Usage: python scripts/benchmark_fetch_filters.py [--populate]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from inperso import config
+from inperso.database.flux import FluxQuery
+from inperso.database.read import query_data_frame
+from inperso.database.write import encode_line, encode_series_key, write_lines, write_pipeline
+
+N_DEVICES = 240
+N_REPEATS = 5
+DATETIME_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DATETIME_END = DATETIME_START + timedelta(days=30)
+DEVICES = [f"Benchmark - {i // 10}.{i % 10}" for i in range(N_DEVICES)]
+
+
+def populate() -> None:
+    rng = np.random.default_rng(0)
+    timestamps = range(int(DATETIME_START.timestamp()), int(DATETIME_END.timestamp()), 300)
+
+    with write_pipeline():
+        for device in DEVICES:
+            series_key = encode_series_key("uhoo", {"device": device})
+            values = rng.uniform(0, 1000, len(timestamps)).round(2).tolist()
+            write_lines([encode_line(series_key, {"co2": value}, t) for value, t in zip(values, timestamps)])
+
+
+def get_query() -> FluxQuery:
+    return (
+        FluxQuery(config.db["bucket"])
+        .range(DATETIME_START, DATETIME_END)
+        .filter("_measurement", ["uhoo"])
+        .keep(["_time", "_measurement", "device", "_field", "_value"])
+    )
+
+
+def time_query(query_str: str) -> tuple[float, int]:
+    durations = []
+
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        df = query_data_frame(query_str)
+        durations.append(time.perf_counter() - start)
+
+    return min(durations), len(df)
+
+
+if __name__ == "__main__":
+    if "--populate" in sys.argv:
+        populate()
+
+    devices = DEVICES[::2]
+    regex_query = get_query().pipe(f'filter(fn: (r) => r["device"] =~ /^({"|".join(devices)})$/)')
+    equality_query = get_query().filter("device", devices)
+
+    duration_regex, n_rows_regex = time_query(str(regex_query))
+    duration_equality, n_rows_equality = time_query(str(equality_query))
+
+    print(f"Devices:              {len(devices)} of {N_DEVICES}")
+    print(f"Regular expression:   {duration_regex:.2f} s ({n_rows_regex:,} rows)")
+    print(f"Equality predicates:  {duration_equality:.2f} s ({n_rows_equality:,} rows)")
+    print(f"Speedup:              {duration_regex / duration_equality:.1f}x")
@@ -0,0 +1,70 @@
+"""Benchmark hourly resampling with a moving average (timedMovingAverage) against aggregate windows (aggregateWindow).
+
+Runs against the database of the environment variables (INFLUX_HOST, INFLUX_TOKEN, ...), meant to be a local InfluxDB
+container (see backend/docker-compose.yml). With "--populate", first writes a month of synthetic 5-minute uHoo data for
+N_DEVICES devices. Both paths resample it like `preprocess_measurements`, with 1-hour windows.
+
+Usage: python scripts/benchmark_fetch_resampling.py [--populate]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from inperso import fetch
+from inperso.database.write import encode_line, encode_series_key, write_lines, write_pipeline
+
+N_DEVICES = 100
+N_REPEATS = 3
+FIELDS = ["co2", "humidity", "pm25", "temperature"]
+DATETIME_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DATETIME_END = DATETIME_START + timedelta(days=30)
+
+
+def populate() -> None:
+    rng = np.random.default_rng(0)
+    timestamps = range(int(DATETIME_START.timestamp()), int(DATETIME_END.timestamp()), 300)
+
+    with write_pipeline():
+        for i in range(N_DEVICES):
+            series_key = encode_series_key("uhoo", {"device": f"Benchmark {i}"})
+            values = rng.uniform(0, 1000, (len(timestamps), len(FIELDS))).round(2).tolist()
+            write_lines(
+                [
+                    encode_line(series_key, dict(zip(FIELDS, row)), timestamp)
+                    for row, timestamp in zip(values, timestamps)
+                ]
+            )
+
+
+def time_fetch(**kwargs) -> tuple[float, pd.DataFrame]:
+    durations = []
+
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        df = fetch(DATETIME_START, DATETIME_END, "1h", brands=["uhoo"], fields=FIELDS, output="dataframe", **kwargs)
+        durations.append(time.perf_counter() - start)
+
+    return min(durations), df
+
+
+if __name__ == "__main__":
+    if "--populate" in sys.argv:
+        populate()
+
+    duration_moving_average, df_moving_average = time_fetch(window_size="1h")
+    duration_aggregate, df_aggregate = time_fetch(aggregate="mean")
+
+    assert len(df_moving_average) == len(df_aggregate)
+    sort_columns = ["time", "device", "field"]
+    values_moving_average = df_moving_average.sort_values(sort_columns)["value"].to_numpy()
+    values_aggregate = df_aggregate.sort_values(sort_columns)["value"].to_numpy()
+
+    print(f"Rows:                  {len(df_aggregate):,}")
+    print(f"Max difference:        {np.abs(values_moving_average - values_aggregate).max():.2e}")
+    print(f"timedMovingAverage:    {duration_moving_average:.2f} s")
+    print(f"aggregateWindow mean:  {duration_aggregate:.2f} s")
+    print(f"Speedup:               {duration_moving_average / duration_aggregate:.1f}x")
@@ -0,0 +1,67 @@
+"""Benchmark a year-long fetch as a single query against the same fetch split into concurrent shards.
+
+Runs against the database of the environment variables (INFLUX_HOST, INFLUX_TOKEN, ...), meant to be a local InfluxDB
+container (see backend/docker-compose.yml). With "--populate", first writes a year of synthetic 5-minute uHoo data for
+N_DEVICES devices.
+
+Usage: python scripts/benchmark_fetch_shards.py [--populate]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from inperso import config, fetch
+from inperso.database.write import encode_line, encode_series_key, write_lines, write_pipeline
+
+N_DEVICES = 40
+FIELDS = ["co2", "humidity", "pm25", "temperature"]
+DATETIME_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DATETIME_END = DATETIME_START + timedelta(days=365)
+
+
+def populate() -> None:
+    rng = np.random.default_rng(0)
+    timestamps = range(int(DATETIME_START.timestamp()), int(DATETIME_END.timestamp()), 300)
+
+    with write_pipeline():
+        for i in range(N_DEVICES):
+            series_key = encode_series_key("uhoo", {"device": f"Benchmark {i}"})
+            values = rng.uniform(0, 1000, (len(timestamps), len(FIELDS))).round(2).tolist()
+            write_lines(
+                [
+                    encode_line(series_key, dict(zip(FIELDS, row)), timestamp)
+                    for row, timestamp in zip(values, timestamps)
+                ]
+            )
+
+
+def time_fetch() -> tuple[float, int]:
+    start = time.perf_counter()
+    df = fetch(DATETIME_START, DATETIME_END, brands=["uhoo"], fields=FIELDS, output="dataframe")
+    return time.perf_counter() - start, len(df)
+
+
+if __name__ == "__main__":
+    if "--populate" in sys.argv:
+        populate()
+
+    shard_config = config.fetch.copy()
+
+    config.fetch.update({"shard_duration_days": 366, "devices_per_shard": 10**6, "max_concurrent_queries": 1})
+    duration_single, n_rows_single = time_fetch()
+
+    config.fetch.update(shard_config)
+    duration_sharded, n_rows_sharded = time_fetch()
+
+    assert n_rows_single == n_rows_sharded
+
+    print(f"Rows:           {n_rows_single:,}")
+    print(f"Single query:   {duration_single:.2f} s")
+    print(
+        f"Sharded query:  {duration_sharded:.2f} s ({shard_config['shard_duration_days']} days, "
+        f"{shard_config['max_concurrent_queries']} concurrent queries)"
+    )
+    print(f"Speedup:        {duration_single / duration_sharded:.1f}x")
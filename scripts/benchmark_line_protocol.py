@@ -0,0 +1,42 @@
+"""Benchmark the line protocol encoding of uHoo minute samples against the influx client's dictionary serialization."""
+
+import sys
+import time
+
+import numpy as np
+from influxdb_client import Point, WritePrecision
+
+from inperso.database.write import encode_line, encode_series_key
+
+N_ROWS = 200_000
+FIELDS = ["temperature", "humidity", "pm25", "tvoc", "co2", "co", "airPressure", "ozone", "no2", "pm1", "pm4", "pm10"]
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS
+    rng = np.random.default_rng(0)
+    rows = [dict(zip(FIELDS, values)) for values in rng.uniform(0, 1000, (n_rows, len(FIELDS))).round(2).tolist()]
+    timestamps = list(range(1704067200, 1704067200 + 60 * n_rows, 60))
+    tags = {"device": "Room 1", "location": "Bedroom", "floor": "2"}
+
+    start = time.perf_counter()
+    lines_dict = [
+        Point.from_dict(
+            {"measurement": "uhoo", "tags": tags, "fields": fields, "time": timestamp},
+            write_precision=WritePrecision.S,
+        ).to_line_protocol()
+        for fields, timestamp in zip(rows, timestamps)
+    ]
+    duration_dict = time.perf_counter() - start
+
+    start = time.perf_counter()
+    series_key = encode_series_key("uhoo", tags)
+    lines = [encode_line(series_key, fields, timestamp) for fields, timestamp in zip(rows, timestamps)]
+    duration_lines = time.perf_counter() - start
+
+    assert [line.decode() for line in lines] == lines_dict
+
+    print(f"Rows:            {n_rows:,}")
+    print(f"Dictionary path: {duration_dict:.2f} s")
+    print(f"Line protocol:   {duration_lines:.2f} s")
+    print(f"Speedup:         {duration_dict / duration_lines:.1f}x")
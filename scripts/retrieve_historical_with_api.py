@@ -5,4 +5,4 @@ import inperso
 datetime_start = datetime(2023, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
 datetime_end = datetime.now(timezone.utc)
 retriever = inperso.data_acquisition.AirthingsRetriever()
-retriever.fetch(datetime_start, datetime_end)
+retriever.fetch(datetime_start, datetime_end, resume=True)  # Restart where a previous run stopped
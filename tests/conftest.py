@@ -0,0 +1,48 @@
+import pytest
+from pytest_mock import MockFixture
+
+from inperso import config
+
+
+@pytest.fixture(autouse=True)
+def isolated_checkpoints(mocker: MockFixture, tmp_path) -> None:
+    """Never read or write the checkpoints of the user."""
+
+    mocker.patch.dict(config.checkpoints, {"path": str(tmp_path / "checkpoints.json")})
+
+
+@pytest.fixture(autouse=True)
+def isolated_query_cache(mocker: MockFixture, tmp_path) -> None:
+    """Never read or write the query cache of the user."""
+
+    mocker.patch.dict(config.cache, {"path": str(tmp_path / "queries")})
+
+
+@pytest.fixture(autouse=True)
+def isolated_atlas_index_state(mocker: MockFixture, tmp_path) -> None:
+    """Never read or write the incremental ATLAS index state of the user."""
+
+    mocker.patch.dict(config.atlas_index_incremental, {"state_path": str(tmp_path / "atlas_index_state.json")})
+
+
+@pytest.fixture(autouse=True)
+def isolated_credentials():
+    """Never share the cached tokens and device lists between tests."""
+
+    from inperso.data_acquisition.credentials import clear_credential_managers
+
+    clear_credential_managers()
+    yield
+    clear_credential_managers()
+
+
+@pytest.fixture(autouse=True)
+def close_batch_writer():
+    """Write pending queries while logging is still captured, instead of at interpreter exit."""
+
+    yield
+
+    from inperso.database import write
+
+    if write._batch_writer is not None:
+        write._batch_writer.close()
@@ -50,3 +50,316 @@ def test_config_load():
 
         else:
             raise ValueError(f"Unknown threshold type: {threshold_type}")
+
+
+def test_array_score_functions_match_scalar_functions():
+    """Ensure the vectorized score functions return exactly the same scores as the scalar ones."""
+
+    import numpy as np
+
+    from inperso.atlas_index.scores import array_function_type_map, function_type_map
+    from inperso.config import atlas_index
+
+    rng = np.random.default_rng(0)
+
+    for params in atlas_index["thresholds"].values():
+        breakpoints = [value for key, value in params.items() if key.endswith(("score", "lower", "upper"))]
+        values = np.concatenate(
+            [
+                rng.uniform(min(breakpoints) - 10, max(breakpoints) + 10, 10_000),
+                np.array(breakpoints, dtype=float),
+                [np.nan],
+            ]
+        )
+
+        scalar_fn = function_type_map[params["type"]](**params)
+        array_fn = array_function_type_map[params["type"]](**params)
+
+        expected = np.array([scalar_fn(value) for value in values], dtype=float)
+        np.testing.assert_array_equal(array_fn(values), expected)
+
+
+def test_compute_scores_per_measurement():
+    """Ensure scores are computed per field, matching the scalar reference implementation."""
+
+    import numpy as np
+    import pandas as pd
+
+    from inperso.atlas_index.scores import compute_scores_per_measurement, function_type_map
+    from inperso.config import atlas_index
+
+    thresholds = atlas_index["thresholds"]
+    rng = np.random.default_rng(0)
+    fields = rng.choice(list(thresholds.keys()), 5_000)
+    df = pd.DataFrame({"field": fields, "value": rng.uniform(-10, 3000, len(fields))})
+
+    expected = [
+        function_type_map[thresholds[field]["type"]](**thresholds[field])(value)
+        for field, value in zip(df["field"], df["value"])
+    ]
+
+    df = compute_scores_per_measurement(df)
+    np.testing.assert_array_equal(df["score"].to_numpy(), np.array(expected, dtype=float))
+
+
+def _mock_preprocess_measurements(mocker):
+    """Mock the measurements of 10 days from 2024-07-01, of units in two DCs."""
+
+    from datetime import datetime, timedelta, timezone
+
+    import numpy as np
+    import pandas as pd
+
+    from inperso.atlas_index.preprocessing import remap_fields
+    from inperso.tags import dcs as dc_per_device
+
+    datetime_start = datetime(2024, 7, 1, tzinfo=timezone.utc)
+    hours = pd.date_range(datetime_start, datetime_start + timedelta(days=10), freq="1h")
+    rng = np.random.default_rng(0)
+    devices = {
+        "airly": ["115452", "115537"],
+        "airthings": ["Airthings - 1", "Airtings - 4", "Airthings - 31"],
+        "uhoo": ["uHoo-1", "uHoo-2"],
+    }
+    fields = {"airly": ["temperature"], "airthings": ["co2", "sla_day", "temperature"], "uhoo": ["light_percent_day"]}
+    measurements = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "time": hours,
+                    "brand": brand,
+                    "device": device,
+                    "field": field,
+                    "value": rng.uniform(15, 30, len(hours)),
+                }
+            )
+            for brand in devices
+            for device in devices[brand]
+            for field in fields[brand]
+        ],
+        ignore_index=True,
+    )
+
+    def fake_preprocess_measurements(datetime_start: datetime, datetime_end: datetime, dcs=None) -> pd.DataFrame:
+        is_in_range = (measurements["time"] > datetime_start) & (measurements["time"] <= datetime_end)
+        if dcs is not None:
+            is_in_range &= (measurements["brand"] == "airly") | measurements["device"].map(dc_per_device).isin(dcs)
+
+        return remap_fields(measurements[is_in_range].reset_index(drop=True))
+
+    return mocker.patch("inperso.atlas_index.index.preprocess_measurements", side_effect=fake_preprocess_measurements)
+
+
+def test_compute_index_incremental(mocker):
+    """Ensure incremental runs only write the new hours, with the same index as a computation from scratch."""
+
+    from datetime import datetime, timedelta, timezone
+
+    import pandas as pd
+
+    from inperso.atlas_index import index
+
+    datetime_start = datetime(2024, 7, 1, tzinfo=timezone.utc)
+    hours = pd.date_range(datetime_start, datetime_start + timedelta(days=10), freq="1h")
+    preprocess_mock = _mock_preprocess_measurements(mocker)
+    mocker.patch("inperso.atlas_index.index.write_data_frame")
+    mocker.patch("inperso.atlas_index.scores.write_data_frame")
+    watermarks_mock = mocker.patch("inperso.atlas_index.index.get_unit_watermarks")
+
+    expected = index.compute_index(datetime_start + timedelta(days=4), hours[-1] + timedelta(hours=1))
+    expected = expected.set_index(["time", "unit_number"]).sort_index()
+
+    # First run, fetching the previous days for the outdoor temperature
+    watermark = datetime_start + timedelta(days=6)
+    watermarks_mock.return_value = {"4.1": watermark, "6.1": watermark + timedelta(hours=2)}
+    indices = index.compute_index_incremental(datetime_start + timedelta(days=8, minutes=30))
+
+    assert preprocess_mock.call_args.args[0] == watermark - timedelta(days=4)
+    assert indices["time"].min() == watermark
+    assert indices[indices["unit_number"] == "6.1"]["time"].min() == watermark + timedelta(hours=2)
+    assert indices["time"].max() == datetime_start + timedelta(days=8)
+
+    # Second run, reusing the outdoor temperatures of the first one
+    watermark = datetime_start + timedelta(days=8)
+    watermarks_mock.return_value = {"4.1": watermark, "6.1": watermark}
+    indices = index.compute_index_incremental(hours[-1])
+
+    assert preprocess_mock.call_args.args[0] == watermark - timedelta(hours=1)
+    assert indices["time"].min() == watermark
+    indices = indices.set_index(["time", "unit_number"]).sort_index()
+    pd.testing.assert_frame_equal(indices, expected.loc[indices.index], check_like=True, check_names=False)
+
+
+def test_compute_partition(mocker):
+    """Ensure partitions by month or DC, computed separately, give the same results as a single computation."""
+
+    from datetime import datetime, timedelta, timezone
+
+    import pandas as pd
+
+    from inperso.atlas_index import index
+
+    _mock_preprocess_measurements(mocker)
+    datetime_start = datetime(2024, 7, 5, tzinfo=timezone.utc)
+    datetime_middle = datetime_start + timedelta(days=2, hours=5)
+    datetime_end = datetime_start + timedelta(days=5)
+
+    def sort(df: pd.DataFrame) -> pd.DataFrame:
+        df = df.astype({column: str for column in df.select_dtypes("category").columns})
+        return df.sort_values(list(df.columns[:3])).reset_index(drop=True)
+
+    expected_scores, expected_indices = index.compute_partition(datetime_start, datetime_end)
+    assert expected_indices["time"].min() == datetime_start
+    assert expected_indices["time"].max() == datetime_end - timedelta(hours=1)
+    assert set(expected_indices["unit_number"]) == {"4.1", "6.1", "1-01"}
+
+    results = [
+        index.compute_partition(datetime_start, datetime_middle),
+        index.compute_partition(datetime_middle, datetime_end),
+    ]
+    for i, expected in enumerate([expected_scores, expected_indices]):
+        pd.testing.assert_frame_equal(sort(pd.concat([r[i] for r in results])), sort(expected))
+
+    results = [index.compute_partition(datetime_start, datetime_end, [dc]) for dc in ["1", "2", "3"]]
+    for i, expected in enumerate([expected_scores, expected_indices]):
+        pd.testing.assert_frame_equal(sort(pd.concat([r[i] for r in results])), sort(expected))
+
+
+def test_compute_light_percent(mocker):
+    """Ensure the light percentages are computed by the database, or locally with the same results as before."""
+
+    from datetime import datetime, timedelta, timezone
+
+    import numpy as np
+    import pandas as pd
+
+    from inperso.atlas_index.preprocessing import compute_light_percent, get_light_percent
+    from inperso.config import atlas_index
+
+    config_light_percent = atlas_index["light_percent"]
+    datetime_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rng = np.random.default_rng(0)
+    minutes = pd.date_range(datetime_start, datetime_start + timedelta(days=2), freq="1min", inclusive="left")
+    df_minute = pd.DataFrame(
+        {
+            "time": np.tile(minutes, 2),
+            "device": np.repeat(["uHoo-1", "uHoo-2"], len(minutes)),
+            "value": rng.uniform(0, 300, 2 * len(minutes)),
+        }
+    )
+
+    # Reference implementation, with one Python call per measurement
+    expected = df_minute.copy()
+    expected["time"] = expected["time"].dt.floor("h")
+    expected["is_day"] = expected["time"].dt.hour.apply(
+        lambda h: config_light_percent["day_start_hour"] <= h < config_light_percent["night_start_hour"]
+    )
+    expected["threshold"] = expected["is_day"].apply(
+        lambda is_day: config_light_percent["day_threshold"] if is_day else config_light_percent["night_threshold"]
+    )
+    expected["above_threshold"] = expected["value"] > expected["threshold"]
+    expected = (
+        expected.groupby(["time", "device"])
+        .agg(value=("above_threshold", lambda x: (x.sum() / len(x)) * 100))
+        .reset_index()
+    )
+
+    df_light_percent = get_light_percent(df_minute)
+    pd.testing.assert_frame_equal(df_light_percent, expected)
+
+    query_mock = mocker.patch(
+        "inperso.atlas_index.preprocessing.query_data_frame",
+        return_value=df_light_percent.rename(columns={"time": "_time", "value": "_value"}),
+    )
+    df = compute_light_percent(datetime_start, datetime_start + timedelta(days=2), pd.DataFrame())
+
+    query_str = query_mock.call_args.args[0]
+    assert "|> map(fn: (r) => ({r with _value: if float(v: r._value) > (if" in query_str
+    assert '|> aggregateWindow(every: 1h, fn: mean, createEmpty: false, timeSrc: "_start")' in query_str
+    assert len(df) == len(expected)
+    assert set(df["field"]) == {"light_percent_day", "light_percent_night"}
+    is_day = df["time"].dt.hour == config_light_percent["day_start_hour"]
+    assert (df.loc[is_day, "field"] == "light_percent_day").all()
+
+
+def test_remap_fields():
+    """Ensure units are converted, and SLA and indoor temperature fields split, by hour, DC and month."""
+
+    import pandas as pd
+
+    from inperso.atlas_index.preprocessing import remap_fields
+    from inperso.config import atlas_index
+
+    df = pd.DataFrame(
+        {
+            "time": pd.to_datetime(
+                ["2024-01-01 12:00", "2024-01-01 23:00", "2024-07-01 12:00", "2024-07-01 12:00", "2024-07-01 12:00"]
+                + ["2024-07-01 12:00", "2024-07-01 12:00"],
+                utc=True,
+            ),
+            "brand": ["airthings", "airthings", "airthings", "airthings", "airly", "uhoo", "uhoo"],
+            "device": ["Airthings - 1", "Airthings - 1", "Airthings - 1", "Airthings - 31", "115452", "uHoo-1", "?"],
+            "field": ["sla", "sla", "temperature", "temperature", "temperature", "no2", "temperature"],
+            "value": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+        }
+    )
+
+    df = remap_fields(df)
+
+    assert list(df["field"]) == [
+        "sla_day",
+        "sla_night",
+        "temperature_cooling_nat",  # DC 1
+        "temperature_cooling_mec",  # DC 2
+        "temperature",  # Outdoor
+        "no2",
+        "temperature",  # Unknown DC
+    ]
+    assert df["value"].iloc[5] == 6.0 * atlas_index["unit_conversion_factors"]["uhoo"]["no2"]
+    assert list(df["value"].iloc[:5]) == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+    df_winter = pd.DataFrame(
+        {
+            "time": [pd.Timestamp("2024-12-15", tz="UTC")],
+            "brand": ["airthings"],
+            "device": ["Airthings - 1"],
+            "field": ["temperature"],
+            "value": [20.0],
+        }
+    )
+    assert remap_fields(df_winter)["field"].iloc[0] == "temperature_heating"
+
+
+def test_compute_index_incremental_lagging_unit(mocker):
+    """Ensure a unit behind the others by more than a day gets the same index as a computation from scratch."""
+
+    from datetime import datetime, timedelta, timezone
+
+    import pandas as pd
+
+    from inperso.atlas_index import index
+
+    datetime_start = datetime(2024, 7, 1, tzinfo=timezone.utc)
+    hours = pd.date_range(datetime_start, datetime_start + timedelta(days=10), freq="1h")
+    preprocess_mock = _mock_preprocess_measurements(mocker)
+    mocker.patch("inperso.atlas_index.index.write_data_frame")
+    mocker.patch("inperso.atlas_index.scores.write_data_frame")
+    watermarks_mock = mocker.patch("inperso.atlas_index.index.get_unit_watermarks")
+
+    expected = index.compute_index(datetime_start + timedelta(days=4), hours[-1] + timedelta(hours=1))
+    expected = expected.set_index(["time", "unit_number"]).sort_index()
+
+    watermark = datetime_start + timedelta(days=5)
+    watermarks_mock.return_value = {"4.1": watermark, "6.1": watermark}
+    index.compute_index_incremental(datetime_start + timedelta(days=8, hours=12))
+
+    # Unit 6.1 is a day and a half behind (ex: its index could not be written)
+    watermark = datetime_start + timedelta(days=7)
+    watermarks_mock.return_value = {"4.1": watermark + timedelta(days=1, hours=12), "6.1": watermark}
+    indices = index.compute_index_incremental(hours[-1])
+
+    assert preprocess_mock.call_args.args[0] == watermark - timedelta(hours=1)
+    assert indices[indices["unit_number"] == "6.1"]["time"].min() == watermark
+    indices = indices.set_index(["time", "unit_number"]).sort_index()
+    assert indices.xs("6.1", level="unit_number")["atlas_index"].notna().all()
+    pd.testing.assert_frame_equal(indices, expected.loc[indices.index], check_like=True, check_names=False)
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+
+from inperso.checkpoints import CheckpointStore
+
+
+def test_checkpoint_ranges(tmp_path):
+    """Ensure stored ranges are persisted and merged when overlapping or contiguous."""
+
+    store = CheckpointStore(str(tmp_path / "subdirectory" / "checkpoints.json"))
+
+    def day(d: int) -> datetime:
+        return datetime(2024, 1, d, tzinfo=timezone.utc)
+
+    store.add_range("uhoo", day(1), day(3))
+    store.add_range("uhoo", day(10), day(12))
+    store.add_range("uhoo", day(3), day(5))
+    store.add_range("uhoo", day(2), day(4), key="device a")
+
+    store = CheckpointStore(str(tmp_path / "subdirectory" / "checkpoints.json"))
+    assert store.get_ranges("uhoo") == [(day(1), day(5)), (day(10), day(12))]
+    assert store.get_range_end("uhoo", day(2)) == day(5)
+    assert store.get_range_end("uhoo", day(7)) is None
+    assert store.get_latest("uhoo") == day(12)
+    assert store.get_latest("airly") is None
+    assert store.get_latest_per_key("uhoo") == {"*": day(12), "device a": day(4)}
@@ -0,0 +1,94 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator
+from urllib.parse import urlsplit
+
+import pytest
+
+# Called with the request handler, returns the status code and the body of the response: JSON data, or the bytes of a
+# zip file
+Route = Callable[[BaseHTTPRequestHandler], tuple[int, Any]]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive
+
+    server: "StubServer"
+
+    def do_GET(self) -> None:
+        self._respond()
+
+    def do_POST(self) -> None:
+        self._respond()
+
+    def _respond(self) -> None:
+        self.body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        with self.server.lock:
+            self.server.requests.append((self.command, urlsplit(self.path).path))
+            self.server.n_in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.n_in_flight)
+
+        try:
+            route = self.server.routes.get(urlsplit(self.path).path)
+            status_code, data = route(self) if route is not None else (404, {})
+        finally:
+            with self.server.lock:
+                self.server.n_in_flight -= 1
+
+        if isinstance(data, bytes):
+            body = data
+            content_type = "application/zip"
+        else:
+            body = json.dumps(data).encode()
+            content_type = "application/json"
+
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    def __init__(self) -> None:
+        """Local HTTP server answering the requests to its routes (paths), recording connections and requests."""
+
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/"
+        self.routes: dict[str, Route] = {}
+
+        self.lock = threading.Lock()
+        self.n_connections = 0
+        self.requests: list[tuple[str, str]] = []  # Method and path
+        self.n_in_flight = 0
+        self.max_in_flight = 0
+
+    def process_request(self, request, client_address) -> None:
+        with self.lock:
+            self.n_connections += 1
+        super().process_request(request, client_address)
+
+
+@pytest.fixture
+def stub_server() -> Iterator[StubServer]:
+    """Local HTTP server standing in for an API."""
+
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+from pytest_mock import MockFixture
+
+from inperso.data_acquisition import uhoo
+from inperso.data_acquisition.credentials import AuthenticationError, CredentialManager
+
+
+def test_credential_manager_refresh(mocker: MockFixture):
+    """Ensure tokens are requested once for all threads, again before they expire, and when they are rejected."""
+
+    now = [0.0]
+    mocker.patch("inperso.data_acquisition.credentials.time.monotonic", side_effect=lambda: now[0])
+
+    tokens = iter(f"token-{i}" for i in range(100))
+    lock = threading.Lock()
+    n_requests = [0]
+
+    def request_token() -> str:
+        with lock:
+            n_requests[0] += 1
+            return next(tokens)
+
+    credentials = CredentialManager(request_token, token_lifetime_seconds=600, refresh_margin_seconds=60)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        assert set(executor.map(lambda _: credentials.get_token(), range(64))) == {"token-0"}
+    assert n_requests[0] == 1
+
+    now[0] = 539
+    assert credentials.get_token() == "token-0"
+    now[0] = 540
+    assert credentials.get_token() == "token-1"
+
+    def get_data(token: str, value: int) -> int:
+        if token == "token-1":
+            raise AuthenticationError("Expired token")
+        return value
+
+    assert credentials.call(get_data, 3) == 3
+    assert credentials.get_token() == "token-2"
+    assert n_requests[0] == 3
+
+    # A token replaced by another thread is not discarded
+    credentials.invalidate_token("token-1")
+    assert credentials.get_token() == "token-2"
+
+    with pytest.raises(AuthenticationError):
+        credentials.call(lambda token: get_data("token-1", 0))
+
+
+def test_uhoo_credentials_shared(mocker: MockFixture):
+    """Ensure the uHoo token and device list are requested once for all the fragments and devices of a fetch."""
+
+    devices = [
+        {"deviceName": f"device {i}", "macAddress": str(i), "roomName": "room", "floorNumber": 1} for i in range(8)
+    ]
+    get_token_mock = mocker.patch("inperso.data_acquisition.uhoo.get_token", return_value="token")
+    get_device_list_mock = mocker.patch("inperso.data_acquisition.uhoo.get_device_list", return_value=devices)
+    get_device_data_mock = mocker.patch("inperso.data_acquisition.uhoo.get_device_data", return_value={})
+    mocker.patch("inperso.data_acquisition.retriever.flush")
+
+    retriever = uhoo.UhooRetriever()
+    retriever.fetch(datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 1, 6, tzinfo=timezone.utc))
+
+    assert get_token_mock.call_count == 1
+    assert get_device_list_mock.call_count == 1
+    assert get_device_data_mock.call_count == 6 * len(devices)
+    assert {call.args[0] for call in get_device_data_mock.call_args_list} == {"token"}
@@ -0,0 +1,83 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from pytest_mock import MockFixture
+
+from inperso import config
+from inperso.data_acquisition import airly
+from inperso.data_acquisition.engine import Engine, run_retrievers
+from tests.test_data_acquisition.conftest import StubServer
+
+
+def test_airly_installations_fetched_concurrently(mocker: MockFixture, stub_server: StubServer):
+    """Ensure the installations are fetched concurrently within the limit of the source, from a stub Airly API."""
+
+    n_installations = 12
+    installations = [
+        {
+            "id": i,
+            "sponsor": {"name": "sponsor" if i % 4 else "other"},
+            "address": {"city": "Lausanne"},
+            "location": {"latitude": 46.5, "longitude": 6.6},
+        }
+        for i in range(n_installations)
+    ]
+
+    def get_measurements(request) -> tuple[int, dict]:
+        time.sleep(0.1)
+
+        if "installationId=5" in request.path:
+            return 500, {}
+
+        history = [
+            {
+                "fromDateTime": f"2024-01-01T{hour:02d}:00:00.000Z",
+                "tillDateTime": f"2024-01-01T{hour + 1:02d}:00:00.000Z",
+                "values": [{"name": "PM25", "value": 3}, {"name": "TEMPERATURE", "value": 4.5}],
+            }
+            for hour in range(23)
+        ]
+        return 200, {"history": history}
+
+    stub_server.routes["/installations/nearest"] = lambda request: (200, installations)
+    stub_server.routes["/measurements/installation"] = get_measurements
+
+    mocker.patch("inperso.data_acquisition.airly.api_url", stub_server.url)
+    mocker.patch.dict(config.airly, {"api_key": "key", "sponsor_name": "sponsor", "max_concurrent_installations": 4})
+    written: list[dict] = []
+    mocker.patch("inperso.data_acquisition.retriever.write", side_effect=written.extend)
+    mocker.patch("inperso.data_acquisition.retriever.flush")
+
+    retriever = airly.AirlyRetriever()
+    datetime_end = datetime.now(timezone.utc)
+    retriever.fetch(datetime_end - timedelta(hours=1), datetime_end)
+
+    # Installation 5 fails, without stopping the others
+    devices = {query["tags"]["device"] for query in written}
+    assert devices == {i for i in range(n_installations) if i % 4 and i != 5}
+    assert len(written) == 23 * len(devices)
+    assert written[0]["fields"] == {"pm25": 3.0, "temperature": 4.5}
+    assert 2 <= stub_server.max_in_flight <= 4
+
+
+def test_run_retrievers_concurrently():
+    """Ensure the sources are fetched concurrently, even with fewer engine threads than sources, and a failing source
+    does not stop the others."""
+
+    engine = Engine(max_threads=2)
+    barrier = threading.Barrier(3, timeout=5)
+    fetched = []
+
+    def fetch(name: str) -> None:
+        barrier.wait()  # Raises if the fetches do not run at the same time
+        engine.run_concurrently(name, fetched.append, [name], max_concurrency=1)
+
+    def fail() -> None:
+        raise RuntimeError("Unavailable")
+
+    fetches = {name: lambda name=name: fetch(name) for name in ["airly", "airthings", "uhoo"]}
+    engine.run(run_retrievers({**fetches, "qualtrics": fail}))
+    engine.close()
+
+    assert sorted(fetched) == ["airly", "airthings", "uhoo"]
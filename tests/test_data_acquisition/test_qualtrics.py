@@ -0,0 +1,108 @@
+import io
+import json
+import zipfile
+from datetime import datetime, timezone
+
+import requests
+from pytest_mock import MockFixture
+
+from inperso import config
+from inperso.data_acquisition import qualtrics
+from inperso.data_acquisition.qualtrics import QualtricsRetriever
+from tests.test_data_acquisition.conftest import StubServer
+
+
+def get_zip_file(data: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        zip_file.writestr("responses.json", json.dumps(data))
+
+    return buffer.getvalue()
+
+
+def test_fetch_survey_exports_concurrently(mocker: MockFixture, stub_server: StubServer):
+    """Ensure all exports are requested up front, polled with backoff, downloaded once complete, and closed surveys
+    are skipped, from a stub Qualtrics API."""
+
+    surveys = [
+        {"id": "SV_slow", "name": "Slow", "isActive": True, "lastModified": "2023-01-01T00:00:00Z"},
+        {"id": "SV_fast", "name": "Fast", "isActive": True, "lastModified": "2023-01-01T00:00:00Z"},
+        {"id": "SV_closed", "name": "Closed", "isActive": False, "lastModified": "2023-01-01T00:00:00Z"},
+        {"id": "SV_reopened", "name": "Reopened", "isActive": False, "lastModified": "2024-06-01T00:00:00Z"},
+        {"id": "SV_failed", "name": "Failed", "isActive": True, "lastModified": "2023-01-01T00:00:00Z"},
+        {"id": "SV_unreachable", "name": "Unreachable", "isActive": True, "lastModified": "2023-01-01T00:00:00Z"},
+    ]
+    n_polls_before_complete = {"SV_slow": 3, "SV_fast": 0, "SV_reopened": 1, "SV_unreachable": 0}
+    n_polls = {survey["id"]: 0 for survey in surveys}
+
+    stub_server.routes["/surveys"] = lambda request: (200, {"result": {"elements": surveys}})
+
+    for survey in surveys:
+        survey_id = survey["id"]
+        export_path = f"/surveys/{survey_id}/export-responses"
+
+        def get_progress(request, survey_id=survey_id) -> tuple[int, dict]:
+            if survey_id == "SV_failed":
+                return 200, {"result": {"status": "failed", "errorMessage": "Export failed"}}
+
+            n_polls[survey_id] += 1
+            if n_polls[survey_id] <= n_polls_before_complete[survey_id]:
+                return 200, {"result": {"status": "inProgress"}}
+
+            return 200, {"result": {"status": "complete", "fileId": f"file_{survey_id}"}}
+
+        responses = {
+            "responses": [
+                {
+                    "responseId": f"R_{survey_id}_{i}",
+                    "values": {"recordedDate": "2024-06-02T10:00:00Z", "QID1": i, "QID2": [1, 3]},
+                }
+                for i in range(2)
+            ]
+        }
+
+        stub_server.routes[export_path] = lambda request, survey_id=survey_id: (
+            200,
+            {"result": {"progressId": f"progress_{survey_id}"}},
+        )
+        stub_server.routes[f"{export_path}/progress_{survey_id}"] = get_progress
+        stub_server.routes[f"{export_path}/file_{survey_id}/file"] = lambda request, r=responses: (200, get_zip_file(r))
+
+    mocker.patch("inperso.data_acquisition.qualtrics.api_url", stub_server.url)
+    mocker.patch.dict(
+        config.qualtrics,
+        {"api_key": "key", "polling_interval_get_response": 0.01, "max_polling_interval_get_response": 0.04},
+    )
+    written: list[dict] = []
+    mocker.patch("inperso.data_acquisition.retriever.write", side_effect=written.extend)
+    mocker.patch("inperso.data_acquisition.retriever.flush")
+
+    # The download of a survey times out, without stopping the others
+    get_response_export = qualtrics.get_response_export
+
+    def get_response_export_or_timeout(api_key: str, survey_id: str, file_id: str) -> list[dict]:
+        if survey_id == "SV_unreachable":
+            raise requests.Timeout("Read timed out")
+        return get_response_export(api_key, survey_id, file_id)
+
+    mocker.patch.object(qualtrics, "get_response_export", side_effect=get_response_export_or_timeout)
+
+    retriever = QualtricsRetriever()
+    retriever.fetch(datetime(2024, 5, 1, tzinfo=timezone.utc), datetime(2024, 7, 1, tzinfo=timezone.utc))
+
+    assert sorted(query["tags"]["response_id"] for query in written) == [
+        f"R_{survey_id}_{i}" for survey_id in ["SV_fast", "SV_reopened", "SV_slow"] for i in range(2)
+    ]
+    assert written[0]["fields"]["QID2_3"] is True
+
+    # Exports started up front, the fast survey downloaded before the slow one is complete
+    paths = [path for _, path in stub_server.requests]
+    export_requests = [i for i, (method, _) in enumerate(stub_server.requests) if method == "POST"]
+    assert len(export_requests) == 5
+    assert max(export_requests) < paths.index("/surveys/SV_slow/export-responses/progress_SV_slow")
+    assert paths.index("/surveys/SV_fast/export-responses/file_SV_fast/file") < paths.index(
+        "/surveys/SV_slow/export-responses/file_SV_slow/file"
+    )
+    assert "/surveys/SV_closed/export-responses" not in paths
+    assert n_polls["SV_slow"] == 4
+    assert retriever._fetch_failed
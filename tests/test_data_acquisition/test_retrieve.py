@@ -40,6 +40,7 @@ def test_main(
     # Mock the lookup of the latest retrieval datetime
     datetime_start = datetime.now(timezone.utc) - timedelta(hours=0.5)
     mocker.patch(f"{retriever_module_path}.get_latest_retrieval_datetime", return_value=datetime_start)
+    mocker.patch(f"{retriever_module_path}.get_latest_retrieval_datetimes", return_value={})
 
     # Mock the fetch and store methods
     mocker.patch(f"{retriever_module_path}._fetch")
@@ -0,0 +1,264 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from pytest_mock import MockFixture
+
+from inperso import config
+from inperso.checkpoints import get_checkpoint_store
+from inperso.data_acquisition.retriever import Retriever
+
+
+class DummyRetriever(Retriever):
+    @property
+    def _measurement_name(self) -> str:
+        return "dummy"
+
+    @property
+    def _fetch_interval(self) -> timedelta:
+        return timedelta(hours=1)
+
+    def _fetch(self, datetime_start: datetime, datetime_end: datetime) -> None:
+        pass
+
+
+def test_add_write_query_concurrent(mocker: MockFixture):
+    """Ensure no query is lost or written twice when many threads add queries concurrently."""
+
+    mocker.patch.dict(config.db, {"minimum_write_batch_size": 97})
+    written: list[dict] = []
+    mocker.patch("inperso.data_acquisition.retriever.write", side_effect=written.extend)
+
+    n_threads = 64
+    n_queries_per_thread = 2_000
+    retriever = DummyRetriever()
+
+    def add_queries(thread_index: int) -> None:
+        for i in range(n_queries_per_thread):
+            retriever.add_write_query(
+                {
+                    "measurement": "dummy",
+                    "tags": {"device": str(thread_index)},
+                    "fields": {"value": float(i)},
+                    "time": i,
+                }
+            )
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(add_queries, range(n_threads)))
+
+    retriever._store()
+
+    keys = [(query["tags"]["device"], query["time"]) for query in written]
+    assert len(keys) == n_threads * n_queries_per_thread
+    assert len(set(keys)) == len(keys)
+
+
+def test_fetch_fragments_concurrently(mocker: MockFixture):
+    """Ensure all fragments are fetched by concurrent workers, and reported as stored in order."""
+
+    fetched: list[tuple[datetime, datetime]] = []
+    stored: list[datetime] = []
+    active_workers = []
+    lock = threading.Lock()
+
+    class ConcurrentRetriever(DummyRetriever):
+        @property
+        def _max_concurrent_fragments(self) -> int:
+            return 4
+
+        def _fetch(self, datetime_start: datetime, datetime_end: datetime) -> None:
+            with lock:
+                active_workers.append(threading.get_ident())
+            time.sleep(random.uniform(0, 0.01))
+            with lock:
+                fetched.append((datetime_start, datetime_end))
+
+        def _on_range_stored(self, datetime_start: datetime, datetime_end: datetime, device_ranges: dict) -> None:
+            stored.append(datetime_end)
+
+    mocker.patch.dict(config.db, {"write_flush_interval_seconds": 0})
+    flush_mock = mocker.patch("inperso.data_acquisition.retriever.flush")
+
+    datetime_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    datetime_end = datetime_start + timedelta(hours=40, minutes=30)
+    ConcurrentRetriever().fetch(datetime_start, datetime_end)
+
+    assert len(fetched) == 41
+    assert sorted(fetched)[0][0] == datetime_start
+    assert sorted(fetched)[-1][1] == datetime_end
+    assert len(set(active_workers)) > 1
+    assert stored == sorted(stored)
+    assert stored[-1] == datetime_end
+    assert flush_mock.call_count == len(stored)
+
+
+def test_fetch_resume(mocker: MockFixture):
+    """Ensure an interrupted fetch resumes from the last stored fragment."""
+
+    datetime_start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=10)
+    datetime_end = datetime_start + timedelta(hours=10)
+    datetime_failure = datetime_start + timedelta(hours=5)
+    fetched: list[datetime] = []
+
+    class FailingRetriever(DummyRetriever):
+        fail = True
+
+        def _fetch(self, datetime_start: datetime, datetime_end: datetime) -> None:
+            if datetime_start == datetime_failure and self.fail:
+                raise RuntimeError("Connection lost")
+            fetched.append(datetime_start)
+
+    mocker.patch.dict(config.db, {"write_flush_interval_seconds": 0})
+    mocker.patch("inperso.data_acquisition.retriever.flush")
+    retriever = FailingRetriever()
+
+    try:
+        retriever.fetch(datetime_start, datetime_end, resume=True)
+    except RuntimeError:
+        pass
+
+    assert fetched[:5] == [datetime_start + timedelta(hours=i) for i in range(5)]
+
+    fetched.clear()
+    retriever.fail = False
+    retriever.fetch(datetime_start, datetime_end, resume=True)
+    assert fetched == [datetime_start + timedelta(hours=i) for i in range(5, 10)]
+
+    # Fetching recent data starts from the checkpoint, or from the database when it is more recent than the
+    # checkpoint of a past range
+    fetched.clear()
+    get_latest_mock = mocker.patch.object(
+        FailingRetriever, "get_latest_retrieval_datetime", return_value=datetime_end - timedelta(hours=1)
+    )
+    retriever.fetch_recent()
+    get_latest_mock.assert_called_once()
+    assert fetched[0] == datetime_end
+
+    # The checkpoint of a previous call is trusted, without querying the database
+    fetched.clear()
+    retriever.fetch_recent()
+    get_latest_mock.assert_called_once()
+    assert len(fetched) <= 1
+
+
+def test_fetch_recent_stale_checkpoint(mocker: MockFixture):
+    """Ensure a checkpoint of a past range does not make fetch_recent start before the latest data in the database."""
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    get_checkpoint_store().add_range(
+        DummyRetriever()._checkpoint_namespace, now - timedelta(days=20), now - timedelta(days=19)
+    )
+    mocker.patch.object(DummyRetriever, "get_latest_retrieval_datetime", return_value=now - timedelta(hours=1))
+    fetch_mock = mocker.patch.object(DummyRetriever, "fetch")
+
+    DummyRetriever().fetch_recent()
+    datetime_start, _ = fetch_mock.call_args.args
+    assert datetime_start == now - timedelta(hours=1)
+
+
+def test_fetch_recent_device_watermarks(mocker: MockFixture):
+    """Ensure each device is only fetched from its own watermark, cached in the checkpoints between runs."""
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    fetched: list[tuple[str, datetime, datetime]] = []
+    lock = threading.Lock()
+
+    class DeviceRetriever(DummyRetriever):
+        @property
+        def _tracks_devices(self) -> bool:
+            return True
+
+        def get_device_names(self) -> list[str]:
+            return ["a", "b"]
+
+        def _fetch(self, datetime_start: datetime, datetime_end: datetime) -> None:
+            for device in ["a", "b"]:
+                datetime_start_device = self._get_device_fetch_start(device, datetime_start)
+                if datetime_start_device >= datetime_end:
+                    continue
+
+                with lock:
+                    fetched.append((device, datetime_start_device, datetime_end))
+                self._mark_device_fetched(device, datetime_start_device, datetime_end)
+
+    mocker.patch("inperso.data_acquisition.retriever.flush")
+    get_latest_mock = mocker.patch.object(
+        DeviceRetriever,
+        "get_latest_retrieval_datetimes",
+        return_value={"a": now - timedelta(hours=5), "b": now - timedelta(hours=2, minutes=30)},
+    )
+    retriever = DeviceRetriever()
+
+    retriever.fetch_recent()
+    get_latest_mock.assert_called_once()
+    starts = {device: min(start for d, start, _ in fetched if d == device) for device in ["a", "b"]}
+    assert starts == {"a": now - timedelta(hours=5), "b": now - timedelta(hours=2, minutes=30)}
+    assert sum((end - start for d, start, end in fetched if d == "b"), timedelta()) < timedelta(hours=3)
+
+    datetime_end = max(end for _, _, end in fetched)
+    fetched.clear()
+    retriever.fetch_recent()
+    get_latest_mock.assert_called_once()
+    assert {start for _, start, _ in fetched} <= {datetime_end.replace(microsecond=0)}
+
+
+def test_fetch_recent_ignores_removed_devices(mocker: MockFixture):
+    """Ensure devices no longer listed by the source do not hold back the start, which is capped to the lookback."""
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    fetch_mock = mocker.patch.object(DummyRetriever, "fetch")
+    mocker.patch.object(DummyRetriever, "_tracks_devices", True)
+    mocker.patch.object(DummyRetriever, "get_device_names", return_value=["a", "b"])
+    mocker.patch.dict(config.retrieve, {"max_lookback_hours": 48})
+    watermarks = {"a": now - timedelta(hours=5), "b": now - timedelta(hours=2), "removed": now - timedelta(days=90)}
+    mocker.patch.object(DummyRetriever, "get_latest_retrieval_datetimes", return_value=watermarks)
+
+    DummyRetriever().fetch_recent()
+    datetime_start, _ = fetch_mock.call_args.args
+    assert datetime_start == now - timedelta(hours=5)
+    assert fetch_mock.call_args.kwargs["device_watermarks"] == {"a": watermarks["a"], "b": watermarks["b"]}
+
+    # A device offline for longer than the lookback
+    mocker.patch.object(DummyRetriever, "get_device_names", return_value=["a", "b", "removed"])
+    DummyRetriever().fetch_recent()
+    datetime_start, datetime_end = fetch_mock.call_args.args
+    assert datetime_start == datetime_end - timedelta(hours=48)
+
+
+def test_fetch_not_marked_stored_after_failure(mocker: MockFixture):
+    """Ensure ranges are not marked as stored after a device could not be fetched or points were dropped."""
+
+    hours = [datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=i) for i in range(6)]
+
+    class DeviceRetriever(DummyRetriever):
+        def _fetch(self, datetime_start: datetime, datetime_end: datetime) -> None:
+            for device in ["a", "b"]:
+                if device == "b" and datetime_start == hours[2]:
+                    self._mark_fetch_failed()
+                    continue
+
+                self._mark_device_fetched(device, datetime_start, datetime_end)
+
+    mocker.patch.dict(config.db, {"host": "http://localhost:8086", "bucket": "test", "write_flush_interval_seconds": 0})
+    mocker.patch("inperso.data_acquisition.retriever.flush")
+    get_points_dropped_mock = mocker.patch("inperso.data_acquisition.retriever.get_points_dropped", return_value=0)
+    store = get_checkpoint_store()
+    namespace = "http://localhost:8086/test/dummy"
+
+    DeviceRetriever().fetch(hours[0], hours[4])
+
+    # Fragments can be fetched before the previous ones are marked as stored, so the failure can be seen earlier
+    assert store.get_ranges(namespace) in [[], [(hours[0], hours[1])], [(hours[0], hours[2])]]
+    assert store.get_ranges(namespace, key="a") == [(hours[0], hours[4])]
+    assert store.get_ranges(namespace, key="b") == [(hours[0], hours[2]), (hours[3], hours[4])]
+    assert store.get_ranges("dummy") == []
+
+    # The writer drops points
+    get_points_dropped_mock.side_effect = [0, 5]
+    DeviceRetriever().fetch(hours[4], hours[5])
+
+    assert store.get_latest(namespace) <= hours[2]
+    assert store.get_latest(namespace, key="a") == hours[4]
@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from pytest_mock import MockFixture
+
+from inperso.data_acquisition.scheduler import AdaptiveConcurrencyLimit, RequestScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def monotonic(self) -> float:
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds: float) -> None:
+        with self.lock:
+            self.now += seconds
+
+
+def get_response(status_code: int, headers: dict[str, str] = {}) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    return response
+
+
+def test_token_bucket(mocker: MockFixture):
+    """Ensure requests are sent at the rate of the bucket after a burst, and none are sent while it is paused."""
+
+    clock = FakeClock()
+    mocker.patch("inperso.data_acquisition.scheduler.time", clock)
+
+    bucket = TokenBucket(requests_per_second=10, burst=5)
+
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.now == 0
+
+    for _ in range(20):
+        bucket.acquire()
+    assert abs(clock.now - 2.0) < 1e-9
+
+    bucket.pause(30)
+    bucket.acquire()
+    assert clock.now >= 32.0
+
+
+def test_request_scheduler_throttled(mocker: MockFixture):
+    """Ensure throttled requests are sent again after their Retry-After delay, and lower the concurrency."""
+
+    clock = FakeClock()
+    mocker.patch("inperso.data_acquisition.scheduler.time", clock)
+
+    scheduler = RequestScheduler(
+        requests_per_second=1000,
+        burst=1000,
+        max_concurrency=8,
+        throttle_status_codes=[400, 429],
+        max_retries=6,
+    )
+    lock = threading.Lock()
+    n_sent = [0]
+
+    def send_request() -> requests.Response:
+        with lock:
+            n_sent[0] += 1
+            n = n_sent[0]
+
+        if n <= 4:
+            return get_response(429, {"Retry-After": "7"})
+        if n <= 6:
+            return get_response(400)
+        return get_response(200)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: scheduler.send(send_request), range(32)))
+
+    assert [response.status_code for response in responses] == [200] * 32
+    assert n_sent[0] == 32 + 6
+    assert clock.now >= 7
+
+    # Always throttled: the last response is returned after max_retries
+    response = scheduler.send(lambda: get_response(429))
+    assert response.status_code == 429
+
+
+def test_adaptive_concurrency_limit(mocker: MockFixture):
+    """Ensure the limit is halved once per throttling event, and increased by one after a window of successes."""
+
+    clock = FakeClock()
+    mocker.patch("inperso.data_acquisition.scheduler.time", clock)
+
+    concurrency = AdaptiveConcurrencyLimit(initial=8, minimum=1, maximum=8)
+    started_at = [concurrency.acquire() for _ in range(8)]
+    clock.sleep(1)
+
+    for t in started_at:
+        concurrency.on_throttle(t)
+        concurrency.release()
+    assert concurrency.limit == 4
+
+    for _ in range(4):
+        concurrency.on_success()
+    assert concurrency.limit == 5
+
+    concurrency.on_throttle(concurrency.acquire())
+    concurrency.release()
+    assert concurrency.limit == 2
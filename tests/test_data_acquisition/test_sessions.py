@@ -0,0 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from inperso.data_acquisition.sessions import TimeoutSession
+from tests.test_data_acquisition.conftest import StubServer
+
+
+def test_session_reuses_connections(stub_server: StubServer):
+    """Ensure concurrent requests of a shared session reuse at most pool_maxsize connections."""
+
+    stub_server.routes["/"] = lambda request: (200, {"ok": True})
+    session = TimeoutSession(timeout_seconds=5, pool_maxsize=4)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(lambda _: session.get(stub_server.url), range(100)))
+
+    assert all(response.json() == {"ok": True} for response in responses)
+    assert all(response.headers["Content-Encoding"] == "gzip" for response in responses)
+    assert 1 <= stub_server.n_connections <= 4
+    session.close()
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pytest_mock import MockFixture
+
+from inperso import config
+from inperso.database import client
+
+
+def test_get_client_shared(mocker: MockFixture):
+    """Ensure one client is created per configuration, even when requested from many threads."""
+
+    mocker.patch.dict(config.db, {"host": "http://localhost:8086", "token": "token", "org": "org"})
+    mocker.patch.object(client, "_clients", {})
+    client_class_mock = mocker.patch.object(client, "InfluxDBClient", side_effect=lambda **kwargs: mocker.Mock())
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        clients = list(executor.map(lambda _: client.get_client(), range(100)))
+
+    assert client_class_mock.call_count == 1
+    assert all(c is clients[0] for c in clients)
+
+    mocker.patch.dict(config.db, {"token": "other_token"})
+    assert client.get_client() is not clients[0]
+    assert client_class_mock.call_count == 2
+
+    client.close_clients()
+    clients[0].close.assert_called_once()
@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+
+from inperso.database.flux import FluxQuery
+
+
+def test_flux_query():
+    """Ensure queries are immutable, with filters merged and rendered in a canonical order."""
+
+    base = FluxQuery("bucket").range(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    query = base.filter("_field", ["co2", "temp"]).filter("device", ["b", "a"]).filter("_measurement", ["uhoo"])
+    same_query = (
+        base.filter("_measurement", ["uhoo"])
+        .filter("device", ["a", "b", "c"])
+        .filter("_field", ["temp", "co2", "pm25"])
+    )
+    same_query = same_query.filter("device", ["a", "b"]).filter("_field", ["temp", "co2"])
+
+    assert str(base) == 'from(bucket:"bucket")|> range(start: 1704067200, stop: now())'
+    assert str(query) == str(same_query)
+    assert query == same_query
+    assert str(query) == (
+        'from(bucket:"bucket")|> range(start: 1704067200, stop: now())'
+        '|> filter(fn: (r) => r["_measurement"] == "uhoo")'
+        '|> filter(fn: (r) => r["device"] == "a" or r["device"] == "b")'
+        '|> filter(fn: (r) => r["_field"] == "co2" or r["_field"] == "temp")'
+    )
+
+    query = query.exclude("_measurement", ["qualtrics"]).pipe("last()").keep(["_time", "device"]).filter("x", None)
+    assert str(query).endswith(
+        '|> filter(fn: (r) => r["_measurement"] == "uhoo")'
+        '|> filter(fn: (r) => r["_measurement"] != "qualtrics")'
+        '|> filter(fn: (r) => r["device"] == "a" or r["device"] == "b")'
+        '|> filter(fn: (r) => r["_field"] == "co2" or r["_field"] == "temp")'
+        '|> last()|> keep(columns: ["_time", "device"])'
+    )
+    assert str(base.filter("device", ["a"]).filter("device", ["b"])).endswith("|> filter(fn: (r) => false)")
@@ -0,0 +1,24 @@
+import pytest
+from pytest_mock import MockFixture
+
+from inperso import config
+from inperso.database import read
+
+
+def test_query_stream_retries(mocker: MockFixture):
+    """Ensure a failed stream is retried before its first record, and raises once the retries are exhausted."""
+
+    mocker.patch.dict(config.db, {"query_retry_delay_seconds": 0, "maximum_query_retries": 2})
+    query_api = mocker.Mock()
+    mocker.patch.object(read, "get_query_api", return_value=query_api)
+
+    query_api.query_stream.side_effect = [RuntimeError("timeout"), iter(["record_1", "record_2"])]
+    assert list(read.query_stream("query")) == ["record_1", "record_2"]
+
+    query_api.query_stream.side_effect = RuntimeError("unavailable")
+    records = read.query_stream("query")
+
+    with pytest.raises(RuntimeError, match="after 2 attempts"):
+        next(records)
+
+    assert query_api.query_stream.call_count == 4
@@ -0,0 +1,160 @@
+import time
+
+from pytest_mock import MockFixture
+
+from inperso import config
+from inperso.database.write import BatchWriter
+
+
+def test_batch_writer(mocker: MockFixture):
+    """Ensure queries are written in batches per bucket, retried, and counted."""
+
+    mocker.patch.dict(config.db, {"query_retry_delay_seconds": 0, "maximum_query_retries": 3})
+    write_api = mocker.Mock()
+    write_api.write.side_effect = [None, RuntimeError("timeout"), None, None, None]
+    mocker.patch("inperso.database.write.get_write_api", return_value=write_api)
+
+    with BatchWriter(batch_size=3, flush_interval_seconds=60) as batch_writer:
+        batch_writer.write([{"time": i} for i in range(4)])
+        batch_writer.write([{"time": i} for i in range(2)], use_atlas_index_bucket=True)
+        batch_writer.flush()
+
+        assert batch_writer.points_written == 6
+        assert batch_writer.points_retried == 1
+
+        batch_writer.write([{"time": 10}])
+
+    assert batch_writer.points_written == 7
+    assert batch_writer.points_dropped == 0
+    assert batch_writer.closed
+
+    calls = [(call.kwargs["bucket"], len(call.kwargs["record"])) for call in write_api.write.call_args_list]
+    assert calls == [
+        (config.db["bucket"], 3),
+        (config.db["bucket"], 1),
+        (config.db["bucket"], 1),
+        (config.db["bucket_atlas_index"], 2),
+        (config.db["bucket"], 1),
+    ]
+
+
+def test_batch_writer_drops_after_retries(mocker: MockFixture):
+    mocker.patch.dict(config.db, {"query_retry_delay_seconds": 0, "maximum_query_retries": 2})
+    write_api = mocker.Mock()
+    write_api.write.side_effect = RuntimeError("unavailable")
+    mocker.patch("inperso.database.write.get_write_api", return_value=write_api)
+
+    with BatchWriter(batch_size=10) as batch_writer:
+        batch_writer.write([{"time": i} for i in range(5)])
+
+    assert batch_writer.points_written == 0
+    assert batch_writer.points_retried == 5
+    assert batch_writer.points_dropped == 5
+
+
+def test_batch_writer_periodic_flush(mocker: MockFixture):
+    """Ensure partial batches are written every flush interval, even while writes keep arriving."""
+
+    n_handled = 0
+    n_handled_at_writes: list[int] = []
+    write_api = mocker.Mock()
+    write_api.write.side_effect = lambda **kwargs: n_handled_at_writes.append(n_handled)
+    mocker.patch("inperso.database.write.get_write_api", return_value=write_api)
+    write_buffer = BatchWriter._write_buffer
+
+    def write_buffer_slowly(self, bucket: str, buffer: list, flush: bool) -> None:
+        nonlocal n_handled
+
+        if not flush:
+            time.sleep(0.005)  # Slower than the writes, so that the queue is never empty
+            n_handled += 1
+
+        write_buffer(self, bucket, buffer, flush)
+
+    mocker.patch.object(BatchWriter, "_write_buffer", write_buffer_slowly)
+
+    with BatchWriter(batch_size=1000, flush_interval_seconds=0.05) as batch_writer:
+        for i in range(100):
+            batch_writer.write([{"time": i}])
+
+    assert batch_writer.points_written == 100
+    assert n_handled_at_writes[0] < 50
+
+
+def test_encode_query_matches_client():
+    """Ensure the line protocol encoding matches the one of the influx client."""
+
+    from datetime import datetime, timezone
+
+    from influxdb_client import Point, WritePrecision
+
+    from inperso.database.write import encode_query
+
+    queries = [
+        {
+            "measurement": "uhoo",
+            "tags": {"device": "Room 1, floor=2", "floor": 2, "location": None, "latitude": 46.5},
+            "fields": {
+                "temperature": 21.5,
+                "co2": 800.0,
+                "count": 3,
+                "ok": True,
+                "note": 'a "b" \\ c',
+                "nan": float("nan"),
+            },
+            "time": datetime(2024, 1, 1, 12, 30, 15, 900000, tzinfo=timezone.utc),
+        },
+        {
+            "measurement": "qualtrics",
+            "tags": {"survey": "Survey A", "response_id": "R_1"},
+            "fields": {"QID1": "answer", "QID2_3": True},
+            "time": 1704067200,
+        },
+        {
+            "measurement": "airthings",
+            "tags": {"device": "a"},
+            "fields": {"temperature": None},
+            "time": 1704067200,
+        },
+    ]
+
+    for query in queries:
+        expected = Point.from_dict(query, write_precision=WritePrecision.S).to_line_protocol()
+        assert encode_query(query) == expected.encode()
+
+
+def test_encode_data_frame_matches_encode_query():
+    """Ensure DataFrames are encoded like one query per row, skipping missing values and rows without fields."""
+
+    import numpy as np
+    import pandas as pd
+
+    from inperso.database.write import encode_data_frame, encode_query
+
+    df = pd.DataFrame(
+        {
+            "time": pd.date_range("2024-01-01", periods=4, freq="1h", tz="UTC"),
+            "unit_number": ["1.1", "2 2", "1.1", "3,3"],
+            "iaq": [1.0, np.nan, 2.5, np.inf],
+            "lux": [3.25, np.nan, 1e20, 0.1],
+            "count": [1, 2, 3, 4],
+        }
+    )
+
+    lines = encode_data_frame(df, "index", ["lux", "iaq"], ["unit_number"], {"atlas_index_hash": "abc"})
+    expected = [
+        encode_query(
+            {
+                "measurement": "index",
+                "tags": {"unit_number": row["unit_number"], "atlas_index_hash": "abc"},
+                "fields": {"iaq": row["iaq"], "lux": row["lux"]},
+                "time": row["time"].to_pydatetime(),
+            }
+        )
+        for _, row in df.iterrows()
+    ]
+    assert lines == [line for line in expected if line]
+    assert len(lines) == 3
+
+    lines = encode_data_frame(df, "index", ["count"])
+    assert lines == [f"index count={i + 1}i {1704067200 + 3600 * i}".encode() for i in range(4)]
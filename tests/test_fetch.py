@@ -0,0 +1,250 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+from pytest_mock import MockFixture
+
+from inperso import config
+from inperso.fetch import _get_fetch_query, fetch, fetch_atlas_index, iter_fetch
+
+
+def test_fetch_dataframe(mocker: MockFixture):
+    """Ensure the DataFrame output is renamed, categorical and uses unique field synonyms."""
+
+    time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    raw = pd.DataFrame(
+        {
+            "result": "_result",
+            "table": [0, 0, 1, 2],
+            "_time": [time] * 4,
+            "_measurement": ["uhoo", "uhoo", "airthings", "uhoo"],
+            "device": ["a", "a", "b", "a"],
+            "_field": ["temp", "ozone", "temperature", "co2"],
+            "_value": [21.0, 30.0, 22.0, 800.0],
+        }
+    )
+    mocker.patch("inperso.fetch.query_data_frame", return_value=raw)
+
+    df = fetch(output="dataframe")
+
+    assert list(df.columns) == ["time", "brand", "device", "field", "value"]
+    for column in ["brand", "device", "field"]:
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    assert list(df["field"]) == ["temperature", "o3", "temperature", "co2"]
+    assert sorted(df["field"].cat.categories) == ["co2", "o3", "temperature"]
+    assert list(df["value"]) == [21.0, 30.0, 22.0, 800.0]
+
+
+def test_fetch_dataframe_empty(mocker: MockFixture):
+    """Ensure an empty result gives an empty DataFrame with the expected columns."""
+
+    mocker.patch("inperso.fetch.query_data_frame", return_value=pd.DataFrame())
+
+    df = fetch_atlas_index(output="dataframe")
+
+    assert len(df) == 0
+    assert list(df.columns) == ["time", "unit_number", "category", "value"]
+
+
+def test_fetch_invalid_output():
+    with pytest.raises(ValueError):
+        fetch(output="arrow")  # type: ignore
+
+
+def test_iter_fetch(mocker: MockFixture):
+    """Ensure records are lazily formatted, with unique field synonyms, and optionally batched."""
+
+    time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    records = [
+        mocker.Mock(
+            values={
+                "result": "_result",
+                "table": 0,
+                "_time": time,
+                "_measurement": "uhoo",
+                "device": "a",
+                "_field": field,
+                "_value": i,
+            }
+        )
+        for i, field in enumerate(["temp", "co2", "ozone", "co2", "temp"])
+    ]
+    query_stream_mock = mocker.patch("inperso.fetch.query_stream", side_effect=lambda _: iter(records))
+
+    values = iter_fetch(brands=["uhoo"])
+    first = next(values)
+    assert first == {"time": time, "brand": "uhoo", "device": "a", "field": "temperature", "value": 0}
+    assert [value["field"] for value in values] == ["co2", "o3", "co2", "temperature"]
+
+    batches = list(iter_fetch(brands=["uhoo"], batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert query_stream_mock.call_count == 2
+
+
+def test_fetch_cache(mocker: MockFixture):
+    """Ensure closed partitions are served from the cache, and the open one is queried every time."""
+
+    now = datetime.now(timezone.utc)
+    datetime_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def fake_query_data_frame(query_str: str) -> pd.DataFrame:
+        # One point at the start of each day of the queried range
+        timestamps = [int(value) for value in re.findall(r"range\(start: (\d+), stop: (\d+)\)", query_str)[0]]
+        times = pd.date_range(pd.Timestamp(timestamps[0], unit="s", tz="UTC"), periods=3, freq="1D")
+        return pd.DataFrame(
+            {
+                "_time": times,
+                "unit_number": "1-25",
+                "_field": "atlas_index",
+                "_value": [float(t.day) for t in times],
+            }
+        )
+
+    query_mock = mocker.patch("inperso.fetch.query_data_frame", side_effect=fake_query_data_frame)
+
+    df = fetch_atlas_index(
+        datetime_start, datetime(2024, 3, 2, tzinfo=timezone.utc), output="dataframe", use_cache=True
+    )
+    assert query_mock.call_count == 3
+    assert list(df["time"].dt.strftime("%m-%d")) == ["01-01", "01-02", "01-03", "02-01", "02-02", "02-03", "03-01"]
+    assert isinstance(df["unit_number"].dtype, pd.CategoricalDtype)
+
+    records = fetch_atlas_index(datetime_start, datetime(2024, 3, 2, tzinfo=timezone.utc), use_cache=True)
+    assert query_mock.call_count == 3
+    assert records == df.to_dict("records")
+
+    # Partitions still open are always queried
+    for expected_call_count in [4, 5]:
+        fetch_atlas_index(now.replace(day=1, hour=0, minute=0, second=0), use_cache=True)
+        assert query_mock.call_count == expected_call_count
+
+    # A new ATLAS index configuration invalidates the cache
+    mocker.patch("inperso.config.atlas_index_hash", "0000000")
+    fetch_atlas_index(datetime_start, datetime(2024, 3, 2, tzinfo=timezone.utc), use_cache=True)
+    assert query_mock.call_count == 5 + 3
+
+    # Moving averages over overlapping windows are not cached
+    fetch_atlas_index(
+        datetime_start, datetime(2024, 3, 2, tzinfo=timezone.utc), "1h", "1d", output="dataframe", use_cache=True
+    )
+    assert query_mock.call_count == 9
+
+
+def test_fetch_sharded(mocker: MockFixture):
+    """Ensure long time ranges and device lists are split into queries, merged in time order."""
+
+    def fake_query_data_frame(query_str: str) -> pd.DataFrame:
+        timestamp_start = int(re.findall(r"range\(start: (\d+)", query_str)[0])
+        device = re.findall(r'r\["device"\] == "([^"]+)"', query_str)[0]
+        return pd.DataFrame(
+            {
+                "_time": [pd.Timestamp(timestamp_start, unit="s", tz="UTC")],
+                "_measurement": "uhoo",
+                "device": device,
+                "_field": "co2",
+                "_value": [400.0],
+            }
+        )
+
+    query_mock = mocker.patch("inperso.fetch.query_data_frame", side_effect=fake_query_data_frame)
+    mocker.patch.dict(config.fetch, {"shard_duration_days": 30, "devices_per_shard": 50})
+    devices = [f"device {i:03d}" for i in range(120)]
+    datetime_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    datetime_end = datetime_start + timedelta(days=95)
+
+    df = fetch(datetime_start, datetime_end, devices=devices, output="dataframe")
+
+    assert query_mock.call_count == 4 * 3
+    assert df["time"].is_monotonic_increasing
+    assert df["time"].iloc[-1] == datetime_start + timedelta(days=90)
+    assert list(df["device"].iloc[:3]) == ["device 000", "device 050", "device 100"]
+    assert isinstance(df["device"].dtype, pd.CategoricalDtype)
+
+    # Overlapping moving average windows would differ at the boundaries of the time ranges
+    fetch(datetime_start, datetime_end, "1h", "1d", devices=devices[:10], output="dataframe")
+    assert query_mock.call_count == 4 * 3 + 1
+
+
+def test_fetch_query_filters():
+    """Ensure filters are escaped equality predicates, with tag filters before field filters."""
+
+    query_str = str(
+        _get_fetch_query(
+            brands=["uhoo", "airthings"],
+            devices=["Airthings - 31", "6.6", 'Room "A"'],
+            fields=["temperature"],
+        )
+    )
+
+    assert "=~" not in query_str
+    assert '|> filter(fn: (r) => r["_measurement"] == "airthings" or r["_measurement"] == "uhoo")' in query_str
+    assert (
+        '|> filter(fn: (r) => r["device"] == "6.6" or r["device"] == "Airthings - 31" or r["device"] == "Room \\"A\\"")'
+        in query_str
+    )
+    assert '|> filter(fn: (r) => r["_field"] == "temp" or r["_field"] == "temperature")' in query_str
+    assert (
+        query_str.index('r["_measurement"] ==') < query_str.index('r["device"] ==') < query_str.index('r["_field"] ==')
+    )
+
+
+def test_fetch_aggregate(mocker: MockFixture):
+    """Ensure aggregates resample with consecutive windows, which are split into shards."""
+
+    query_mock = mocker.patch("inperso.fetch.query_data_frame", return_value=pd.DataFrame())
+    mocker.patch.dict(config.fetch, {"shard_duration_days": 30})
+    datetime_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    datetime_end = datetime_start + timedelta(days=60)
+
+    fetch(datetime_start, datetime_end, "1h", aggregate="max", output="dataframe")
+
+    assert query_mock.call_count == 2
+    query_str = query_mock.call_args.args[0]
+    assert "|> aggregateWindow(every: 1h, fn: max, createEmpty: false)" in query_str
+    assert "timedMovingAverage" not in query_str
+    assert 'r["_measurement"] != "qualtrics"' in query_str
+
+    fetch(datetime_start, datetime_end, "1h", "1h", aggregate="mean", output="dataframe")
+    assert "fn: mean" in query_mock.call_args.args[0]
+
+    with pytest.raises(ValueError):
+        fetch(datetime_start, datetime_end, "1h", "1d", aggregate="mean")
+
+    with pytest.raises(ValueError):
+        fetch(datetime_start, datetime_end, "1h", aggregate="median")
+
+    with pytest.raises(ValueError):
+        fetch(datetime_start, datetime_end, aggregate="mean")
+
+
+def test_fetch_sharded_time_order(mocker: MockFixture):
+    """Ensure records of several device shards, returned series by series by each query, are merged in time order."""
+
+    def get_shard_records(query_str: str) -> list:
+        devices = re.findall(r'r\["device"\] == "([^"]+)"', query_str)
+        times = [datetime(2024, 1, 1, hour, tzinfo=timezone.utc) for hour in range(3)]
+        values = [
+            {"_time": time, "_measurement": "uhoo", "device": device, "_field": "co2", "_value": 400.0}
+            for device in devices
+            for time in times
+        ]
+        return [mocker.Mock(records=[mocker.Mock(values=value) for value in values])]
+
+    def get_shard_data_frame(query_str: str) -> pd.DataFrame:
+        values = [record.values for table in get_shard_records(query_str) for record in table.records]
+        return pd.DataFrame(values)
+
+    mocker.patch("inperso.fetch.query", side_effect=get_shard_records)
+    mocker.patch("inperso.fetch.query_data_frame", side_effect=get_shard_data_frame)
+    mocker.patch.dict(config.fetch, {"devices_per_shard": 2})
+    datetime_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    devices = ["a", "b", "c"]
+
+    records = fetch(datetime_start, datetime_start + timedelta(hours=3), devices=devices)
+    df = fetch(datetime_start, datetime_start + timedelta(hours=3), devices=devices, output="dataframe")
+
+    assert [record["time"].hour for record in records] == [0, 0, 0, 1, 1, 1, 2, 2, 2]
+    assert [record["device"] for record in records[:3]] == ["a", "b", "c"]
+    assert df["time"].is_monotonic_increasing
+    assert list(df["device"].iloc[:3]) == ["a", "b", "c"]
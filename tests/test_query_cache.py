@@ -0,0 +1,47 @@
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from inperso.query_cache import QueryCache, get_partitions
+
+
+def test_get_partitions():
+    datetime_start = datetime(2023, 11, 15, 12, tzinfo=timezone.utc)
+    datetime_end = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+    partitions = get_partitions(datetime_start, datetime_end, "month")
+    assert [start.month for start, _ in partitions] == [11, 12, 1]
+    assert partitions[0][0] == datetime(2023, 11, 1, tzinfo=timezone.utc)
+    assert partitions[-1][1] == datetime(2024, 2, 1, tzinfo=timezone.utc)
+
+    partitions = get_partitions(datetime_start, datetime_end, "day")
+    assert len(partitions) == 48
+    assert all(end - start == partitions[0][1] - partitions[0][0] for start, end in partitions)
+
+    with pytest.raises(ValueError):
+        get_partitions(datetime_start, datetime_end, "week")  # type: ignore
+
+
+def test_query_cache_eviction(tmp_path):
+    """Ensure the least recently used files are removed when the cache is too large."""
+
+    df = pd.DataFrame({"value": range(1000)})
+    cache = QueryCache(str(tmp_path), max_size_bytes=10**9)
+    keys = [cache.get_key("fetch", f"query {i}") for i in range(3)]
+
+    for i, key in enumerate(keys):
+        cache.put(key, df)
+        os.utime(os.path.join(tmp_path, f"{key}.pkl"), (i, i))
+
+    pd.testing.assert_frame_equal(cache.get(keys[0]), df)  # Now the most recently used
+    cache.max_size_bytes = 3.5 * os.path.getsize(os.path.join(tmp_path, f"{keys[0]}.pkl"))
+    cache.put(cache.get_key("fetch", "query 3"), df)
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+
+    cache.clear()
+    assert cache.get(keys[0]) is None